@@ -0,0 +1,156 @@
+import argparse
+import asyncio
+import resource
+import time
+import tracemalloc
+
+from sqlalchemy.sql import text
+
+from benchmarks.mock_node import MockNode, SyntheticChain
+from ethereum_proxy_etl import detect, stream
+from ethereum_proxy_etl.provider import NodeProviderPool
+from ethereum_proxy_etl.stream import markers
+from ethereum_proxy_etl.update import update_existing_async
+
+# Scenarios needing a database, they write synthetic rows to public.contracts
+# and proxy_contracts of the configured database and remove them afterwards
+DB_SCENARIOS = ('stream', 'update')
+
+
+def peak_memory() -> str:
+    # With tracemalloc, the peak of Python allocations since the last reset,
+    # which covers one scenario. Otherwise the peak RSS of the process so far,
+    # which includes the scenarios before. ru_maxrss is in KiB on Linux.
+    if tracemalloc.is_tracing():
+        peak = tracemalloc.get_traced_memory()[1] / (1 << 20)
+        tracemalloc.reset_peak()
+        return f'peak allocations {peak:.0f} MB'
+    return f'process peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB'
+
+
+def report(scenario: str, rows: int, node: MockNode, elapsed: float):
+    elements = sum(node.elements.values())
+    print(f'{scenario:>8}: {rows} rows in {elapsed:.2f}s, '
+          f'{rows / elapsed:.0f} rows/s, {elements / elapsed:.0f} RPCs/s, '
+          f'{node.requests / elapsed:.1f} batches/s, {peak_memory()}')
+
+
+async def run_checks(chain: SyntheticChain) -> int:
+    rows = 0
+    for marker in markers:
+        proxies = chain.proxies[marker['name']]
+        if marker['select'] == 'bytecode':
+            keys = [chain.bytecodes[proxy] for proxy, _ in proxies]
+        else:
+            keys = [proxy for proxy, _ in proxies]
+        found = await marker['method'](keys)
+        wrong = sum(1 for (_, impl), res in zip(proxies, found) if res != impl)
+        if wrong:
+            print(f"{marker['name']}: {wrong} of {len(proxies)} wrong implementations")
+        rows += len(proxies)
+    return rows
+
+
+async def insert_contracts(engine, chain: SyntheticChain):
+    async with engine.begin() as conn:
+        await conn.execute(text(
+            "INSERT INTO public.contracts (address, bytecode, function_sighashes, block_number) "
+            "VALUES (:address, :bytecode, :function_sighashes, :block_number) "
+            "ON CONFLICT DO NOTHING"), chain.contracts)
+
+
+async def remove_contracts(engine, chain: SyntheticChain):
+    addresses = [contract['address'] for contract in chain.contracts]
+    async with engine.begin() as conn:
+        await conn.execute(text("DELETE FROM public.proxy_contracts WHERE proxy_address = ANY(:addresses)")
+                           .bindparams(addresses=addresses))
+        await conn.execute(text("DELETE FROM public.contracts WHERE address = ANY(:addresses)")
+                           .bindparams(addresses=addresses))
+        beacons = await conn.execute(text("SELECT to_regclass('public.proxy_beacons')"))
+        if beacons.scalar() is not None:
+            await conn.execute(text("DELETE FROM public.proxy_beacons WHERE proxy_address = ANY(:addresses)")
+                               .bindparams(addresses=addresses))
+        # Left over checkpoints would make follow mode continue after the synthetic blocks
+        checkpoints = await conn.execute(text("SELECT to_regclass('public.stream_checkpoints')"))
+        if checkpoints.scalar() is not None:
+            await conn.execute(text("DELETE FROM public.stream_checkpoints WHERE end_block >= :first_block")
+                               .bindparams(first_block=chain.contracts[0]['block_number']))
+
+
+async def count_proxies(engine, chain: SyntheticChain) -> int:
+    addresses = [contract['address'] for contract in chain.contracts]
+    async with engine.connect() as conn:
+        result = await conn.execute(text("SELECT COUNT(*) FROM public.proxy_contracts WHERE proxy_address = ANY(:addresses)")
+                                    .bindparams(addresses=addresses))
+        return result.scalar()
+
+
+async def benchmark_async(scenarios: list[str],
+                          proxies_per_type: int,
+                          single_pass: bool = False,
+                          **node_options):
+    chain = SyntheticChain(proxies_per_type)
+    node = MockNode(chain, **node_options)
+    url = await node.start()
+    detect.node_provider = NodeProviderPool([url])
+    print(f'Mock node on {url} with {proxies_per_type} proxies of each of {len(markers)} types')
+
+    engine = None
+    if any(scenario in DB_SCENARIOS for scenario in scenarios):
+        engine = stream.engine
+        await insert_contracts(engine, chain)
+
+    try:
+        for scenario in scenarios:
+            node.requests = 0
+            node.elements.clear()
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+            started = time.perf_counter()
+            if scenario == 'check':
+                rows = await run_checks(chain)
+            elif scenario == 'stream':
+                first_block = chain.contracts[0]['block_number']
+                last_block = chain.contracts[-1]['block_number']
+                await stream.stream_async(first_block, last_block, single_pass=single_pass)
+                rows = await count_proxies(engine, chain)
+            elif scenario == 'update':
+                await update_existing_async()
+                rows = await count_proxies(engine, chain)
+            else:
+                raise ValueError(f'Unknown scenario {scenario}')
+            report(scenario, rows, node, time.perf_counter() - started)
+    finally:
+        if engine is not None:
+            await remove_contracts(engine, chain)
+        await detect.close_resources()
+        await node.stop()
+
+
+def benchmark(scenarios: list[str], proxies_per_type: int, single_pass: bool = False, **node_options):
+    asyncio.run(benchmark_async(scenarios, proxies_per_type, single_pass, **node_options))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput of proxy detection against a local mock node')
+    parser.add_argument('scenarios', nargs='*', default=['check'], choices=['check', *DB_SCENARIOS])
+    parser.add_argument('--proxies', type=int, default=1000, help='proxies of each type')
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds per batch')
+    parser.add_argument('--element-latency', type=float, default=0.00001, help='seconds per batch element')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests failing once')
+    parser.add_argument('--overload-rate', type=float, default=0.0, help='share of batches rejected with 429')
+    parser.add_argument('--single-pass', action='store_true', help='stream in single pass mode')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='report the peak allocations of each scenario, slows the runs down')
+    args = parser.parse_args()
+    if args.trace_memory:
+        tracemalloc.start()
+    benchmark(args.scenarios, args.proxies, args.single_pass,
+              latency=args.latency,
+              element_latency=args.element_latency,
+              error_rate=args.error_rate,
+              overload_rate=args.overload_rate)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+from collections import Counter
+
+from aiohttp import web
+
+from ethereum_proxy_etl.detect import (ARA_LOGIC_SLOT, EIP_1822_LOGIC_SLOT,
+                                       EIP_1967_BEACON_SLOT,
+                                       EIP_1967_LOGIC_SLOT,
+                                       ONE_TO_ONE_LOGIC_SLOT,
+                                       OPEN_ZEPPELIN_IMPLEMENTATION_SLOT,
+                                       P_PROXY_LOGIC_SLOT)
+from ethereum_proxy_etl.stream import markers
+
+# Storage slot of the implementation of each slot based proxy type
+SLOTS = {
+    'eip_1967_direct': EIP_1967_LOGIC_SLOT,
+    'oz': OPEN_ZEPPELIN_IMPLEMENTATION_SLOT,
+    'eip_1822': EIP_1822_LOGIC_SLOT,
+    'p_proxy': P_PROXY_LOGIC_SLOT,
+    'ara': ARA_LOGIC_SLOT,
+    'one_to_one': ONE_TO_ONE_LOGIC_SLOT,
+}
+
+# Selector returning the implementation of each call based proxy type
+SELECTORS = {
+    'eip_897': '0x5c60da1b',
+    'gnosis_safe': '0xa619486e',
+    'comptroller': '0xbb82aa5e',
+    'many_to_one': '0x552079dc',
+}
+
+# Beacons return the implementation from implementation()
+BEACON_SELECTOR = '0x5c60da1b'
+
+# A real many-to-one proxy, its handler address is replaced per proxy
+MANY_TO_ONE_BYTECODE = '0x60806040523661001357610011610017565b005b6100115b61001f61002f565b61002f61002a610031565b6101b0565b565b60405160009081906060906001600160a01b037f000000000000000000000000ffde4785e980a99fe10e6a87a67d243664b91b25169083818181855afa9150503d806000811461009d576040519150601f19603f3d011682016040523d82523d6000602084013e6100a2565b606091505b50915091508181906101325760405162461bcd60e51b81526004018080602001828103825283818151815260200191508051906020019080838360005b838110156100f75781810151838201526020016100df565b50505050905090810190601f1680156101245780820380516001836020036101000a031916815260200191505b509250505060405180910390fd5b50600081806020019051602081101561014a57600080fd5b505190506001600160a01b0381166101a9576040805162461bcd60e51b815260206004820152601760248201527f4552525f4e554c4c5f494d504c454d454e544154494f4e000000000000000000604482015290519081900360640190fd5b9250505090565b3660008037600080366000845af43d6000803e8080156101cf573d6000f35b3d6000fdfea26469706673582212209b0f8ebe5564b0d1fb938189635d5a7b33088937e2d48e4ff88b4fcf7c850bb164736f6c634300060c0033'
+MANY_TO_ONE_HANDLER = 'ffde4785e980a99fe10e6a87a67d243664b91b25'
+
+ZERO_WORD = '0x' + '0' * 64
+
+
+def synthetic_address(*parts) -> str:
+    return '0x' + hashlib.blake2b('-'.join(map(str, parts)).encode(), digest_size=20).hexdigest()
+
+
+def word(addr: str) -> str:
+    return '0x' + addr[2:].rjust(64, '0')
+
+
+class SyntheticChain:
+    # proxies_per_type proxies of every proxy type of the stream markers, with
+    # their storage, call results and public.contracts rows. Beacon proxies
+    # share one beacon per ten proxies.
+
+    def __init__(self, proxies_per_type: int, block_number: int = 20000000, first_block: int = 900000000):
+        self.block_number = block_number
+        self.storage: dict[tuple[str, str], str] = {}
+        self.calls: dict[tuple[str, str], str] = {}
+        self.contracts: list[dict] = []
+        self.proxies: dict[str, list[tuple[str, str]]] = {}
+        self.bytecodes: dict[str, str] = {}
+
+        for marker in markers:
+            proxy_type = marker['name']
+            self.proxies[proxy_type] = []
+            for idx in range(proxies_per_type):
+                proxy = synthetic_address(proxy_type, idx, 'proxy')
+                # Proxies of a beacon share its implementation
+                impl_idx = idx // 10 if proxy_type == 'eip_1967_beacon' else idx
+                impl = synthetic_address(proxy_type, impl_idx, 'implementation')
+                self.add_proxy(marker, proxy, impl, idx)
+                self.proxies[proxy_type].append((proxy, impl))
+                self.contracts.append({
+                    'address': proxy,
+                    'bytecode': self.bytecodes[proxy],
+                    'function_sighashes': [marker['marker']] if marker['type'] == 'function' else [],
+                    'block_number': first_block + len(self.contracts),
+                })
+
+    def add_proxy(self, marker, proxy: str, impl: str, idx: int):
+        proxy_type = marker['name']
+        if marker['type'] == 'function':
+            bytecode = '0x6080604052'
+        elif proxy_type == 'eip_1167_minimal':
+            bytecode = '0x363d3d373d3d3d363d73' + impl[2:] + '5af43d82803e903d91602b57fd5bf3'
+        elif proxy_type == 'many_to_one':
+            handler = synthetic_address(proxy_type, idx, 'handler')
+            bytecode = MANY_TO_ONE_BYTECODE.replace(MANY_TO_ONE_HANDLER, handler[2:])
+            self.calls[(handler, SELECTORS[proxy_type])] = word(impl)
+        else:
+            bytecode = '0x6080604052' + marker['marker'] + '00'
+        self.bytecodes[proxy] = bytecode
+
+        if proxy_type in SLOTS:
+            self.storage[(proxy, SLOTS[proxy_type])] = word(impl)
+        elif proxy_type == 'eip_1967_beacon':
+            beacon = synthetic_address(proxy_type, idx // 10, 'beacon')
+            self.storage[(proxy, EIP_1967_BEACON_SLOT)] = word(beacon)
+            self.calls[(beacon, BEACON_SELECTOR)] = word(impl)
+        elif proxy_type in SELECTORS and proxy_type != 'many_to_one':
+            self.calls[(proxy, SELECTORS[proxy_type])] = word(impl)
+
+    def result(self, method: str, params: list) -> str | list:
+        if method == 'eth_blockNumber':
+            return hex(self.block_number)
+        if method == 'eth_getStorageAt':
+            return self.storage.get((params[0].lower(), params[1]), ZERO_WORD)
+        if method == 'eth_call':
+            return self.calls.get((params[0]['to'].lower(), params[0]['data'][:10]), '0x')
+        if method == 'eth_getLogs':
+            return []
+        raise KeyError(method)
+
+
+class MockNode:
+    # JSON-RPC server answering from a synthetic chain, with a latency per
+    # batch and per element. With error_rate, a share of the requests fails
+    # with a transient error the first time it is seen, and with
+    # overload_rate, a share of the batches is rejected with HTTP 429.
+
+    def __init__(self,
+                 chain: SyntheticChain,
+                 latency: float = 0.0,
+                 element_latency: float = 0.0,
+                 error_rate: float = 0.0,
+                 overload_rate: float = 0.0,
+                 seed: int = 0):
+        self.chain = chain
+        self.latency = latency
+        self.element_latency = element_latency
+        self.error_rate = error_rate
+        self.overload_rate = overload_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.elements = Counter()
+        self.failed: set[str] = set()
+        self.url: str | None = None
+        self._runner: web.AppRunner | None = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        app = web.Application(client_max_size=1 << 30)
+        app.router.add_post('/', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f'http://{host}:{port}'
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = json.loads(await request.read())
+        items = body if isinstance(body, list) else [body]
+        self.requests += 1
+        await asyncio.sleep(self.latency + self.element_latency * len(items))
+        if self.overload_rate and self.random.random() < self.overload_rate:
+            return web.Response(status=429, text='Too Many Requests')
+
+        responses = [self.respond(item) for item in items]
+        return web.json_response(responses if isinstance(body, list) else responses[0])
+
+    def respond(self, item: dict) -> dict:
+        self.elements[item['method']] += 1
+        if self.error_rate:
+            key = json.dumps([item['method'], item['params']])
+            if key not in self.failed and self.random.random() < self.error_rate:
+                self.failed.add(key)
+                return {'jsonrpc': '2.0', 'id': item['id'], 'error': {'code': -32603, 'message': 'internal error'}}
+        try:
+            result = self.chain.result(item['method'], item['params'])
+        except KeyError:
+            return {'jsonrpc': '2.0', 'id': item['id'], 'error': {'code': -32601, 'message': 'method not found'}}
+        return {'jsonrpc': '2.0', 'id': item['id'], 'result': result}
+
+
+async def serve(proxies_per_type: int, port: int, **options):
+    node = MockNode(SyntheticChain(proxies_per_type), **options)
+    url = await node.start(port=port)
+    print(f'Mock node listening on {url}')
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await node.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON-RPC node serving a synthetic chain of proxies')
+    parser.add_argument('--proxies', type=int, default=1000, help='proxies of each type')
+    parser.add_argument('--port', type=int, default=8545)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per batch')
+    parser.add_argument('--element-latency', type=float, default=0.0, help='seconds per batch element')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests failing once')
+    parser.add_argument('--overload-rate', type=float, default=0.0, help='share of batches rejected with 429')
+    args = parser.parse_args()
+    asyncio.run(serve(args.proxies, args.port,
+                      latency=args.latency,
+                      element_latency=args.element_latency,
+                      error_rate=args.error_rate,
+                      overload_rate=args.overload_rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,29 @@
 import asyncio
+import os
+import time
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from typing import Callable, Literal, TypedDict
 
-import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from db import snowflake_connection
-from detect import (check_ara_proxy, check_comptroller_proxy,
+from detect import (FAILED, check_ara_proxy, check_comptroller_proxy,
                     check_eip_897_proxy, check_eip_1167_minimal_proxy,
                     check_eip_1822_proxy, check_eip_1967_beacon_proxy,
                     check_eip_1967_direct_proxy, check_gnosis_safe_proxy,
                     check_many_to_one_proxy, check_one_to_one_proxy,
                     check_oz_proxy, check_p_proxy_proxy)
-from pandas import DataFrame
+from insert import BACKFILL_DIR, BATCH_SCHEMA
+from metrics import (DB_FETCH, DB_WRITE, ROWS, STAGE_LATENCY, MetricsExporter,
+                     timed_get, timed_put)
 
 conn = snowflake_connection()
 
+# Parquet file of each proxy type, every batch is appended as a row group
+writers: dict[str, pq.ParquetWriter] = {}
+
 # sem = asyncio.Semaphore(10)
 queue = asyncio.Queue(maxsize=4)
 
@@ -61,8 +70,21 @@ markers: list[Marker] = [
 ]
 
 
-async def handle_batch(id: str, proxy_type: str, check_proxy: Callable[[str], str], df: DataFrame):
-    print(f"processing {id} - {len(df)}")
+def get_writer(proxy_type: str) -> pq.ParquetWriter:
+    if proxy_type not in writers:
+        os.makedirs(BACKFILL_DIR, exist_ok=True)
+        writers[proxy_type] = pq.ParquetWriter(os.path.join(BACKFILL_DIR, f'{proxy_type}.parquet'), BATCH_SCHEMA)
+    return writers[proxy_type]
+
+
+def close_writers():
+    for writer in writers.values():
+        writer.close()
+    writers.clear()
+
+
+async def handle_batch(id: str, proxy_type: str, check_proxy: Callable[[str], str], table: pa.Table):
+    print(f"processing {id} - {table.num_rows}")
 
     async def check_proxy_no_err(key: str):
         try:
@@ -70,7 +92,8 @@ async def handle_batch(id: str, proxy_type: str, check_proxy: Callable[[str], st
         except ValueError as err:
             return None
 
-    keys = list(df['KEY'])
+    keys = table.column('KEY').to_pylist()
+    ROWS.inc(proxy_type, 'candidate', amount=len(keys))
     # print(len(keys))
     try:
         proxy_addr = await check_proxy_no_err(keys)
@@ -80,32 +103,43 @@ async def handle_batch(id: str, proxy_type: str, check_proxy: Callable[[str], st
         print(err)
         raise err
 
-    new_df = df[['ADDRESS']].copy().rename(columns={
-        'ADDRESS': 'proxy_address'
-    })
-
-    new_df['proxy_type'] = proxy_type
-
-    proxy_addr = pd.Series(proxy_addr)
-    new_df['implementation_address'] = proxy_addr.values
-    new_df['updated_at'] = updated_at
-    new_df = new_df.dropna()
-    new_df.to_csv(f'batch-{id}.csv', index=False)
-    print(f'batch-{id}.csv is written. Processed {len(df)}.')
+    if proxy_addr is None:
+        proxy_addr = [None] * len(keys)
+    failed = sum(addr is FAILED for addr in proxy_addr)
+    if failed:
+        # Not written, so they are found again by the next backfill
+        print(f'Failed to check {failed} contracts of batch-{id}')
+        ROWS.inc(proxy_type, 'failed', amount=failed)
+    implementation_address = pa.array([None if addr is FAILED else addr for addr in proxy_addr], pa.string())
+    found = pc.is_valid(implementation_address)
+    proxy_address = table.column('ADDRESS').cast(pa.string()).filter(found)
+    new_table = pa.table([
+        proxy_address,
+        pa.array([proxy_type] * len(proxy_address), pa.string()),
+        implementation_address.filter(found),
+        pa.array([updated_at] * len(proxy_address), pa.string()),
+    ], schema=BATCH_SCHEMA)
+    ROWS.inc(proxy_type, 'proxy', amount=new_table.num_rows)
+    started = time.perf_counter()
+    get_writer(proxy_type).write_table(new_table)
+    DB_WRITE.observe(time.perf_counter() - started, 'parquet')
+    print(f'batch-{id} is written to {proxy_type}.parquet. Processed {table.num_rows}.')
 
 
 async def worker():
     print('Starting worker')
     while True:
-        args = await queue.get()
+        args = await timed_get(queue, 'detect')
+        started = time.perf_counter()
         try:
             await handle_batch(*args)
+            STAGE_LATENCY.observe(time.perf_counter() - started, 'detect')
         except Exception as err:
             print('Got exception when processing batch')
             print(err)
             id = args[0]
-            df = args[-1]
-            df.to_csv(f'error-{id}.csv')
+            table = args[-1]
+            pq.write_table(table, f'error-{id}.parquet')
         finally:
             queue.task_done()
 
@@ -120,24 +154,33 @@ async def execute_marker(executor: ThreadPoolExecutor, marker: Marker):
     elif marker['type'] == 'function':
         cur.execute(
             f"SELECT {marker['select']} as key, address FROM ETHEREUM_V2.CORE_RAW.CONTRACTS WHERE ARRAY_CONTAINS('{marker['marker']}'::variant, SPLIT(TRIM(FUNCTION_SIGHASHES, '{{}}'), ',')) AND BLOCK_NUMBER <= 17690000")
-    batches = await loop.run_in_executor(executor, cur.fetch_pandas_batches)
+    started = time.perf_counter()
+    batches = await loop.run_in_executor(executor, cur.fetch_arrow_batches)
     for idx, batch in enumerate(batches):
-        await queue.put((f"{marker['name']}-{idx}", marker['name'], marker['method'], batch))
+        DB_FETCH.observe(time.perf_counter() - started, marker['name'])
+        await timed_put(queue, 'detect', (f"{marker['name']}-{idx}", marker['name'], marker['method'], batch))
         print(f"added {marker['name']}-{idx} to queue")
+        started = time.perf_counter()
 
 
 async def main(executor: ThreadPoolExecutor):
     workers = [asyncio.create_task(worker()) for _ in range(1)]
+    exporter = MetricsExporter()
+    await exporter.start()
 
-    async with asyncio.TaskGroup() as tg:
-        for marker in markers:
-            tg.create_task(execute_marker(executor, marker))
-
-    await queue.join()
-
-    for task in workers:
-        task.cancel()
-    await asyncio.gather(*workers, return_exceptions=True)
+    try:
+        async with asyncio.TaskGroup() as tg:
+            for marker in markers:
+                tg.create_task(execute_marker(executor, marker))
+
+        await queue.join()
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await exporter.stop()
+        # A parquet file is only readable once its writer wrote the footer
+        close_writers()
 
 
 def backfill():
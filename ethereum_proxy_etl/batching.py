@@ -0,0 +1,246 @@
+import asyncio
+import random
+from typing import Any, Awaitable, Callable
+
+from aiohttp import ClientError, ClientResponseError
+
+from .deadletter import dead_letters
+from .env import RPC_RETRIES, RPC_RETRY_BACKOFF
+from .metrics import RPC_ERRORS, RPC_RETRIED
+from .provider import (BatchTooLargeError, RPCBatchError, RPCOverloadError,
+                       is_overload_error)
+
+# Max no of chunks of one list call in flight at a time
+BATCH_CONCURRENCY = 10
+
+
+class AdaptiveBatchSizer:
+    # Grows the batch size while batches come back faster than the target latency,
+    # shrinks it when they are slow or fail, and lowers the ceiling when the node
+    # rejects a batch as too large.
+
+    def __init__(self,
+                 initial_size: int = 100,
+                 min_size: int = 1,
+                 max_size: int = 1000,
+                 target_latency: float = 1.0):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self._size = float(initial_size)
+
+    @property
+    def size(self) -> int:
+        return max(self.min_size, min(self.max_size, int(self._size)))
+
+    def record_success(self, size: int, latency: float):
+        # Only batches of at least the current size tell us something about it
+        if size < self.size:
+            return
+        if latency <= self.target_latency:
+            self._size = min(self.max_size, self._size + max(1, self._size * 0.1))
+        else:
+            self._size = max(self.min_size, self._size * self.target_latency / latency)
+
+    def record_error(self):
+        self._size = max(self.min_size, self._size / 2)
+
+    def record_too_large(self, size: int):
+        self.max_size = max(self.min_size, min(self.max_size, size // 2))
+        self._size = min(self._size, self.max_size)
+
+
+batch_sizers = {
+    'eth_getStorageAt': AdaptiveBatchSizer(initial_size=100, max_size=1000, target_latency=1.0),
+    'eth_call': AdaptiveBatchSizer(initial_size=100, max_size=500, target_latency=2.0),
+}
+
+
+def get_batch_sizer(method: str) -> AdaptiveBatchSizer:
+    if method not in batch_sizers:
+        batch_sizers[method] = AdaptiveBatchSizer()
+    return batch_sizers[method]
+
+
+def record_batch_latency(method: str, size: int, latency: float):
+    # Called by the provider pool with the round trip of a batch to the node,
+    # which leaves out waits for the governor and retry backoffs
+    get_batch_sizer(method).record_success(size, latency)
+
+
+async def run_batched(method: str, items: list, fetch: Callable[[list], Awaitable[list]]) -> list:
+    # Splits items into chunks sized by the method's sizer and returns the
+    # concatenated results of fetch(chunk) in the order of items. The sizer
+    # grows from the node latencies given to record_batch_latency.
+    sizer = get_batch_sizer(method)
+    results: list[Any] = [None] * len(items)
+
+    async def run(start: int, chunk: list):
+        try:
+            res = await fetch(chunk)
+        except BatchTooLargeError:
+            if len(chunk) <= 1:
+                raise
+            sizer.record_too_large(len(chunk))
+            res = await run_batched(method, chunk, fetch)
+        except Exception:
+            sizer.record_error()
+            raise
+        results[start:start + len(chunk)] = res
+
+    tasks = set()
+    try:
+        offset = 0
+        while offset < len(items):
+            if len(tasks) >= BATCH_CONCURRENCY:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+            chunk = items[offset:offset + sizer.size]
+            tasks.add(asyncio.create_task(run(offset, chunk)))
+            offset += len(chunk)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    return results
+
+
+# Errors of a whole batch request worth retrying
+TRANSIENT_BATCH_ERRORS = (ClientError, asyncio.TimeoutError, RPCBatchError)
+
+
+def is_element_batch_error(error: Exception) -> bool:
+    # The node answered but rejected the batch, which may be caused by some of
+    # its elements. An unreachable or overloaded node fails any batch alike.
+    if isinstance(error, RPCOverloadError):
+        return False
+    if isinstance(error, RPCBatchError):
+        return True
+    return isinstance(error, ClientResponseError) and error.status >= 500
+
+
+# Messages of batch element errors worth retrying, as opposed to e.g. reverts
+TRANSIENT_ELEMENT_MESSAGES = ('timeout', 'timed out', 'header not found', 'internal error', 'try again')
+
+
+def is_transient_element_error(error: Any) -> bool:
+    if is_overload_error(error):
+        return True
+    if isinstance(error, dict):
+        if error.get('code') == -32603:
+            return True
+        error = error.get('message', '')
+    message = str(error).lower()
+    return any(part in message for part in TRANSIENT_ELEMENT_MESSAGES)
+
+
+# Messages of batch element errors of the EVM executing a call, which answer
+# the call, e.g. when a contract has no such function, as opposed to failures
+EXECUTION_ERROR_MESSAGES = ('revert', 'invalid opcode', 'out of gas', 'stack', 'invalid jump', 'vm execution error')
+
+
+def is_execution_error(error: Any) -> bool:
+    if isinstance(error, dict):
+        if error.get('code') == 3:
+            return True
+        error = error.get('message', '')
+    message = str(error).lower()
+    return any(part in message for part in EXECUTION_ERROR_MESSAGES)
+
+
+def backoff_delay(attempt: int) -> float:
+    # Full jitter, so that retries of concurrent batches do not line up
+    return random.uniform(0, RPC_RETRY_BACKOFF * 2 ** attempt)
+
+
+class RPCRequestFailedError(Exception):
+    pass
+
+
+class FailedResult:
+    # Result of a request that failed permanently. Falsy like a missing result,
+    # but not None, so callers can tell a failed read from 'not a proxy'.
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return 'FAILED'
+
+
+FAILED = FailedResult()
+
+
+def failed_response(error: Any) -> dict:
+    # Marked as failed, unlike errors of the request itself such as reverts
+    return {'jsonrpc': '2.0', 'id': None, 'failed': True,
+            'error': {'code': -32603, 'message': f'Failed permanently: {error!r}'}}
+
+
+def is_failed_response(response: dict) -> bool:
+    return response.get('failed', False)
+
+
+async def send_with_retry(method: str,
+                          params: list[Any],
+                          send: Callable[[list[Any]], Awaitable[list]],
+                          retries: int = RPC_RETRIES) -> list:
+    # Retries a failing batch with backoff, then splits it in half until the
+    # elements that keep failing are isolated and written to the dead letters.
+    # Errors not caused by elements, like connection errors and timeouts, are
+    # raised after the retries instead. Elements that fail with transient
+    # errors inside a successful batch are retried on their own. Returns one
+    # response per param, in order.
+    error = None
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            RPC_RETRIED.inc(method)
+            await asyncio.sleep(backoff_delay(attempt - 1))
+        try:
+            responses = await send(params)
+        except BatchTooLargeError:
+            raise
+        except TRANSIENT_BATCH_ERRORS as err:
+            error = err
+            continue
+        return await retry_failed_elements(method, params, responses, send, retries)
+
+    if not is_element_batch_error(error):
+        raise error
+
+    if len(params) > 1:
+        mid = len(params) // 2
+        left, right = await asyncio.gather(send_with_retry(method, params[:mid], send, min(retries, 1)),
+                                           send_with_retry(method, params[mid:], send, min(retries, 1)))
+        return left + right
+
+    RPC_ERRORS.inc(method, 'dead_letter')
+    dead_letters.record('rpc', method=method, params=params[0], error=repr(error))
+    return [failed_response(error)]
+
+
+async def retry_failed_elements(method: str,
+                                params: list[Any],
+                                responses: list,
+                                send: Callable[[list[Any]], Awaitable[list]],
+                                retries: int) -> list:
+    failed = [idx for idx, response in enumerate(responses)
+              if 'error' in response and is_transient_element_error(response['error'])]
+    if not failed:
+        return responses
+
+    RPC_ERRORS.inc(method, 'element', amount=len(failed))
+    if retries > 0:
+        RPC_RETRIED.inc(method, amount=len(failed))
+        await asyncio.sleep(backoff_delay(0))
+        retried = await send_with_retry(method, [params[idx] for idx in failed], send, retries - 1)
+        for idx, response in zip(failed, retried):
+            responses[idx] = response
+    else:
+        RPC_ERRORS.inc(method, 'dead_letter', amount=len(failed))
+        for idx in failed:
+            dead_letters.record('rpc', method=method, params=params[idx], error=responses[idx]['error'])
+            responses[idx] = {**responses[idx], 'failed': True}
+    return responses
@@ -0,0 +1,101 @@
+from typing import Callable, Container, Iterator
+
+# Parsers of raw runtime code, free of node and database state, so they can run
+# in worker processes. Each returns the implementation address or raises
+# ValueError when the code is not a proxy of its kind.
+
+EIP_1167_BYTECODE_PREFIX = '0x363d3d373d3d3d363d'
+EIP_1167_BYTECODE_SUFFIX = '57fd5bf3'
+EIP_1167_CODE_PREFIX = bytes.fromhex(EIP_1167_BYTECODE_PREFIX[2:])
+EIP_1167_CODE_SUFFIX = bytes.fromhex(EIP_1167_BYTECODE_SUFFIX)
+
+# No of bytes between the address and the suffix of EIP-1167 code
+EIP_1167_SUFFIX_OFFSET = 11
+
+MANY_TO_ONE_PREFIX = '0x60806040523661001357610011610017565b005b6100115b61001f61002f565b61002f61002a610031565b6101'
+MANY_TO_ONE_CODE_PREFIX = bytes.fromhex(MANY_TO_ONE_PREFIX[2:])
+
+PUSH1 = 0x60
+PUSH32 = 0x7f
+
+
+def to_code(bytecode: str) -> bytes:
+    if bytecode[:2] != '0x':
+        raise ValueError('Not a hex bytecode')
+    return bytes.fromhex(bytecode[2:])
+
+
+def parse_1167_code(code: bytes) -> str:
+    if not code.startswith(EIP_1167_CODE_PREFIX) or len(code) <= len(EIP_1167_CODE_PREFIX):
+        raise ValueError('Not an EIP-1167 bytecode')
+
+    # detect length of address (20 bytes non-optimized, 0 < N < 20 bytes for vanity addresses)
+    # push1 ... push20 use opcodes 0x60 ... 0x73
+    address_start = len(EIP_1167_CODE_PREFIX) + 1
+    address_length = code[address_start - 1] - 0x5f
+
+    if address_length < 1 or address_length > 20:
+        raise ValueError('Not an EIP-1167 bytecode')
+    address = code[address_start:address_start + address_length]
+
+    if not code[address_start + address_length + EIP_1167_SUFFIX_OFFSET:].startswith(EIP_1167_CODE_SUFFIX):
+        raise ValueError('Not an EIP-1167 bytecode')
+
+    # padStart is needed for vanity addresses
+    return '0x' + address.hex().zfill(40)
+
+
+def parse_1167_bytecode(bytecode: str) -> str:
+    return parse_1167_code(to_code(bytecode))
+
+
+def parse_many_to_one_code(code: bytes) -> str:
+    if not code.startswith(MANY_TO_ONE_CODE_PREFIX):
+        raise ValueError('Not a many-to-one bytecode')
+
+    # The handler is the first PUSH32 of a left-padded non-zero address
+    for _pc, operand in iter_push_operands(code, (32,)):
+        if not any(operand[:12]) and any(operand[12:]):
+            return '0x' + operand[12:].hex()
+
+    raise ValueError('Not a many-to-one bytecode')
+
+
+def parse_many_to_one_bytecode(bytecode: str) -> str:
+    return parse_many_to_one_code(to_code(bytecode))
+
+
+def iter_push_operands(code: bytes, sizes: Container[int] | None = None) -> Iterator[tuple[int, bytes]]:
+    # Walks the instructions of raw bytecode, skipping over push data, and yields
+    # (pc, operand) of every PUSHn with n in sizes (all if None). A push
+    # truncated by the end of the code is not yielded.
+    pc = 0
+    code_size = len(code)
+    while pc < code_size:
+        opcode = code[pc]
+        if PUSH1 <= opcode <= PUSH32:
+            size = opcode - PUSH1 + 1
+            if (sizes is None or size in sizes) and pc + size < code_size:
+                yield pc, code[pc + 1:pc + 1 + size]
+            pc += size + 1
+        else:
+            pc += 1
+
+
+# Parsers by the kind of bytecode analysis, as cached in BytecodeCache
+CODE_PARSERS: dict[str, Callable[[bytes], str]] = {
+    'eip_1167_minimal': parse_1167_code,
+    'many_to_one': parse_many_to_one_code,
+}
+
+
+def parse_codes(kind: str, codes: list[bytes]) -> list[str | None]:
+    # Runs in a worker process, None for the codes that are not proxies
+    parse = CODE_PARSERS[kind]
+    results = []
+    for code in codes:
+        try:
+            results.append(parse(code))
+        except ValueError:
+            results.append(None)
+    return results
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import sqlite3
+from collections import OrderedDict
+from typing import Any, Hashable
+
+MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: OrderedDict[Hashable, Any] = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return default
+        return self._data[key]
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+
+def bytecode_hash(bytecode: str) -> bytes:
+    return hashlib.blake2b(bytecode.encode(), digest_size=16).digest()
+
+
+class BytecodeCache:
+    # Results of analysing a bytecode, keyed by the kind of analysis and the hash
+    # of the bytecode, so identical runtime code is analysed once. Kept in memory
+    # with LRU eviction and, when a path is given, in a SQLite file across runs.
+
+    def __init__(self, max_size: int, path: str | None = None, flush_every: int = 1000):
+        self.memory = LRUCache(max_size)
+        self.path = path
+        self.flush_every = flush_every
+        self._db: sqlite3.Connection | None = None
+        self._pending: list[tuple[str, bytes, str | None]] = []
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS bytecode_results '
+                '(kind TEXT NOT NULL, hash BLOB NOT NULL, result TEXT, PRIMARY KEY (kind, hash))')
+        return self._db
+
+    def get(self, kind: str, key: bytes) -> Any:
+        result = self.memory.get((kind, key))
+        if result is not MISSING or self.path is None:
+            return result
+        row = self._connect().execute(
+            'SELECT result FROM bytecode_results WHERE kind = ? AND hash = ?', (kind, key)).fetchone()
+        if row is None:
+            return MISSING
+        self.memory.set((kind, key), row[0])
+        return row[0]
+
+    def set(self, kind: str, key: bytes, result: str | None):
+        self.memory.set((kind, key), result)
+        if self.path is not None:
+            self._pending.append((kind, key, result))
+            if len(self._pending) >= self.flush_every:
+                self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        db = self._connect()
+        with db:
+            db.executemany(
+                'INSERT OR REPLACE INTO bytecode_results (kind, hash, result) VALUES (?, ?, ?)', self._pending)
+        self._pending = []
+
+
+class CacheMissError(Exception):
+    pass
+
+
+def is_block_number(block: Any) -> bool:
+    return isinstance(block, str) and block.startswith('0x')
+
+
+class ResponseCache:
+    # Node results of requests at a block number, which cannot change, kept in
+    # a SQLite file. The oldest results are evicted once they take more than
+    # max_bytes. In replay mode a request missing from the cache fails instead
+    # of going to the node, to reproduce a run offline.
+
+    def __init__(self, path: str, max_bytes: int, replay: bool = False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.replay = replay
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS responses '
+            '(key BLOB PRIMARY KEY, result TEXT NOT NULL, size INTEGER NOT NULL)')
+        self.size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    @staticmethod
+    def cacheable(params: Any) -> bool:
+        # The block is the last param of eth_getStorageAt, eth_call and eth_getCode,
+        # the block range is in the filter of eth_getLogs
+        if not isinstance(params, list) or len(params) == 0:
+            return False
+        if isinstance(params[0], dict) and 'fromBlock' in params[0]:
+            return is_block_number(params[0]['fromBlock']) and is_block_number(params[0].get('toBlock'))
+        return is_block_number(params[-1])
+
+    @staticmethod
+    def key(method: str, params: list[Any]) -> bytes:
+        request = json.dumps([method, params], separators=(',', ':'), sort_keys=True)
+        return hashlib.blake2b(request.encode(), digest_size=16).digest()
+
+    def get_many(self, keys: list[bytes]) -> dict[bytes, Any]:
+        found = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self._db.execute(
+                f'SELECT key, result FROM responses WHERE key IN ({",".join("?" * len(chunk))})', chunk)
+            for key, result in rows:
+                found[key] = json.loads(result)
+        return found
+
+    def set_many(self, results: list[tuple[bytes, Any]]):
+        if not results:
+            return
+        rows = {}
+        for key, result in results:
+            text = json.dumps(result, separators=(',', ':'))
+            rows[key] = (key, text, len(key) + len(text))
+        # Rows replaced by the insert no longer count towards the size
+        keys = list(rows)
+        replaced = 0
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            replaced += self._db.execute(
+                f'SELECT COALESCE(SUM(size), 0) FROM responses WHERE key IN ({",".join("?" * len(chunk))})',
+                chunk).fetchone()[0]
+        with self._db:
+            self._db.executemany('INSERT OR REPLACE INTO responses (key, result, size) VALUES (?, ?, ?)', rows.values())
+        self.size += sum(row[2] for row in rows.values()) - replaced
+        if self.size > self.max_bytes:
+            self.evict(int(self.max_bytes * 0.9))
+
+    def evict(self, max_bytes: int):
+        with self._db:
+            while self.size > max_bytes:
+                rows = self._db.execute('SELECT rowid, size FROM responses ORDER BY rowid LIMIT 1000').fetchall()
+                if not rows:
+                    self.size = 0
+                    break
+                self._db.execute('DELETE FROM responses WHERE rowid <= ?', (rows[-1][0],))
+                self.size -= sum(size for _, size in rows)
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,138 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import Iterator
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .db import Base, StreamCheckpoints
+
+# No of blocks of a unit of work recorded in a checkpoint
+CHECKPOINT_BLOCKS = 100000
+
+
+def block_ranges(start_block: int, end_block: int, size: int = CHECKPOINT_BLOCKS) -> Iterator[tuple[int, int]]:
+    # Inclusive sub-ranges aligned to multiples of size, so that runs over
+    # different ranges share their units
+    unit_start = start_block
+    while unit_start <= end_block:
+        unit_end = min(end_block, (unit_start // size + 1) * size - 1)
+        yield unit_start, unit_end
+        unit_start = unit_end + 1
+
+
+def first_gap(units: list[tuple[int, int]]) -> int:
+    # First block after the units that run on without a gap from the lowest one
+    units = sorted(units)
+    covered_end = units[0][1]
+    for unit_start, unit_end in units[1:]:
+        if unit_start > covered_end + 1:
+            break
+        covered_end = max(covered_end, unit_end)
+    return covered_end + 1
+
+
+class WorkUnit:
+    # A marker over a block sub-range. It is done once all of its rows were
+    # fetched and every batch made from them went through the pipeline.
+
+    def __init__(self, marker: str, start_block: int, end_block: int):
+        self.marker = marker
+        self.start_block = start_block
+        self.end_block = end_block
+        self.pending = 0
+        self.fetched = False
+        self.failed = False
+        self.done = asyncio.Event()
+
+    def add_batch(self):
+        self.pending += 1
+
+    def finish_batch(self, failed: bool = False):
+        self.pending -= 1
+        self.failed = self.failed or failed
+        self._check_done()
+
+    def finish_fetch(self):
+        self.fetched = True
+        self._check_done()
+
+    def _check_done(self):
+        if self.fetched and self.pending == 0:
+            self.done.set()
+
+
+class Checkpoints:
+    # Records units of a stream run in stream_checkpoints once all of their
+    # batches were detected and written, so a failed run can be resumed. Units
+    # with a failed batch are not recorded and run again on resume.
+
+    def __init__(self, engine: AsyncEngine, resume: bool = False):
+        self.engine = engine
+        self.resume = resume
+        self.completed: dict[str, list[tuple[int, int]]] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def setup(self):
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all, tables=[StreamCheckpoints.__table__])
+
+    async def load(self, start_block: int, end_block: int):
+        await self.setup()
+        if not self.resume:
+            return
+        async with self.engine.connect() as conn:
+            result = await conn.execute(
+                select(StreamCheckpoints.marker, StreamCheckpoints.start_block, StreamCheckpoints.end_block)
+                .where(StreamCheckpoints.end_block >= start_block, StreamCheckpoints.start_block <= end_block))
+            for marker, unit_start, unit_end in result:
+                self.completed.setdefault(marker, []).append((unit_start, unit_end))
+
+    async def resume_block(self, markers: list[str]) -> int | None:
+        # First block all the markers have to run from again, the first gap in
+        # their checkpointed units, so units that failed are not skipped
+        units: dict[str, list[tuple[int, int]]] = {}
+        async with self.engine.connect() as conn:
+            result = await conn.execute(
+                select(StreamCheckpoints.marker, StreamCheckpoints.start_block, StreamCheckpoints.end_block)
+                .where(StreamCheckpoints.marker.in_(markers)))
+            for marker, unit_start, unit_end in result:
+                units.setdefault(marker, []).append((unit_start, unit_end))
+        if len(units) < len(markers):
+            return None
+        return min(first_gap(marker_units) for marker_units in units.values())
+
+    def is_completed(self, marker: str, start_block: int, end_block: int) -> bool:
+        return any(unit_start <= start_block and end_block <= unit_end
+                   for unit_start, unit_end in self.completed.get(marker, []))
+
+    def finish_fetch(self, unit: WorkUnit):
+        unit.finish_fetch()
+        task = asyncio.create_task(self._save_when_done(unit))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _save_when_done(self, unit: WorkUnit):
+        await unit.done.wait()
+        if unit.failed:
+            print(f'Not checkpointing {unit.marker} {unit.start_block}-{unit.end_block}, a batch failed')
+            return
+        insert_stmt = insert(StreamCheckpoints).values(
+            marker=unit.marker,
+            start_block=unit.start_block,
+            end_block=unit.end_block,
+            completed_at=datetime.now(timezone.utc).replace(tzinfo=None))
+        async with self.engine.begin() as conn:
+            await conn.execute(insert_stmt.on_conflict_do_update(
+                index_elements=['marker', 'start_block', 'end_block'],
+                set_=dict(completed_at=insert_stmt.excluded.completed_at)))
+        self.completed.setdefault(unit.marker, []).append((unit.start_block, unit.end_block))
+
+    async def wait(self):
+        await asyncio.gather(*self._tasks)
+
+    async def cancel(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
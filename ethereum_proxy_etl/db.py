@@ -1,8 +1,10 @@
 from datetime import datetime
 
 import snowflake.connector
-from sqlalchemy import TIMESTAMP, URL
-from sqlalchemy.ext.asyncio import AsyncAttrs, create_async_engine
+from sqlalchemy import TIMESTAMP, URL, BigInteger, UniqueConstraint
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import (AsyncAttrs, AsyncConnection,
+                                    create_async_engine)
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
 from .env import (POSTGRES_DATABASE, POSTGRES_HOST, POSTGRES_PASSWORD,
@@ -24,6 +26,42 @@ class ProxyContracts(Base):
     updated_at: Mapped[datetime] = mapped_column(TIMESTAMP)
 
 
+class ProxyBeacons(Base):
+    # Beacon of each eip_1967_beacon proxy, to find the proxies following a beacon that emitted Upgraded
+    __tablename__ = "proxy_beacons"
+    __table_args__ = (UniqueConstraint('proxy_address'),)
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    proxy_address: Mapped[str]
+    beacon_address: Mapped[str] = mapped_column(index=True)
+    updated_at: Mapped[datetime] = mapped_column(TIMESTAMP)
+
+
+class StreamCheckpoints(Base):
+    # Block sub-ranges of a marker that were fully streamed, marker is '*' for single pass runs
+    __tablename__ = "stream_checkpoints"
+    __table_args__ = (UniqueConstraint('marker', 'start_block', 'end_block'),)
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    marker: Mapped[str]
+    start_block: Mapped[int] = mapped_column(BigInteger)
+    end_block: Mapped[int] = mapped_column(BigInteger)
+    completed_at: Mapped[datetime] = mapped_column(TIMESTAMP)
+
+
+class ProxyImplementationHistory(Base):
+    # Implementation of a proxy from from_block to to_block, both inclusive
+    __tablename__ = "proxy_implementation_history"
+    __table_args__ = (UniqueConstraint('proxy_address', 'proxy_type', 'from_block'),)
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    proxy_address: Mapped[str]
+    proxy_type: Mapped[str]
+    implementation_address: Mapped[str]
+    from_block: Mapped[int] = mapped_column(BigInteger)
+    to_block: Mapped[int] = mapped_column(BigInteger)
+
+
 def async_engine():
     pg_url = URL(
         drivername='postgresql+asyncpg',
@@ -37,6 +75,80 @@ def async_engine():
     return create_async_engine(pg_url, echo=False)
 
 
+# When a proxy detected again under another type replaces the stored type
+PROXY_TYPE_OVERRIDE_RULE = (
+    "(proxy_contracts.proxy_type = 'eip_897' AND excluded.proxy_type = 'eip_1967_beacon') "
+    "OR (proxy_contracts.proxy_type = 'eip_1967_direct' AND excluded.proxy_type = 'eip_897')"
+)
+
+PROXY_CONTRACT_COLUMNS = ['proxy_address', 'proxy_type', 'implementation_address', 'updated_at']
+
+# Rank of the rows of one address written together, so the row that would win
+# the override rule when written one by one is kept, otherwise the first one
+PROXY_TYPE_RANK = (
+    "CASE proxy_type WHEN 'eip_1967_beacon' THEN 0 WHEN 'eip_897' THEN 1 ELSE 2 END"
+)
+
+
+async def copy_upsert_proxy_contracts(conn: AsyncConnection, rows: list[dict]):
+    # Streams rows into a session-local staging table with a binary COPY, then
+    # merges them with one INSERT ... ON CONFLICT under the same rules as the
+    # per-row upsert. Runs in the transaction of conn. Rows of several proxy
+    # types are merged by the same single statement, which locks them in
+    # address order, so concurrent writers cannot deadlock.
+    await conn.exec_driver_sql(
+        "CREATE TEMP TABLE IF NOT EXISTS proxy_contracts_staging "
+        "(seq integer, proxy_address text, proxy_type text, implementation_address text, updated_at timestamp) "
+        "ON COMMIT DELETE ROWS")
+    await conn.exec_driver_sql("TRUNCATE proxy_contracts_staging")
+    raw_conn = await conn.get_raw_connection()
+    await raw_conn.driver_connection.copy_records_to_table(
+        'proxy_contracts_staging',
+        records=[(seq, *(row[col] for col in PROXY_CONTRACT_COLUMNS)) for seq, row in enumerate(rows)],
+        columns=['seq', *PROXY_CONTRACT_COLUMNS])
+    # ON CONFLICT cannot update a row twice in one statement
+    await conn.exec_driver_sql(
+        "INSERT INTO proxy_contracts (proxy_address, proxy_type, implementation_address, updated_at) "
+        "SELECT DISTINCT ON (proxy_address) proxy_address, proxy_type, implementation_address, updated_at "
+        "FROM proxy_contracts_staging "
+        f"ORDER BY proxy_address, {PROXY_TYPE_RANK}, seq "
+        "ON CONFLICT (proxy_address) DO UPDATE SET "
+        "proxy_type = excluded.proxy_type, "
+        "implementation_address = excluded.implementation_address, "
+        "updated_at = excluded.updated_at "
+        f"WHERE {PROXY_TYPE_OVERRIDE_RULE}")
+
+
+async def copy_update_implementations(conn: AsyncConnection, rows: list[dict]):
+    # Same as copy_upsert_proxy_contracts for updates of implementation_address by id
+    await conn.exec_driver_sql(
+        "CREATE TEMP TABLE IF NOT EXISTS proxy_implementations_staging "
+        "(id bigint, implementation_address text) "
+        "ON COMMIT DELETE ROWS")
+    await conn.exec_driver_sql("TRUNCATE proxy_implementations_staging")
+    raw_conn = await conn.get_raw_connection()
+    await raw_conn.driver_connection.copy_records_to_table(
+        'proxy_implementations_staging',
+        records=[(row['id'], row['implementation_address']) for row in rows],
+        columns=['id', 'implementation_address'])
+    await conn.exec_driver_sql(
+        "UPDATE proxy_contracts "
+        "SET implementation_address = staging.implementation_address "
+        "FROM proxy_implementations_staging staging "
+        "WHERE proxy_contracts.id = staging.id")
+
+
+async def upsert_proxy_beacons(conn: AsyncConnection, rows: list[dict]):
+    # Rows of proxy_address, beacon_address and updated_at, written in address
+    # order so that concurrent writers lock them in the same order
+    insert_stmt = insert(ProxyBeacons)
+    await conn.execute(insert_stmt.on_conflict_do_update(
+        index_elements=['proxy_address'],
+        set_=dict(beacon_address=insert_stmt.excluded.beacon_address,
+                  updated_at=insert_stmt.excluded.updated_at)),
+        sorted(rows, key=lambda row: row['proxy_address']))
+
+
 def snowflake_connection():
     return snowflake.connector.connect(
         user=SNOWFLAKE_USER,
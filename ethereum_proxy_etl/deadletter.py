@@ -0,0 +1,54 @@
+import json
+import os
+import time
+from typing import Any, Iterator
+
+from .env import DEAD_LETTER_PATH
+
+
+class DeadLetterLog:
+    # Append-only JSON lines file of work that failed permanently, so it can be
+    # inspected and replayed instead of re-running whole block ranges.
+    #
+    # kind='rpc':   a batch element, with its method, params and error, whose
+    #               contract is also recorded in a 'batch' entry
+    # kind='batch': proxy addresses of a stream batch, all of a batch that
+    #               failed or only the contracts whose requests failed
+    # kind='history': a history batch, with its proxy type, block range and
+    #               proxy addresses
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def record(self, kind: str, **entry: Any):
+        line = json.dumps({'kind': kind, 'time': time.time(), **entry}, default=str)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+    def read(self, kind: str | None = None) -> Iterator[dict]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if kind is None or entry['kind'] == kind:
+                    yield entry
+
+    def take(self, kinds: set[str]) -> list[dict]:
+        # Removes and returns the entries of kinds, for a replay. The file is
+        # moved aside first, so failures of the replay are recorded anew, and
+        # the entries of other kinds are recorded again.
+        taken_path = f'{self.path}.{int(time.time())}.replayed'
+        os.rename(self.path, taken_path)
+        entries = []
+        for entry in DeadLetterLog(taken_path).read():
+            if entry['kind'] in kinds:
+                entries.append(entry)
+            else:
+                self.record(entry.pop('kind'), **entry)
+        return entries
+
+
+dead_letters = DeadLetterLog(DEAD_LETTER_PATH)
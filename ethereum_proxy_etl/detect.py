@@ -1,52 +1,137 @@
 import asyncio
+import multiprocessing
+import time
 from collections import defaultdict
-from typing import Any, cast
-
-from eth_utils import to_bytes, to_text
-from ethereum_dasm.evmdasm import Contract, EvmCode
-from web3 import AsyncHTTPProvider, AsyncWeb3, Web3
-from web3._utils.encoding import FriendlyJsonSerde
-from web3._utils.request import async_make_post_request
-from web3.types import BlockIdentifier, RPCResponse
-
-from .env import ETH_NODE_URL
-
-
-class NodeBatchProvider(AsyncHTTPProvider):
-    def encode_rpc_requests(self, method: str, params_list: list[Any]) -> bytes:
-        rpc_dict = [{
-            "jsonrpc": "2.0",
-            "method": method,
-            "params": params or [],
-            "id": next(self.request_counter),
-        } for params in params_list]
-        encoded = FriendlyJsonSerde().json_encode(rpc_dict)
-        return to_bytes(text=encoded)
-
-    def decode_rpc_responses(self, raw_response: bytes) -> list[RPCResponse]:
-        text_response = to_text(raw_response)
-        return cast(list[RPCResponse], FriendlyJsonSerde().json_decode(text_response))
-
-    async def batch_requests(self, method: str, params: list[Any]) -> list[RPCResponse]:
-        self.logger.debug(
-            f"Making request HTTP. URI: {self.endpoint_uri}, Method: {method}"
-        )
-        request_data = self.encode_rpc_requests(method, params)
-        raw_response = await async_make_post_request(
-            self.endpoint_uri, request_data, **self.get_request_kwargs()  # pylint: disable=not-a-mapping
-        )
-        response = self.decode_rpc_responses(raw_response)
-        response = sorted(response, key=lambda d: d['id'])
-        self.logger.debug(
-            f"Getting response HTTP. URI: {self.endpoint_uri}, "
-            f"Method: {method}, Response: {response}"
-        )
-        return response
-
-
-node_provider = NodeBatchProvider(ETH_NODE_URL)
-
-w3 = AsyncWeb3(provider=AsyncHTTPProvider(ETH_NODE_URL))
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable
+
+from web3.types import BlockIdentifier
+
+from .batching import (FAILED, is_execution_error, is_failed_response,
+                       record_batch_latency, run_batched, send_with_retry)
+from .bytecode import CODE_PARSERS, parse_1167_bytecode, parse_codes, to_code
+from .cache import (MISSING, BytecodeCache, LRUCache, ResponseCache,
+                    bytecode_hash, is_block_number)
+from .env import (BEACON_CACHE_SIZE, BEACON_CACHE_TTL, BYTECODE_CACHE_PATH,
+                  BYTECODE_CACHE_SIZE, BYTECODE_WORKERS, ETH_NODE_URLS,
+                  RPC_CACHE_MAX_BYTES, RPC_CACHE_PATH, RPC_CACHE_REPLAY,
+                  RPC_RESULT_CACHE_SIZE)
+from .governor import governor
+from .provider import NodeProviderPool
+
+node_provider = NodeProviderPool(
+    ETH_NODE_URLS,
+    response_cache=ResponseCache(RPC_CACHE_PATH, RPC_CACHE_MAX_BYTES, RPC_CACHE_REPLAY) if RPC_CACHE_PATH else None,
+    governor=governor,
+    batch_observer=record_batch_latency)
+
+bytecode_cache = BytecodeCache(BYTECODE_CACHE_SIZE, BYTECODE_CACHE_PATH)
+
+# Results of requests at a block number, which cannot change unlike at 'latest'
+rpc_result_cache = LRUCache(RPC_RESULT_CACHE_SIZE)
+
+# (implementation, expiry) of (beacon, block param), the expiry is None for an
+# implementation at a block number, which cannot change
+beacon_cache = LRUCache(BEACON_CACHE_SIZE)
+
+# Min no of uncached bytecodes worth sending to the process pool, fewer are parsed in the event loop
+BYTECODE_OFFLOAD_MIN = 256
+
+# No of bytecodes sent to a worker process at a time
+BYTECODE_CHUNK_SIZE = 1000
+
+bytecode_executor: ProcessPoolExecutor | None = None
+
+
+def get_bytecode_executor() -> ProcessPoolExecutor | None:
+    global bytecode_executor
+    if bytecode_executor is None and BYTECODE_WORKERS > 0:
+        # Forking a process with a running event loop, open sockets and
+        # threads is unsafe. Workers are forked from a server process that
+        # preloads the parsers, but each one still imports the __main__ module
+        # of the driver, which has to guard its run with __name__ == '__main__'.
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['ethereum_proxy_etl.bytecode'])
+        else:
+            context = multiprocessing.get_context('spawn')
+        bytecode_executor = ProcessPoolExecutor(BYTECODE_WORKERS, mp_context=context)
+    return bytecode_executor
+
+
+async def close_resources():
+    global bytecode_executor
+    await node_provider.close()
+    bytecode_cache.flush()
+    if bytecode_executor is not None:
+        bytecode_executor.shutdown()
+        bytecode_executor = None
+
+
+async def rpc_request(method: str, params: list[Any]):
+    return await governor.call(1, lambda: node_provider.make_request(method, params))
+
+
+async def rpc_batch_request(method: str, params_list: list[Any]):
+    async def send(params: list[Any]):
+        return await governor.call(len(params), lambda: node_provider.batch_requests(method, params))
+    return await send_with_retry(method, params_list, send)
+
+
+def rpc_cache_key(method: str, params: list[Any]) -> tuple | None:
+    # Only requests at a block number are cached
+    if not is_block_number(params[-1]):
+        return None
+    if method == 'eth_call':
+        return (method, params[0]['to'], params[0]['data'], params[-1])
+    return (method, *params)
+
+
+async def rpc_result(method: str, params: list[Any]) -> Any:
+    key = rpc_cache_key(method, params)
+    result = rpc_result_cache.get(key) if key is not None else MISSING
+    if result is not MISSING:
+        return result
+    res = await rpc_request(method, params)
+    result = res.get('result')
+    if key is not None and 'error' not in res:
+        rpc_result_cache.set(key, result)
+    return result
+
+
+async def rpc_batch_results(method: str, params_list: list[Any]) -> list[Any]:
+    # Results of the requests, None for calls the EVM failed to execute, served
+    # from the cache where possible. Other failed requests give FAILED, which
+    # the check APIs pass on for their proxies instead of None.
+    keys = [rpc_cache_key(method, params) for params in params_list]
+    results = [rpc_result_cache.get(key) if key is not None else MISSING for key in keys]
+    missing = [idx for idx, result in enumerate(results) if result is MISSING]
+    if missing:
+        responses = await rpc_batch_request(method, [params_list[idx] for idx in missing])
+        for idx, response in zip(missing, responses):
+            results[idx] = response.get('result')
+            if is_failed_response(response) or ('error' in response and not is_execution_error(response['error'])):
+                results[idx] = FAILED
+            elif keys[idx] is not None and 'error' not in response:
+                rpc_result_cache.set(keys[idx], results[idx])
+    return results
+
+
+async def get_block_number() -> int:
+    res = await rpc_request('eth_blockNumber', [])
+    return int(res['result'], 16)
+
+
+async def pinned_block(pin_block: int | bool) -> BlockIdentifier:
+    # The block to read node state at: the given block number, the block of the
+    # node with True, or 'latest' with False. A given block needs no request,
+    # so runs at it can be replayed from the response cache.
+    if pin_block is True:
+        return await get_block_number()
+    if pin_block is False:
+        return 'latest'
+    return pin_block
+
 
 # obtained as bytes32(uint256(keccak256('eip1967.proxy.implementation')) - 1)
 EIP_1967_LOGIC_SLOT = '0x360894a13ba1a3210667c828492db98dca3e2076cc3735a920a3ca505d382bbc'
@@ -100,42 +185,76 @@ MANY_TO_ONE_HANDLER_METHODS = [
 ]
 
 
-async def check_eip_1167_minimal_proxy(bytecode: str | list[str]):
+async def check_eip_1167_minimal_proxy(bytecode: str | list[str], _block: BlockIdentifier = 'latest'):
     if isinstance(bytecode, list):
-        addrs = []
-        for b in bytecode:
-            try:
-                addr = parse_1167_bytecode(b)
-                addrs.append(read_address(addr))
-            except ValueError:
-                addrs.append(None)
-        return addrs
+        return read_addresses(await parse_bytecodes('eip_1167_minimal', bytecode))
 
     addr = parse_1167_bytecode(bytecode)
     return read_address(addr)
 
 
-async def check_eip_1967_direct_proxy(proxy_addr: str | list[str], block: BlockIdentifier = 'latest'):
+async def check_eip_1967_direct_proxy(proxy_addr: str | list[str], block: BlockIdentifier | list[BlockIdentifier] = 'latest'):
     return await get_stored_addr_at(proxy_addr, EIP_1967_LOGIC_SLOT, block)
 
 
-async def check_eip_1967_beacon_proxy(proxy_addr: str | list[str], block: BlockIdentifier = 'latest'):
-    beacon_addr = await get_stored_addr_at(proxy_addr, EIP_1967_BEACON_SLOT, block)
+async def check_eip_1967_beacon_proxy(proxy_addr: str | list[str], block: BlockIdentifier | list[BlockIdentifier] = 'latest'):
     if isinstance(proxy_addr, list):
-        implementations = []
-        method_0 = await call_for_addr(beacon_addr, EIP_1167_BEACON_METHODS[0], block)
-        method_1 = await call_for_addr(beacon_addr, EIP_1167_BEACON_METHODS[1], block)
-        for idx, _ in enumerate(proxy_addr):
-            implementations.append(
-                method_1[idx] if method_0[idx] is None else method_0[idx])
+        _beacon_addrs, implementations = await check_eip_1967_beacon_proxies(proxy_addr, block)
         return implementations
 
+    beacon_addr = await get_stored_addr_at(proxy_addr, EIP_1967_BEACON_SLOT, block)
     try:
         return await call_for_addr(beacon_addr, EIP_1167_BEACON_METHODS[0], block)
     except:  # pylint: disable=bare-except
         return await call_for_addr(beacon_addr, EIP_1167_BEACON_METHODS[1], block)
 
 
+async def check_eip_1967_beacon_proxies(proxy_addrs: list[str], block: BlockIdentifier | list[BlockIdentifier] = 'latest'):
+    # (beacons, implementations) of the proxies, for callers keeping the beacons
+    # without reading the beacon slot again
+    beacon_addrs = await get_stored_addr_at(proxy_addrs, EIP_1967_BEACON_SLOT, block)
+    return beacon_addrs, await get_beacon_implementations(beacon_addrs, block)
+
+
+async def get_beacon_implementations(beacon_addrs: list[str | None], block: BlockIdentifier | list[BlockIdentifier] = 'latest'):
+    # Many proxies share a few beacons, so each distinct beacon is called once
+    # and its implementation reused from beacon_cache, for BEACON_CACHE_TTL
+    # seconds at 'latest'. childImplementation() is only called on beacons
+    # without an implementation().
+    requests = list(zip(beacon_addrs, block_params(block, len(beacon_addrs))))
+    now = time.monotonic()
+    implementations = {}
+    missing = []
+    for request in dict.fromkeys(requests):
+        if request[0] is None or request[0] is FAILED:
+            implementations[request] = request[0]
+            continue
+        cached = beacon_cache.get(request)
+        if cached is not MISSING and (cached[1] is None or cached[1] > now):
+            implementations[request] = cached[0]
+        else:
+            missing.append(request)
+
+    if missing:
+        method_0 = await call_for_addr([beacon for beacon, _ in missing], EIP_1167_BEACON_METHODS[0],
+                                       [block_param for _, block_param in missing])
+        resolved = dict(zip(missing, method_0))
+        fallback = [request for request, implementation in resolved.items() if implementation is None]
+        if fallback:
+            method_1 = await call_for_addr([beacon for beacon, _ in fallback], EIP_1167_BEACON_METHODS[1],
+                                           [block_param for _, block_param in fallback])
+            resolved.update(zip(fallback, method_1))
+        for request, implementation in resolved.items():
+            implementations[request] = implementation
+            if implementation is FAILED:
+                continue
+            # A missing implementation may come from a failed call, so it is not kept for good
+            fixed = implementation is not None and is_block_number(request[1])
+            beacon_cache.set(request, (implementation, None if fixed else now + BEACON_CACHE_TTL))
+
+    return [implementations.get(request) for request in requests]
+
+
 async def check_oz_proxy(proxy_addr: str, block: BlockIdentifier = 'latest'):
     return await get_stored_addr_at(proxy_addr, OPEN_ZEPPELIN_IMPLEMENTATION_SLOT, block)
 
@@ -172,159 +291,280 @@ async def check_many_to_one_proxy(bytecode: str, block: BlockIdentifier = 'lates
     is_single = isinstance(bytecode, str)
     if is_single:
         bytecode = [bytecode]
-    addrs = []
-    for b in bytecode:
-        try:
-            addr = parse_many_to_one_bytecode(b)
-            addrs.append(read_address(addr))
-        except ValueError:
-            addrs.append(None)
-    res = await call_for_addr(addrs, MANY_TO_ONE_HANDLER_METHODS[0], block)
+    addrs = await parse_bytecodes('many_to_one', bytecode)
+    res = await call_for_addr(read_addresses(addrs), MANY_TO_ONE_HANDLER_METHODS[0], block)
     if is_single:
         return res[0]
     return res
 
 
-def divide_chunks(big_list: list, chunk_size: int):
-    for i in range(0, len(big_list), chunk_size):
-        yield big_list[i:i + chunk_size]
+# Storage slot read by each slot based proxy type. For eip_1967_beacon it is the
+# slot of the beacon, which is resolved with a second round of calls.
+SLOT_PROXY_LOCATIONS = {
+    'eip_1967_direct': EIP_1967_LOGIC_SLOT,
+    'eip_1967_beacon': EIP_1967_BEACON_SLOT,
+    'oz': OPEN_ZEPPELIN_IMPLEMENTATION_SLOT,
+    'eip_1822': EIP_1822_LOGIC_SLOT,
+    'p_proxy': P_PROXY_LOGIC_SLOT,
+    'ara': ARA_LOGIC_SLOT,
+    'one_to_one': ONE_TO_ONE_LOGIC_SLOT,
+}
+
+
+async def check_slot_proxies(proxies: dict[str, list[str]],
+                             block: BlockIdentifier = 'latest') -> tuple[dict[str, list[str | None]], list[str | None]]:
+    # Reads the slots of several proxy types in shared eth_getStorageAt batches,
+    # so an address matching many markers costs one batch element per slot
+    # instead of one batch per proxy type. Returns the implementations of each
+    # proxy type and the beacons of the eip_1967_beacon proxies.
+    addr_locations = list(dict.fromkeys(
+        (addr, SLOT_PROXY_LOCATIONS[proxy_type])
+        for proxy_type, addrs in proxies.items()
+        for addr in addrs))
+    stored = dict(zip(addr_locations, await get_stored_addr_at_locations(addr_locations, block)))
+
+    results = {
+        proxy_type: [stored[(addr, SLOT_PROXY_LOCATIONS[proxy_type])] for addr in addrs]
+        for proxy_type, addrs in proxies.items()
+    }
+    beacons = results.get('eip_1967_beacon', [])
+    if beacons:
+        results['eip_1967_beacon'] = await get_beacon_implementations(beacons, block)
+    return results, beacons
+
+
+async def get_stored_addr_at(addr: str | list[str], location: str, block: BlockIdentifier | list[BlockIdentifier] = 'latest'):
+    if isinstance(addr, list):
+        return await get_stored_addr_at_locations([(a, location) for a in addr], block)
 
+    res = await rpc_result(
+        'eth_getStorageAt',
+        [to_rpc_address(addr), location, to_block_param(block)])
+    return read_address(res)
 
-async def get_stored_addr_at(addr: str | list[str], location: str, block: BlockIdentifier = 'latest'):
-    if isinstance(addr, list):
-        responses = await asyncio.gather(*[get_stored_addrs_at(chunk, location, block) for chunk in divide_chunks(addr, 100)])
-        return sum(responses, [])
 
-    res = await w3.eth.get_storage_at(
-        Web3.to_checksum_address(addr),
-        int(location, 16),
-        'latest' if not block else block)
-    return read_address(res.hex())
+async def get_stored_addr_at_locations(addr_locations: list[tuple[str, str]], block: BlockIdentifier | list[BlockIdentifier] = 'latest'):
+    requests = [(addr, location, block_param)
+                for (addr, location), block_param in zip(addr_locations, block_params(block, len(addr_locations)))]
+    return await run_batched('eth_getStorageAt', requests, get_stored_addrs_at_blocks)
+
+
+async def get_stored_addrs_at(addrs: list[str], location: str, block: BlockIdentifier | list[BlockIdentifier] = 'latest') -> list[str | None]:
+    return await get_stored_addrs_at_locations([(addr, location) for addr in addrs], block)
+
 
+async def get_stored_addrs_at_locations(addr_locations: list[tuple[str, str]], block: BlockIdentifier | list[BlockIdentifier] = 'latest') -> list[str | None]:
+    return await get_stored_addrs_at_blocks(
+        [(addr, location, block_param)
+         for (addr, location), block_param in zip(addr_locations, block_params(block, len(addr_locations)))])
 
-async def get_stored_addrs_at(addrs: list[str], location: str, block: BlockIdentifier = 'latest') -> list[str | None]:
-    responses = await node_provider.batch_requests(
+
+async def get_stored_addrs_at_blocks(requests: list[tuple[str, str, str]]) -> list[str | None]:
+    results = await rpc_batch_results(
         'eth_getStorageAt',
-        [[Web3.to_checksum_address(addr), location, 'latest' if not block else block]
-         for addr in addrs]
+        [[to_rpc_address(addr), location, block_param]
+         for addr, location, block_param in requests]
     )
 
-    storage_list = []
-    for response in responses:
-        try:
-            storage_list.append(read_address(response['result']))
-        except ValueError:
-            storage_list.append(None)
-    return storage_list
+    return read_addresses(results)
 
 
-async def call_for_addr(addr: str | list[str], data: Any, block: BlockIdentifier = 'latest'):
+async def call_for_addr(addr: str | list[str], data: Any, block: BlockIdentifier | list[BlockIdentifier] = 'latest'):
     if isinstance(addr, list):
-        responses = await asyncio.gather(*[call_for_addrs(chunk, data, block) for chunk in divide_chunks(addr, 100)])
-        return sum(responses, [])
+        requests = list(zip(addr, block_params(block, len(addr))))
+        return await run_batched('eth_call', requests, lambda chunk: call_for_addrs_at_blocks(chunk, data))
+
+    res = await rpc_result(
+        'eth_call',
+        [{
+            'to': to_rpc_address(addr),
+            'data': data
+        }, to_block_param(block)])
+    return read_address(res)
+
 
-    res = await w3.eth.call({
-        'to': Web3.to_checksum_address(addr),
-        'data': data
-    }, 'latest' if not block else block)
-    return read_address(res.hex())
+async def call_for_addrs(addrs: list[str | None], data: list[Any], block: BlockIdentifier | list[BlockIdentifier] = 'latest') -> list[str | None]:
+    return await call_for_addrs_at_blocks(list(zip(addrs, block_params(block, len(addrs)))), data)
 
 
-async def call_for_addrs(addrs: list[str | None], data: list[Any], block: BlockIdentifier = 'latest') -> list[str | None]:
+async def call_for_addrs_at_blocks(requests: list[tuple[str | None, str]], data: list[Any]) -> list[str | None]:
     index_map = defaultdict(list)
-    filtered = []
 
-    for idx, addr in enumerate(addrs):
-        if addr is None:
+    # Calls to a failed read fail too
+    results = [FAILED if request[0] is FAILED else None for request in requests]
+    for idx, request in enumerate(requests):
+        if not request[0]:
             continue
-        if addr not in filtered:
-            filtered.append(addr)
-        index_map[addr].append(idx)
+        index_map[request].append(idx)
 
-    responses = await node_provider.batch_requests(
+    if not index_map:
+        return results
+
+    filtered = list(index_map)
+    call_results = await rpc_batch_results(
         'eth_call',
         [[{
-            'to': Web3.to_checksum_address(addr),
+            'to': to_rpc_address(addr),
             'data': data
-        }, 'latest' if not block else block]
-            for addr in filtered]
+        }, block_param]
+            for addr, block_param in filtered]
     )
 
-    results = [None] * len(addrs)
-    for idx, response in enumerate(responses):
-        orig_idx = index_map[idx]
-        try:
-            if 'result' not in response:
-                raise ValueError('Invalid call')
-            for orig_idx in index_map[filtered[idx]]:
-                results[orig_idx] = read_address(response['result'])
-        except ValueError:
-            pass
+    implementations = read_addresses(call_results)
+    for request, implementation in zip(filtered, implementations):
+        for orig_idx in index_map[request]:
+            results[orig_idx] = implementation
     return results
 
 
-def read_address(addr) -> str:
-    if not isinstance(addr, str) or addr == '0x':
-        raise ValueError('Invalid address')
-
-    if len(addr) == 66:
-        addr = '0x' + addr[-40:]
+def to_block_param(block: BlockIdentifier) -> str:
+    if isinstance(block, int):
+        return hex(block)
+    return 'latest' if not block else block
 
-    if not Web3.is_address(addr):
-        raise ValueError('Invalid web3 address')
 
-    ZERO_ADDRESS = '0x0000000000000000000000000000000000000000'  # pylint: disable=invalid_name
-    if addr == ZERO_ADDRESS:
-        raise ValueError('Zero address')
+def block_params(block: BlockIdentifier | list[BlockIdentifier], count: int) -> list[str]:
+    # A list gives the block of each element, otherwise all are read at the same block
+    if isinstance(block, list):
+        return [to_block_param(b) for b in block]
+    return [to_block_param(block)] * count
 
-    return addr
 
+# obtained as keccak256("Upgraded(address)")
+UPGRADED_TOPIC = '0xbc7cd75a20ee27fd9adebab32041f755214dbc6bffa90cc0225b39da2e5c2d3b'
 
-EIP_1167_BYTECODE_PREFIX = '0x363d3d373d3d3d363d'
-EIP_1167_BYTECODE_SUFFIX = '57fd5bf3'
+# obtained as keccak256("BeaconUpgraded(address)")
+BEACON_UPGRADED_TOPIC = '0x1cf3b03a6cf19fa2baba4df148e9dcabedea7f8a5c07840e207e5c089be95d3e'
 
+# obtained as keccak256("AdminChanged(address,address)")
+ADMIN_CHANGED_TOPIC = '0x7e644d79422f17c01e4894b5f4f588d331ebfa28653d42ae832dc59e38c9798f'
 
-def parse_1167_bytecode(bytecode: str) -> str:
-    if not bytecode.startswith(EIP_1167_BYTECODE_PREFIX):
-        raise ValueError('Not an EIP-1167 bytecode')
+PROXY_EVENT_TOPICS = [UPGRADED_TOPIC, BEACON_UPGRADED_TOPIC, ADMIN_CHANGED_TOPIC]
 
-    # detect length of address (20 bytes non-optimized, 0 < N < 20 bytes for vanity addresses)
-    push_n_hex = bytecode[len(EIP_1167_BYTECODE_PREFIX):len(EIP_1167_BYTECODE_PREFIX) + 2]
+# No of blocks of one eth_getLogs request
+LOG_BLOCKS = 2000
 
-    # push1 ... push20 use opcodes 0x60 ... 0x73
-    address_length = int(push_n_hex, base=16) - 0x5f
 
-    if address_length < 1 or address_length > 20:
-        raise ValueError('Not an EIP-1167 bytecode')
-    # address length is in bytes, 2 hex chars make up 1 byte
-    addressFromBytecode = bytecode[len(
-        EIP_1167_BYTECODE_PREFIX) + 2:len(EIP_1167_BYTECODE_PREFIX) + 2 + address_length * 2]
+async def get_logs(from_block: int, to_block: int, topics: list[str], chunk_blocks: int = LOG_BLOCKS) -> list[dict]:
+    # Logs with any of the topics as first topic, requested in batches of block
+    # ranges. Ranges the node refuses, e.g. for too many results, are split.
+    ranges = [(start, min(to_block, start + chunk_blocks - 1))
+              for start in range(from_block, to_block + 1, chunk_blocks)]
+    responses = await run_batched('eth_getLogs', ranges, lambda chunk: get_logs_batch(chunk, topics))
 
-    SUFFIX_OFFSET_FROM_ADDRESS_END = 22  # pylint: disable=invalid-name
-    if not bytecode[len(EIP_1167_BYTECODE_PREFIX) + 2 + address_length * 2 + SUFFIX_OFFSET_FROM_ADDRESS_END:].startswith(EIP_1167_BYTECODE_SUFFIX):
-        raise ValueError('Not an EIP-1167 bytecode')
+    logs = []
+    for (start, end), response in zip(ranges, responses):
+        if 'error' not in response:
+            logs.extend(response.get('result') or [])
+        elif end > start:
+            mid = (start + end) // 2
+            logs.extend(await get_logs(start, end, topics, mid - start + 1))
+        else:
+            raise ValueError(f"eth_getLogs failed for block {start}: {response['error']}")
+    return logs
 
-    # padStart is needed for vanity addresses
-    return '0x' + addressFromBytecode.zfill(40)
 
+async def get_logs_batch(ranges: list[tuple[int, int]], topics: list[str]) -> list:
+    return await rpc_batch_request(
+        'eth_getLogs',
+        [[{'fromBlock': hex(start), 'toBlock': hex(end), 'topics': [topics]}] for start, end in ranges]
+    )
 
-MANY_TO_ONE_PREFIX = '0x60806040523661001357610011610017565b005b6100115b61001f61002f565b61002f61002a610031565b6101'
 
+ZERO_ADDRESS = '0x0000000000000000000000000000000000000000'
+ZERO_ADDRESS_HEX = ZERO_ADDRESS[2:]
 
-def parse_many_to_one_bytecode(bytecode: str) -> str:
-    if not bytecode.startswith(MANY_TO_ONE_PREFIX):
-        raise ValueError('Not a many-to-one bytecode')
+# Length of a 20 bytes address and of a 32 bytes word, with the 0x prefix
+ADDRESS_LENGTHS = (42, 66)
 
-    evm_code = EvmCode(contract=Contract(bytecode=bytecode),
-                       static_analysis=False, dynamic_analysis=False)
-    evm_code.disassemble(bytecode)
-    basic_blocks = evm_code.basicblocks
-    for block in basic_blocks:
-        for inst in block.instructions:
-            if inst.name == 'PUSH32':
-                addr_prefix = inst.operand[:-40]
-                addr = inst.operand[-40:]
-                if int(addr_prefix, 16) == 0 and int(addr, 16) != 0:
-                    return '0x' + addr
 
-    raise ValueError('Not a many-to-one bytecode')
+def read_address(addr) -> str:
+    address = read_addresses([addr])[0]
+    if address is None:
+        raise ValueError('Invalid address')
+    return address
+
+
+def read_addresses(words: list) -> list[str | None]:
+    # Reads the address in the low 20 bytes of each hex word, lowercased, or
+    # None for anything that is not a valid non-zero address. The hex of all
+    # words is validated and lowercased at once, without per-item exceptions
+    # or checksums. FAILED words are kept as FAILED.
+    if any(word is FAILED for word in words):
+        addresses = read_addresses([None if word is FAILED else word for word in words])
+        return [FAILED if word is FAILED else address for word, address in zip(words, addresses)]
+    tails = [word[-40:] if isinstance(word, str) and len(word) in ADDRESS_LENGTHS and word[:2] == '0x'
+             else ZERO_ADDRESS_HEX
+             for word in words]
+    joined = ''.join(tails).lower()
+    try:
+        # fromhex skips whitespace, so also check that no character was skipped
+        valid = len(bytes.fromhex(joined)) * 2 == len(joined)
+    except ValueError:
+        valid = False
+    if not valid:
+        return [read_addresses([word])[0] for word in words] if len(words) > 1 else [None]
+
+    addresses = []
+    for offset in range(0, len(joined), 40):
+        tail = joined[offset:offset + 40]
+        addresses.append(None if tail == ZERO_ADDRESS_HEX else '0x' + tail)
+    return addresses
+
+
+def to_rpc_address(addr: str) -> str:
+    # Nodes accept lowercase addresses, which saves the keccak of a checksum
+    return addr.lower()
+
+
+async def parse_bytecodes(kind: str, bytecodes: list[str]) -> list[str | None]:
+    # Bytecodes missing from the cache are sent as raw bytes, in chunks, to the
+    # process pool when there are enough of them, so parsing runs on other cores
+    # while the event loop keeps serving node requests.
+    keys = [bytecode_hash(bytecode) for bytecode in bytecodes]
+    executor = get_bytecode_executor()
+    if executor is not None and len(bytecodes) >= BYTECODE_OFFLOAD_MIN:
+        missing: dict[bytes, bytes] = {}
+        for bytecode, key in zip(bytecodes, keys):
+            if key in missing or bytecode_cache.get(kind, key) is not MISSING:
+                continue
+            try:
+                missing[key] = to_code(bytecode)
+            except ValueError:
+                bytecode_cache.set(kind, key, None)
+
+        if len(missing) >= BYTECODE_OFFLOAD_MIN:
+            loop = asyncio.get_running_loop()
+            missing_keys = list(missing)
+            chunks = [missing_keys[start:start + BYTECODE_CHUNK_SIZE]
+                      for start in range(0, len(missing_keys), BYTECODE_CHUNK_SIZE)]
+            results = await asyncio.gather(*(
+                loop.run_in_executor(executor, parse_codes, kind, [missing[key] for key in chunk])
+                for chunk in chunks))
+            for chunk, chunk_results in zip(chunks, results):
+                for key, result in zip(chunk, chunk_results):
+                    bytecode_cache.set(kind, key, result)
+
+    return parse_bytecodes_cached(kind, lambda bytecode: CODE_PARSERS[kind](to_code(bytecode)), bytecodes, keys)
+
+
+def parse_bytecodes_cached(kind: str,
+                           parse: Callable[[str], str],
+                           bytecodes: list[str],
+                           keys: list[bytes] | None = None) -> list[str | None]:
+    # Clone factories deploy the same runtime code many times, so each distinct
+    # bytecode is parsed once and its result or 'not a proxy' verdict (None) reused.
+    # keys are the hashes of the bytecodes, when the caller has them already.
+    if keys is None:
+        keys = [bytecode_hash(bytecode) for bytecode in bytecodes]
+    results = []
+    for bytecode, key in zip(bytecodes, keys):
+        result = bytecode_cache.get(kind, key)
+        if result is MISSING:
+            try:
+                result = parse(bytecode)
+            except ValueError:
+                result = None
+            bytecode_cache.set(kind, key, result)
+        results.append(result)
+    return results
@@ -13,7 +13,63 @@ POSTGRES_DATABASE = os.getenv('POSTGRES_DATABASE')
 
 
 ETH_NODE_URL = os.getenv('ETH_NODE_URL')
+# Comma separated node urls to spread requests over, defaults to ETH_NODE_URL
+ETH_NODE_URLS = [url.strip() for url in os.getenv('ETH_NODE_URLS', ETH_NODE_URL or '').split(',') if url.strip()]
+
+# Max no of pooled connections to the node
+ETH_NODE_POOL_SIZE = int(os.getenv('ETH_NODE_POOL_SIZE', '100'), base=10)
+# Seconds an idle connection to the node is kept open
+ETH_NODE_KEEPALIVE_TIMEOUT = float(os.getenv('ETH_NODE_KEEPALIVE_TIMEOUT', '60'))
+# Seconds before a request to the node times out
+ETH_NODE_TIMEOUT = float(os.getenv('ETH_NODE_TIMEOUT', '120'))
+# Gzip request bodies, only if the node accepts Content-Encoding: gzip
+ETH_NODE_GZIP = os.getenv('ETH_NODE_GZIP', 'false').lower() in ('1', 'true', 'yes')
+
+# Max no of requests to the node in flight, across all batches
+RPC_MAX_IN_FLIGHT = int(os.getenv('RPC_MAX_IN_FLIGHT', '32'), base=10)
+# Max no of requests (batches) per second to the node, 0 for no limit
+RPC_MAX_REQUESTS_PER_SECOND = float(os.getenv('RPC_MAX_REQUESTS_PER_SECOND', '0'))
+# Max no of batch elements per second to the node, 0 for no limit
+RPC_MAX_ELEMENTS_PER_SECOND = float(os.getenv('RPC_MAX_ELEMENTS_PER_SECOND', '0'))
+# No of times a request is retried after the node signals overload
+RPC_OVERLOAD_RETRIES = int(os.getenv('RPC_OVERLOAD_RETRIES', '8'), base=10)
+# No of times a failed batch is retried before it is split in half
+RPC_RETRIES = int(os.getenv('RPC_RETRIES', '3'), base=10)
+# Base seconds of the jittered exponential backoff between retries
+RPC_RETRY_BACKOFF = float(os.getenv('RPC_RETRY_BACKOFF', '0.5'))
+
+# Percentile of recent batch latencies after which a batch is also sent to a
+# second node, 0 to disable hedging
+RPC_HEDGE_PERCENTILE = float(os.getenv('RPC_HEDGE_PERCENTILE', '0.95'))
+
+# SQLite file keeping node results of requests at a block number across runs, unset to disable
+RPC_CACHE_PATH = os.getenv('RPC_CACHE_PATH')
+# Max bytes of results kept in RPC_CACHE_PATH, the oldest are evicted first
+RPC_CACHE_MAX_BYTES = int(os.getenv('RPC_CACHE_MAX_BYTES', str(1 << 30)), base=10)
+# Serve requests from RPC_CACHE_PATH only and fail on the ones missing from it
+RPC_CACHE_REPLAY = os.getenv('RPC_CACHE_REPLAY', 'false').lower() in ('1', 'true', 'yes')
+
+# Max no of node results at fixed block numbers kept in memory
+RPC_RESULT_CACHE_SIZE = int(os.getenv('RPC_RESULT_CACHE_SIZE', '100000'), base=10)
+# Max no of beacon implementations kept in memory
+BEACON_CACHE_SIZE = int(os.getenv('BEACON_CACHE_SIZE', '10000'), base=10)
+# Seconds the implementation of a beacon read at 'latest' is reused
+BEACON_CACHE_TTL = float(os.getenv('BEACON_CACHE_TTL', '60'))
+# Max no of bytecode analysis results kept in memory
+BYTECODE_CACHE_SIZE = int(os.getenv('BYTECODE_CACHE_SIZE', '100000'), base=10)
+# SQLite file keeping bytecode analysis results across runs, unset to keep them in memory only
+BYTECODE_CACHE_PATH = os.getenv('BYTECODE_CACHE_PATH')
+# No of worker processes parsing bytecodes off the event loop, 0 to parse in it
+BYTECODE_WORKERS = int(os.getenv('BYTECODE_WORKERS', '0'), base=10)
+
+# File recording requests and batches that failed permanently
+DEAD_LETTER_PATH = os.getenv('DEAD_LETTER_PATH', 'dead-letter.jsonl')
 
 SNOWFLAKE_ACCOUNT = os.getenv('SNOWFLAKE_ACCOUNT')
 SNOWFLAKE_USER = os.getenv('SNOWFLAKE_USER')
 SNOWFLAKE_PASSWORD = os.getenv('SNOWFLAKE_PASSWORD')
+
+# Port serving Prometheus metrics on /metrics, 0 to disable
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'), base=10)
+# Seconds between JSON snapshots of the metrics printed to the log, 0 to disable
+METRICS_LOG_INTERVAL = float(os.getenv('METRICS_LOG_INTERVAL', '0'))
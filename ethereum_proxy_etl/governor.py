@@ -0,0 +1,141 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, TypeVar
+
+from .env import (RPC_MAX_ELEMENTS_PER_SECOND, RPC_MAX_IN_FLIGHT,
+                  RPC_MAX_REQUESTS_PER_SECOND, RPC_OVERLOAD_RETRIES)
+from .provider import RPCOverloadError
+
+T = TypeVar('T')
+
+
+class TokenBucket:
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def delay(self, amount: float, rate: float) -> float:
+        # Takes amount tokens if available and returns 0, otherwise returns
+        # the seconds to wait before trying again.
+        now = time.monotonic()
+        self.rate = rate
+        self.tokens = min(rate, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        # Requests larger than a full bucket pass once the bucket is full
+        amount = min(amount, rate)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0
+        return (amount - self.tokens) / rate
+
+
+class RPCGovernor:
+    # Caps requests in flight, requests per second and batch elements per second
+    # for all node calls. The caps are scaled with AIMD: they grow additively
+    # while the node keeps up and are cut multiplicatively when it signals
+    # overload, which also pauses every caller for a backoff period.
+
+    def __init__(self,
+                 max_in_flight: int = RPC_MAX_IN_FLIGHT,
+                 max_requests_per_second: float = RPC_MAX_REQUESTS_PER_SECOND,
+                 max_elements_per_second: float = RPC_MAX_ELEMENTS_PER_SECOND,
+                 max_retries: int = RPC_OVERLOAD_RETRIES,
+                 decrease_factor: float = 0.5,
+                 backoff: float = 1.0):
+        self.max_in_flight = max_in_flight
+        self.max_requests_per_second = max_requests_per_second
+        self.max_elements_per_second = max_elements_per_second
+        self.max_retries = max_retries
+        self.decrease_factor = decrease_factor
+        self.backoff = backoff
+
+        self.in_flight_limit = float(max_in_flight)
+        self.rate_scale = 1.0
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._requests = TokenBucket(max_requests_per_second)
+        self._elements = TokenBucket(max_elements_per_second)
+        self._waiters: list[asyncio.Future] = []
+
+    def _wake_next(self):
+        while self._waiters:
+            waiter = self._waiters.pop(0)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    async def _wait_turn(self):
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                # Pass the turn we were given on to the next waiter
+                self._wake_next()
+            raise
+
+    async def acquire(self, elements: int):
+        while self.in_flight >= max(1, int(self.in_flight_limit)):
+            await self._wait_turn()
+        self.in_flight += 1
+        try:
+            while True:
+                delay = self.paused_until - time.monotonic()
+                if self.max_requests_per_second > 0:
+                    delay = max(delay, self._requests.delay(
+                        1, self.max_requests_per_second * self.rate_scale))
+                if delay <= 0 and self.max_elements_per_second > 0:
+                    delay = self._elements.delay(
+                        elements, self.max_elements_per_second * self.rate_scale)
+                if delay <= 0:
+                    return
+                await asyncio.sleep(delay)
+        except BaseException:
+            self.release()
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake_next()
+
+    def record_success(self):
+        # Additive increase of about one request per full window of requests
+        self.in_flight_limit = min(self.max_in_flight,
+                                   self.in_flight_limit + 1 / max(1.0, self.in_flight_limit))
+        self.rate_scale = min(1.0, self.rate_scale + 0.01)
+
+    def record_overload(self):
+        self.in_flight_limit = max(1.0, self.in_flight_limit * self.decrease_factor)
+        self.rate_scale = max(0.01, self.rate_scale * self.decrease_factor)
+        self.paused_until = max(self.paused_until, time.monotonic() + self.backoff)
+
+    @asynccontextmanager
+    async def slot(self, elements: int = 1):
+        await self.acquire(elements)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def call(self, elements: int, request: Callable[[], Awaitable[T]]) -> T:
+        attempt = 0
+        while True:
+            async with self.slot(elements):
+                try:
+                    result = await request()
+                except RPCOverloadError:
+                    self.record_overload()
+                    if attempt >= self.max_retries:
+                        raise
+                    attempt += 1
+                    continue
+            self.record_success()
+            return result
+
+
+governor = RPCGovernor()
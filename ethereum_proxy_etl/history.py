@@ -0,0 +1,201 @@
+import asyncio
+import os
+from typing import Awaitable, Callable
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.sql import text
+
+from .batching import RPCRequestFailedError
+from .db import Base, ProxyImplementationHistory, async_engine
+from .deadletter import DeadLetterLog, dead_letters
+from .detect import (FAILED, check_ara_proxy, check_comptroller_proxy,
+                     check_eip_897_proxy, check_eip_1822_proxy,
+                     check_eip_1967_beacon_proxy, check_eip_1967_direct_proxy,
+                     check_gnosis_safe_proxy, check_one_to_one_proxy,
+                     check_oz_proxy, check_p_proxy_proxy, close_resources)
+from .metrics import MetricsExporter, timed_partitions
+
+engine = async_engine()
+async_session = async_sessionmaker(engine)
+
+# Proxy types whose implementation can change, the others are fixed in the bytecode
+proxies = [
+    {'name': 'eip_1967_direct', 'method': check_eip_1967_direct_proxy, },
+    {'name': 'eip_1967_beacon', 'method': check_eip_1967_beacon_proxy, },
+    {'name': 'oz', 'method': check_oz_proxy, },
+    {'name': 'eip_1822', 'method': check_eip_1822_proxy, },
+    {'name': 'eip_897', 'method': check_eip_897_proxy, },
+    {'name': 'gnosis_safe', 'method': check_gnosis_safe_proxy, },
+    {'name': 'comptroller', 'method': check_comptroller_proxy, },
+    {'name': 'ara', 'method': check_ara_proxy, },
+    {'name': 'p_proxy', 'method': check_p_proxy_proxy, },
+    {'name': 'one_to_one', 'method': check_one_to_one_proxy, },
+]
+
+# No of proxies bisected together, each round of the bisection is one batched call
+BATCH_SIZE = 10000
+
+CheckProxy = Callable[[list[str], list[int]], Awaitable[list[str | None]]]
+
+
+async def find_changes(check_proxy: CheckProxy,
+                       addrs: list[str],
+                       start_block: int,
+                       end_block: int) -> list[list[tuple[int, str | None]]]:
+    # Returns the (block, implementation) changes of each proxy in the range,
+    # starting with its implementation at start_block. The range between two
+    # blocks with the same implementation is assumed to have no change, so an
+    # upgrade reverted within it is missed. Every round reads the middle block
+    # of all ranges left, for all proxies at once. check_proxy returns None only
+    # for no implementation and FAILED when a read fails, which is raised here,
+    # as a failed read taken for None would be a change.
+    start_impls = check_reads(await check_proxy(addrs, [start_block] * len(addrs)))
+    end_impls = check_reads(await check_proxy(addrs, [end_block] * len(addrs)))
+    changes: list[list[tuple[int, str | None]]] = [[(start_block, impl)] for impl in start_impls]
+
+    # (proxy idx, low block, implementation at low, high block, implementation at high)
+    pending = []
+
+    def split(idx: int, low: int, low_impl: str | None, high: int, high_impl: str | None):
+        if low_impl == high_impl:
+            return
+        if high - low <= 1:
+            changes[idx].append((high, high_impl))
+        else:
+            pending.append((idx, low, low_impl, high, high_impl))
+
+    for idx, (start_impl, end_impl) in enumerate(zip(start_impls, end_impls)):
+        split(idx, start_block, start_impl, end_block, end_impl)
+
+    while pending:
+        ranges, pending = pending, []
+        mids = [(low + high) // 2 for _, low, _, high, _ in ranges]
+        mid_impls = check_reads(await check_proxy([addrs[idx] for idx, *_ in ranges], mids))
+        for (idx, low, low_impl, high, high_impl), mid, mid_impl in zip(ranges, mids, mid_impls):
+            split(idx, low, low_impl, mid, mid_impl)
+            split(idx, mid, mid_impl, high, high_impl)
+
+    for proxy_changes in changes:
+        proxy_changes.sort(key=lambda change: change[0])
+    return changes
+
+
+def check_reads(impls: list) -> list[str | None]:
+    failed = sum(impl is FAILED for impl in impls)
+    if failed:
+        raise RPCRequestFailedError(f'{failed} of {len(impls)} reads failed permanently')
+    return impls
+
+
+def history_rows(proxy_address: str,
+                 proxy_type: str,
+                 changes: list[tuple[int, str | None]],
+                 end_block: int) -> list[dict]:
+    rows = []
+    for idx, (from_block, impl) in enumerate(changes):
+        if impl is None:
+            continue
+        to_block = changes[idx + 1][0] - 1 if idx + 1 < len(changes) else end_block
+        rows.append({
+            "proxy_address": proxy_address,
+            "proxy_type": proxy_type,
+            "implementation_address": impl,
+            "from_block": from_block,
+            "to_block": to_block,
+        })
+    return rows
+
+
+async def handle_batch(proxy_type: str, check_proxy: CheckProxy, addrs: list[str], start_block: int, end_block: int):
+    changes = await find_changes(check_proxy, addrs, start_block, end_block)
+
+    batch = []
+    for addr, proxy_changes in zip(addrs, changes):
+        batch.extend(history_rows(addr, proxy_type, proxy_changes, end_block))
+
+    if len(batch) == 0:
+        return
+
+    async with async_session.begin() as session:
+        insert_stmt = insert(ProxyImplementationHistory)
+        await session.execute(insert_stmt.on_conflict_do_update(
+            index_elements=['proxy_address', 'proxy_type', 'from_block'],
+            set_=dict(implementation_address=insert_stmt.excluded.implementation_address,
+                      to_block=insert_stmt.excluded.to_block)), batch)
+
+
+async def build_history_async(start_block: int,
+                              end_block: int,
+                              proxy_types: list[str] | None = None,
+                              addresses: list[str] | None = None):
+    # With addresses, only the history of those proxies is built, e.g. of the
+    # addresses of the 'history' entries in the dead letters
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all, tables=[ProxyImplementationHistory.__table__])
+
+    exporter = MetricsExporter()
+    await exporter.start()
+
+    try:
+        for proxy in proxies:
+            if proxy_types is not None and proxy['name'] not in proxy_types:
+                continue
+            async with engine.connect() as conn:
+                conn = await conn.execution_options(yield_per=BATCH_SIZE)
+                if addresses is None:
+                    stmt = text(
+                        "SELECT proxy_address FROM public.proxy_contracts WHERE proxy_type = :proxy_type"
+                    ).bindparams(proxy_type=proxy['name'])
+                else:
+                    stmt = text(
+                        "SELECT proxy_address FROM public.proxy_contracts "
+                        "WHERE proxy_type = :proxy_type AND proxy_address = ANY(:addresses)"
+                    ).bindparams(proxy_type=proxy['name'], addresses=[addr.lower() for addr in addresses])
+                async with conn.stream(stmt) as result:
+                    idx = 0
+                    async for partition in timed_partitions(result, BATCH_SIZE, proxy['name']):
+                        addrs = [row.proxy_address for row in partition]
+                        try:
+                            await handle_batch(proxy['name'], proxy['method'], addrs, start_block, end_block)
+                        except Exception as err:
+                            # Skipped without rows, built again by replay_history_dead_letters
+                            print(f"Got exception when processing {proxy['name']}-{idx}")
+                            print(err)
+                            dead_letters.record('history',
+                                                batch_id=f"history-{proxy['name']}-{idx}",
+                                                proxy_type=proxy['name'],
+                                                start_block=start_block,
+                                                end_block=end_block,
+                                                addresses=addrs,
+                                                error=repr(err))
+                        else:
+                            print(f"processed {proxy['name']}-{idx}")
+                        idx += 1
+    finally:
+        await exporter.stop()
+        await close_resources()
+
+
+def build_history(start_block: int,
+                  end_block: int,
+                  proxy_types: list[str] | None = None,
+                  addresses: list[str] | None = None):
+    asyncio.run(build_history_async(start_block, end_block, proxy_types, addresses))
+
+
+async def replay_history_dead_letters_async(path: str):
+    # Builds the history of the batches recorded as failed again, for their
+    # proxy type, block range and addresses only
+    if not os.path.exists(path):
+        print(f'No dead letters to replay at {path}')
+        return
+    entries = DeadLetterLog(path).take({'history'})
+    print(f'Replaying {len(entries)} history batches from {path}')
+    for entry in entries:
+        await build_history_async(entry['start_block'], entry['end_block'],
+                                  [entry['proxy_type']], entry['addresses'])
+
+
+def replay_history_dead_letters(path: str = dead_letters.path):
+    asyncio.run(replay_history_dead_letters_async(path))
@@ -1,65 +1,30 @@
 import os
+import shutil
 import sys
+from collections import Counter
+
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
 
 # from .backfill import backfill
 
+COLUMNS = ['proxy_address', 'proxy_type', 'implementation_address', 'updated_at']
 
-# ---- STEP 0 ---- #
-# backfill()
-
-# ---- STEP 1 ---- #
-df_list = []
-processed_csv = []
-for x in os.listdir():
-    if not x.endswith(".csv"):
-        continue
-    print(x)
-    df_list.append(pd.read_csv(x))
-    processed_csv.append(x)
-
-df = pd.concat(df_list, axis=0)
-df.to_parquet('combined.parquet', index=False)
-
-for x in processed_csv:
-    os.remove(x)
-
-# ---- STEP 2 ---- #
-# df = pd.read_parquet('combined.parquet')
-df = df[['proxy_address', 'proxy_type', 'implementation_address', 'updated_at']]
-print(df.groupby(['proxy_type'])['proxy_type'].count())
-
-duplicate = df[df.duplicated(subset=['proxy_address'], keep=False)].sort_values(
-    ['proxy_address', 'proxy_type'])
-
-count = 0
-for group, df in duplicate.groupby('proxy_address'):
-    if len(df['implementation_address'].unique()) == 1:
-        continue
-
-    # Handled
-    if (len(df) == 2
-            and 'eip_1967_direct' in df['proxy_type'].values
-            and 'eip_897' in df['proxy_type'].values):
-        continue
+# Schema of the parquet files written by the backfill
+BATCH_SCHEMA = pa.schema([(column, pa.string()) for column in COLUMNS])
 
-    # Handled
-    if (len(df) == 2
-            and 'eip_1967_beacon' in df['proxy_type'].values
-            and 'eip_897' in df['proxy_type'].values):
-        continue
+# Directory of the parquet files written by the backfill, one per proxy type
+BACKFILL_DIR = 'backfill'
 
-    count += 1
-    print(group)
-    print(df[['implementation_address', 'proxy_type']])
+# Directory of the combined batches, in one subdirectory per bucket
+COMBINED_DIR = 'combined'
 
-print(count)
+# No of hex characters of proxy_address after 0x naming its bucket, all rows of
+# an address land in the same bucket, so buckets are merged one at a time
+BUCKET_PREFIX_LENGTH = 2
 
-if count > 0:
-    print('Found unhandled duplicates')
-    sys.exit(1)
-
-# ---- STEP 3 ---- #
 sort_key = {
     'eip_1967_beacon': 1,  # BEACON_SLOT -> implementation()
     'eip_897': 2,  # implementation()
@@ -74,8 +39,106 @@ sort_key = {
     'one_to_one': 11,
     'many_to_one': 12,
 }
-df = pd.read_parquet('combined.parquet')
-df = df[['proxy_address', 'proxy_type', 'implementation_address', 'updated_at']]
-df = df.sort_values('proxy_type', key=lambda x: x.map(sort_key))
-df = df.drop_duplicates(subset=['proxy_address'], keep='first')
-df.to_csv('combined.csv', index=False)
+
+
+def partition_batches(paths: list[str], out_dir: str = COMBINED_DIR):
+    # Streams the batch files into parquet files bucketed by address prefix,
+    # without holding more than a few record batches in memory.
+    dataset = ds.dataset(paths, schema=BATCH_SCHEMA, format='parquet')
+    address = pc.utf8_lower(ds.field('proxy_address'))
+    columns = {column: ds.field(column) for column in COLUMNS}
+    columns['bucket'] = pc.utf8_slice_codeunits(address, 2, 2 + BUCKET_PREFIX_LENGTH)
+    ds.write_dataset(ds.Scanner.from_dataset(dataset, columns=columns),
+                     out_dir,
+                     format='parquet',
+                     partitioning=ds.partitioning(pa.schema([('bucket', pa.string())])),
+                     existing_data_behavior='overwrite_or_ignore')
+
+
+def iter_buckets(out_dir: str = COMBINED_DIR):
+    for bucket in sorted(os.listdir(out_dir)):
+        yield ds.dataset(os.path.join(out_dir, bucket), format='parquet').to_table(columns=COLUMNS).to_pandas()
+
+
+def unhandled_duplicates(df: pd.DataFrame) -> list[tuple[str, pd.DataFrame]]:
+    duplicate = df[df.duplicated(subset=['proxy_address'], keep=False)].sort_values(
+        ['proxy_address', 'proxy_type'])
+
+    unhandled = []
+    for group, group_df in duplicate.groupby('proxy_address'):
+        if len(group_df['implementation_address'].unique()) == 1:
+            continue
+
+        # Handled
+        if (len(group_df) == 2
+                and 'eip_1967_direct' in group_df['proxy_type'].values
+                and 'eip_897' in group_df['proxy_type'].values):
+            continue
+
+        # Handled
+        if (len(group_df) == 2
+                and 'eip_1967_beacon' in group_df['proxy_type'].values
+                and 'eip_897' in group_df['proxy_type'].values):
+            continue
+
+        unhandled.append((group, group_df))
+    return unhandled
+
+
+def resolve_duplicates(df: pd.DataFrame) -> pd.DataFrame:
+    # Keeps the row of each address with the proxy type of the highest priority
+    df = df.sort_values('proxy_type', key=lambda x: x.map(sort_key), kind='stable')
+    return df.drop_duplicates(subset=['proxy_address'], keep='first')
+
+
+def merge(out_dir: str = COMBINED_DIR, out_path: str = 'combined.csv') -> int:
+    # Writes the resolved rows of all buckets to out_path and returns the no of
+    # addresses with unhandled duplicates. out_path is only written if there are none.
+    type_counts: Counter[str] = Counter()
+    count = 0
+    tmp_path = f'{out_path}.tmp'
+    header = True
+    for df in iter_buckets(out_dir):
+        type_counts.update(df['proxy_type'])
+
+        for group, group_df in unhandled_duplicates(df):
+            count += 1
+            print(group)
+            print(group_df[['implementation_address', 'proxy_type']])
+
+        resolve_duplicates(df).to_csv(tmp_path, index=False, header=header, mode='w' if header else 'a')
+        header = False
+
+    print(pd.Series(type_counts, name='proxy_type').sort_index())
+    print(count)
+
+    if count > 0:
+        if not header:
+            os.remove(tmp_path)
+        return count
+    if header:
+        pd.DataFrame(columns=COLUMNS).to_csv(tmp_path, index=False)
+    os.replace(tmp_path, out_path)
+    return 0
+
+
+if __name__ == '__main__':
+    # ---- STEP 0 ---- #
+    # backfill()
+
+    # ---- STEP 1 ---- #
+    # Without new batch files, the buckets of the last run are merged again
+    processed = sorted(os.path.join(BACKFILL_DIR, x) for x in os.listdir(BACKFILL_DIR)
+                       if x.endswith('.parquet')) if os.path.isdir(BACKFILL_DIR) else []
+    if processed:
+        print(f'Partitioning {len(processed)} batch files')
+        shutil.rmtree(COMBINED_DIR, ignore_errors=True)
+        partition_batches(processed)
+
+        for x in processed:
+            os.remove(x)
+
+    # ---- STEP 2 ---- #
+    if merge() > 0:
+        print('Found unhandled duplicates')
+        sys.exit(1)
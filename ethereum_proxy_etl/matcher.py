@@ -0,0 +1,32 @@
+import re
+from typing import Iterable
+
+
+class MultiPatternMatcher:
+    # Finds every pattern contained in a text in a single pass.
+    #
+    # The alternation is wrapped in a lookahead so that overlapping matches are
+    # reported, and ordered longest first so that, at any position, the longest
+    # pattern starting there wins. Every other pattern starting at that position
+    # is a prefix of the winner, so it is resolved from a precomputed table
+    # instead of re-scanning. The scan itself runs inside the C regex engine,
+    # which is much faster than a Python-level automaton over long bytecode.
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns = sorted(set(patterns), key=len, reverse=True)
+        if not self.patterns:
+            raise ValueError('No patterns to match')
+        self._regex = re.compile(
+            '(?=(' + '|'.join(re.escape(p) for p in self.patterns) + '))')
+        self._prefixes = {
+            pattern: frozenset(p for p in self.patterns if pattern.startswith(p))
+            for pattern in self.patterns
+        }
+
+    def match(self, text: str) -> set[str]:
+        found = set()
+        for match in self._regex.finditer(text):
+            found |= self._prefixes[match.group(1)]
+            if len(found) == len(self.patterns):
+                break
+        return found
@@ -0,0 +1,230 @@
+import asyncio
+import json
+import math
+import time
+from bisect import bisect_left
+from typing import AsyncIterator
+
+from aiohttp import web
+
+from .env import METRICS_LOG_INTERVAL, METRICS_PORT
+
+# Upper bounds of the buckets of durations in seconds and of batch sizes
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def label_text(self, label_values: tuple[str, ...], extra: str = '') -> str:
+        parts = [f'{label}="{value}"' for label, value in zip(self.labels, label_values)]
+        if extra:
+            parts.append(extra)
+        return '{' + ','.join(parts) + '}' if parts else ''
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        for label_values, value in self.values.items():
+            lines.append(f'{self.name}{self.label_text(label_values)} {value:g}')
+        return lines
+
+    def snapshot(self) -> dict:
+        return {'/'.join(label_values) or '_': value for label_values, value in self.values.items()}
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *label_values: str, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, *label_values: str):
+        self.values[label_values] = value
+
+
+class Histogram(Metric):
+    # Counts of observations per bucket, with the sum and the count of all of
+    # them. Percentiles of the snapshots are the upper bounds of their buckets.
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = SECONDS_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+        self.counts: dict[tuple[str, ...], list[int]] = {}
+        self.sums: dict[tuple[str, ...], float] = {}
+
+    def observe(self, value: float, *label_values: str):
+        counts = self.counts.get(label_values)
+        if counts is None:
+            counts = self.counts[label_values] = [0] * (len(self.buckets) + 1)
+            self.sums[label_values] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self.sums[label_values] += value
+
+    def percentile(self, label_values: tuple[str, ...], fraction: float) -> float:
+        counts = self.counts[label_values]
+        rank = math.ceil(sum(counts) * fraction)
+        seen = 0
+        for bound, count in zip(self.buckets, counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        for label_values, counts in self.counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == math.inf else f'le="{bound:g}"'
+                lines.append(f'{self.name}_bucket{self.label_text(label_values, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{self.label_text(label_values)} {self.sums[label_values]:g}')
+            lines.append(f'{self.name}_count{self.label_text(label_values)} {sum(counts)}')
+        return lines
+
+    def snapshot(self) -> dict:
+        return {'/'.join(label_values) or '_': {
+            'count': sum(counts),
+            'sum': round(self.sums[label_values], 6),
+            'p50': self.percentile(label_values, 0.5),
+            'p95': self.percentile(label_values, 0.95),
+        } for label_values, counts in self.counts.items()}
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = SECONDS_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
+
+    def snapshot(self) -> dict:
+        snapshots = {metric.name: metric.snapshot() for metric in self.metrics}
+        return {name: snapshot for name, snapshot in snapshots.items() if snapshot}
+
+
+registry = Registry()
+
+RPC_LATENCY = registry.histogram(
+    'rpc_batch_seconds', 'Seconds of node batch requests', ('method',))
+RPC_BATCH_SIZE = registry.histogram(
+    'rpc_batch_size', 'Elements of node batch requests', ('method',), SIZE_BUCKETS)
+RPC_DECODE = registry.histogram(
+    'rpc_decode_seconds', 'Seconds decoding node batch responses', ('method',))
+RPC_ERRORS = registry.counter(
+    'rpc_errors_total', 'Failed node requests and batch elements', ('method', 'kind'))
+RPC_RETRIED = registry.counter(
+    'rpc_retries_total', 'Retried node batches and batch elements', ('method',))
+RPC_CACHE_HITS = registry.counter(
+    'rpc_cache_hits_total', 'Requests served from the response cache', ('method',))
+QUEUE_DEPTH = registry.gauge(
+    'queue_depth', 'Items waiting in the queue of a stage', ('stage',))
+WORKER_IDLE = registry.counter(
+    'worker_idle_seconds_total', 'Seconds workers waited for work', ('stage',))
+STAGE_LATENCY = registry.histogram(
+    'stage_seconds', 'Seconds workers spent on a batch', ('stage',))
+DB_FETCH = registry.histogram(
+    'db_fetch_seconds', 'Seconds waiting for a partition of rows from the database', ('source',))
+DB_WRITE = registry.histogram(
+    'db_write_seconds', 'Seconds writing a batch to the database', ('target',))
+ROWS = registry.counter(
+    'rows_total', 'Rows fetched as candidates and found as proxies', ('marker', 'stage'))
+
+
+async def timed_partitions(result, size: int, source: str) -> AsyncIterator[list]:
+    # Partitions of a streamed result, recording the wait for each one
+    partitions = result.partitions(size)
+    while True:
+        started = time.perf_counter()
+        try:
+            partition = await anext(partitions)
+        except StopAsyncIteration:
+            return
+        DB_FETCH.observe(time.perf_counter() - started, source)
+        yield partition
+
+
+async def timed_get(queue: asyncio.Queue, name: str):
+    # Gets an item from the queue feeding the name stage, recording the wait
+    # of its worker and the queue depth
+    started = time.perf_counter()
+    item = await queue.get()
+    WORKER_IDLE.inc(name, amount=time.perf_counter() - started)
+    QUEUE_DEPTH.set(queue.qsize(), name)
+    return item
+
+
+async def timed_put(queue: asyncio.Queue, name: str, item):
+    await queue.put(item)
+    QUEUE_DEPTH.set(queue.qsize(), name)
+
+
+class MetricsExporter:
+    # Serves the registry as Prometheus text on /metrics of port, and prints a
+    # JSON snapshot of it every log_interval seconds. Either is off when 0.
+
+    def __init__(self, port: int = METRICS_PORT, log_interval: float = METRICS_LOG_INTERVAL,
+                 metrics: Registry = registry):
+        self.port = port
+        self.log_interval = log_interval
+        self.registry = metrics
+        self.runner: web.AppRunner | None = None
+        self.log_task: asyncio.Task | None = None
+
+    async def handle(self, _request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(), content_type='text/plain', charset='utf-8')
+
+    async def start(self):
+        if self.port:
+            app = web.Application()
+            app.router.add_get('/metrics', self.handle)
+            self.runner = web.AppRunner(app)
+            await self.runner.setup()
+            await web.TCPSite(self.runner, port=self.port).start()
+            print(f'Serving metrics on port {self.port}')
+        if self.log_interval:
+            self.log_task = asyncio.create_task(self.log_snapshots())
+
+    async def log_snapshots(self):
+        while True:
+            await asyncio.sleep(self.log_interval)
+            self.log_snapshot()
+
+    def log_snapshot(self):
+        print(json.dumps({'time': time.time(), 'metrics': self.registry.snapshot()}, default=str))
+
+    async def stop(self):
+        if self.log_task is not None:
+            self.log_task.cancel()
+            await asyncio.gather(self.log_task, return_exceptions=True)
+            self.log_task = None
+            self.log_snapshot()
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
@@ -0,0 +1,402 @@
+import asyncio
+import gzip
+import json
+import logging
+import random
+import time
+from collections import defaultdict, deque
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, TypeVar, cast
+
+from aiohttp import (ClientResponseError, ClientSession, ClientTimeout,
+                     TCPConnector)
+from web3 import AsyncHTTPProvider
+from web3.types import RPCResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from .cache import CacheMissError, ResponseCache
+from .env import (ETH_NODE_GZIP, ETH_NODE_KEEPALIVE_TIMEOUT,
+                  ETH_NODE_POOL_SIZE, ETH_NODE_TIMEOUT, RPC_HEDGE_PERCENTILE)
+from .metrics import (RPC_BATCH_SIZE, RPC_CACHE_HITS, RPC_DECODE, RPC_ERRORS,
+                      RPC_LATENCY)
+
+if TYPE_CHECKING:
+    from .governor import RPCGovernor
+
+T = TypeVar('T')
+
+
+def json_dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+def json_loads(raw: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+class RPCBatchError(Exception):
+    pass
+
+
+class BatchTooLargeError(RPCBatchError):
+    pass
+
+
+class RPCOverloadError(RPCBatchError):
+    pass
+
+
+# HTTP statuses and JSON-RPC error codes used by nodes to signal rate limiting
+OVERLOAD_HTTP_STATUSES = (429, 503)
+OVERLOAD_ERROR_CODES = (-32005, 429)
+
+
+def is_batch_too_large(message: str) -> bool:
+    message = message.lower()
+    return 'batch' in message and any(word in message for word in ('large', 'limit', 'size', 'exceed'))
+
+
+# Messages of requests asking for too much, e.g. eth_getLogs over a range with
+# too many logs, which some nodes send with the overload code -32005
+RESULT_LIMIT_MESSAGES = ('more than', 'results', 'block range', 'response size')
+
+
+def is_result_limit_error(error: Any) -> bool:
+    if isinstance(error, dict):
+        error = error.get('message', '')
+    message = str(error).lower()
+    return any(part in message for part in RESULT_LIMIT_MESSAGES)
+
+
+def is_overload_error(error: Any) -> bool:
+    if is_result_limit_error(error):
+        return False
+    if isinstance(error, dict):
+        if error.get('code') in OVERLOAD_ERROR_CODES:
+            return True
+        error = error.get('message', '')
+    message = str(error).lower()
+    return 'rate limit' in message or 'too many requests' in message
+
+
+class NodeBatchProvider(AsyncHTTPProvider):
+    def __init__(self,
+                 endpoint_uri: str | None,
+                 pool_size: int = ETH_NODE_POOL_SIZE,
+                 keepalive_timeout: float = ETH_NODE_KEEPALIVE_TIMEOUT,
+                 timeout: float = ETH_NODE_TIMEOUT,
+                 compress_requests: bool = ETH_NODE_GZIP):
+        super().__init__(endpoint_uri)
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self.compress_requests = compress_requests
+        self._session: ClientSession | None = None
+        self._session_loop: asyncio.AbstractEventLoop | None = None
+        self._next_id = 0
+
+    async def get_session(self) -> ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            # A session is bound to the loop it was created in, e.g. by asyncio.run()
+            connector = TCPConnector(limit=self.pool_size,
+                                     limit_per_host=self.pool_size,
+                                     keepalive_timeout=self.keepalive_timeout,
+                                     ttl_dns_cache=300)
+            self._session = ClientSession(connector=connector,
+                                          timeout=ClientTimeout(total=self.timeout),
+                                          raise_for_status=True)
+            self._session_loop = loop
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._session_loop = None
+
+    def get_request_headers(self) -> dict[str, str]:
+        headers = super().get_request_headers()
+        headers['Accept-Encoding'] = 'gzip, deflate'
+        if self.compress_requests:
+            headers['Content-Encoding'] = 'gzip'
+        return headers
+
+    async def post(self, request_data: bytes, timeout: float | None = None) -> bytes:
+        if self.compress_requests:
+            request_data = gzip.compress(request_data, compresslevel=1)
+        session = await self.get_session()
+        kwargs = {'timeout': ClientTimeout(total=timeout)} if timeout else {}
+        async with session.post(self.endpoint_uri,
+                                data=request_data,
+                                headers=self.get_request_headers(),
+                                **kwargs) as response:
+            return await response.read()
+
+    def reserve_ids(self, count: int) -> int:
+        # Ids of a batch are consecutive, so a response is placed by its id offset
+        first_id = self._next_id
+        self._next_id += count
+        return first_id
+
+    def encode_rpc_requests(self, method: str, params_list: list[Any], first_id: int) -> bytes:
+        return json_dumps([{
+            "jsonrpc": "2.0",
+            "method": method,
+            "params": params or [],
+            "id": first_id + idx,
+        } for idx, params in enumerate(params_list)])
+
+    def decode_rpc_responses(self, raw_response: bytes, first_id: int, count: int) -> list[RPCResponse]:
+        response = json_loads(raw_response)
+        if not isinstance(response, list):
+            return response
+
+        ordered: list[Any] = [None] * count
+        for item in response:
+            idx = item.get('id')
+            if isinstance(idx, int) and 0 <= idx - first_id < count:
+                ordered[idx - first_id] = item
+        for idx, item in enumerate(ordered):
+            if item is None:
+                ordered[idx] = {'jsonrpc': '2.0', 'id': first_id + idx,
+                                'error': {'code': -32603, 'message': 'Missing response'}}
+        return cast(list[RPCResponse], ordered)
+
+    async def make_request(self, method: str, params: Any) -> RPCResponse:
+        self.logger.debug(
+            f"Making request HTTP. URI: {self.endpoint_uri}, Method: {method}"
+        )
+        request_data = self.encode_rpc_request(method, params)
+        try:
+            raw_response = await self.post(request_data)
+        except ClientResponseError as err:
+            if err.status in OVERLOAD_HTTP_STATUSES:
+                raise RPCOverloadError(f'Node overloaded: {err.status} {err.message}') from err
+            raise
+        response = self.decode_rpc_response(raw_response)
+        if 'error' in response and is_overload_error(response['error']):
+            raise RPCOverloadError(f"Node overloaded: {response['error']}")
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(
+                f"Getting response HTTP. URI: {self.endpoint_uri}, "
+                f"Method: {method}, Response: {response}"
+            )
+        return response
+
+    async def batch_requests(self, method: str, params: list[Any], timeout: float | None = None) -> list[RPCResponse]:
+        self.logger.debug(
+            f"Making request HTTP. URI: {self.endpoint_uri}, Method: {method}"
+        )
+        first_id = self.reserve_ids(len(params))
+        request_data = self.encode_rpc_requests(method, params, first_id)
+        try:
+            raw_response = await self.post(request_data, timeout)
+        except ClientResponseError as err:
+            if err.status == 413:
+                raise BatchTooLargeError(f'Batch of {len(params)} rejected: {err.message}') from err
+            if err.status in OVERLOAD_HTTP_STATUSES:
+                raise RPCOverloadError(f'Node overloaded: {err.status} {err.message}') from err
+            raise
+        started = time.perf_counter()
+        response = self.decode_rpc_responses(raw_response, first_id, len(params))
+        RPC_DECODE.observe(time.perf_counter() - started, method)
+        if not isinstance(response, list):
+            # The node rejected the batch as a whole
+            error = response.get('error', response)
+            if is_overload_error(error):
+                raise RPCOverloadError(f'Node overloaded: {error}')
+            if is_batch_too_large(str(error)):
+                raise BatchTooLargeError(f'Batch of {len(params)} rejected: {error}')
+            raise RPCBatchError(f'Batch of {len(params)} rejected: {error}')
+        if any('error' in item and is_overload_error(item['error']) for item in response):
+            raise RPCOverloadError(f'Node overloaded in batch of {len(params)}')
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(
+                f"Getting response HTTP. URI: {self.endpoint_uri}, "
+                f"Method: {method}, Response: {response}"
+            )
+        return response
+
+
+class NodeStats:
+    def __init__(self):
+        self.latency: float | None = None
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+
+    def record_success(self, latency: float):
+        # Exponentially weighted moving average of the latency
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        self.consecutive_failures = 0
+
+    def record_failure(self, cooldown: float):
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= 3:
+            self.down_until = time.monotonic() + cooldown
+
+
+class NodeProviderPool:
+    # Spreads requests over several nodes, weighted by their observed latency,
+    # and takes nodes failing repeatedly out of rotation for a cooldown. A batch
+    # slower than the hedge percentile of recent batches of its method is sent
+    # to a second node too, and the first successful response wins. The hedge
+    # takes a slot of the governor, if any, like the request it duplicates.
+    # Results of requests at a block number are served from the response
+    # cache, if any.
+
+    def __init__(self,
+                 endpoint_uris: list[str | None],
+                 hedge_percentile: float = RPC_HEDGE_PERCENTILE,
+                 failure_cooldown: float = 30.0,
+                 min_hedge_samples: int = 20,
+                 response_cache: ResponseCache | None = None,
+                 governor: 'RPCGovernor | None' = None,
+                 batch_observer: Callable[[str, int, float], None] | None = None):
+        # Without urls, web3's default endpoint is used
+        self.providers = [NodeBatchProvider(uri) for uri in endpoint_uris or [None]]
+        self.stats = {provider: NodeStats() for provider in self.providers}
+        self.hedge_percentile = hedge_percentile
+        self.failure_cooldown = failure_cooldown
+        self.min_hedge_samples = min_hedge_samples
+        self.latencies: dict[str, deque[float]] = defaultdict(lambda: deque(maxlen=500))
+        self.response_cache = response_cache
+        self.governor = governor
+        # Called with the method, size and latency of each successful batch
+        self.batch_observer = batch_observer
+
+    def pick(self, exclude: NodeBatchProvider | None = None) -> NodeBatchProvider:
+        now = time.monotonic()
+        candidates = [p for p in self.providers if p is not exclude] or self.providers
+        healthy = [p for p in candidates if self.stats[p].down_until <= now]
+        if not healthy:
+            return min(candidates, key=lambda p: self.stats[p].down_until)
+        # Nodes without samples yet are tried first
+        unmeasured = [p for p in healthy if self.stats[p].latency is None]
+        if unmeasured:
+            return random.choice(unmeasured)
+        weights = [1 / max(self.stats[p].latency, 1e-3) for p in healthy]
+        return random.choices(healthy, weights=weights)[0]
+
+    def hedge_delay(self, method: str) -> float | None:
+        samples = self.latencies[method]
+        if (len(self.providers) < 2
+                or not 0 < self.hedge_percentile < 1
+                or len(samples) < self.min_hedge_samples):
+            return None
+        ordered = sorted(samples)
+        return ordered[int(len(ordered) * self.hedge_percentile)]
+
+    async def _send(self,
+                    provider: NodeBatchProvider,
+                    method: str,
+                    request: Callable[[], Awaitable[T]],
+                    elements: int = 0) -> T:
+        # Times the round trip to the node only, callers hold a governor slot by then
+        started = time.monotonic()
+        try:
+            result = await request()
+        except BatchTooLargeError:
+            RPC_ERRORS.inc(method, 'too_large')
+            raise
+        except Exception as err:
+            RPC_ERRORS.inc(method, 'overload' if isinstance(err, RPCOverloadError) else 'request')
+            self.stats[provider].record_failure(self.failure_cooldown)
+            raise
+        latency = time.monotonic() - started
+        self.stats[provider].record_success(latency)
+        self.latencies[method].append(latency)
+        RPC_LATENCY.observe(latency, method)
+        if elements and self.batch_observer is not None:
+            self.batch_observer(method, elements, latency)
+        return result
+
+    async def make_request(self, method: str, params: Any) -> RPCResponse:
+        cache = self.response_cache
+        key = cache.key(method, params) if cache is not None and cache.cacheable(params) else None
+        if key is not None:
+            cached = cache.get_many([key])
+            if key in cached:
+                RPC_CACHE_HITS.inc(method)
+                return cast(RPCResponse, {'jsonrpc': '2.0', 'id': 0, 'result': cached[key]})
+        if cache is not None and cache.replay:
+            raise CacheMissError(f'{method} request not in the cache: {params}')
+
+        provider = self.pick()
+        response = await self._send(provider, method, lambda: provider.make_request(method, params))
+        if key is not None and 'result' in response and 'error' not in response:
+            cache.set_many([(key, response['result'])])
+        return response
+
+    async def batch_requests(self, method: str, params: list[Any], timeout: float | None = None) -> list[RPCResponse]:
+        cache = self.response_cache
+        if cache is None:
+            return await self.send_batch(method, params, timeout)
+
+        keys = [cache.key(method, p) if cache.cacheable(p) else None for p in params]
+        cached = cache.get_many([key for key in keys if key is not None])
+        responses: list[Any] = [None] * len(params)
+        missing = []
+        for idx, key in enumerate(keys):
+            if key is not None and key in cached:
+                responses[idx] = {'jsonrpc': '2.0', 'id': idx, 'result': cached[key]}
+            else:
+                missing.append(idx)
+        RPC_CACHE_HITS.inc(method, amount=len(params) - len(missing))
+        if not missing:
+            return responses
+        if cache.replay:
+            raise CacheMissError(f'{len(missing)} of {len(params)} {method} requests not in the cache')
+
+        fetched = await self.send_batch(method, [params[idx] for idx in missing], timeout)
+        cache.set_many([(keys[idx], response['result']) for idx, response in zip(missing, fetched)
+                        if keys[idx] is not None and 'result' in response and 'error' not in response])
+        for idx, response in zip(missing, fetched):
+            responses[idx] = response
+        return responses
+
+    async def send_batch(self, method: str, params: list[Any], timeout: float | None = None) -> list[RPCResponse]:
+        RPC_BATCH_SIZE.observe(len(params), method)
+        primary = self.pick()
+        primary_task = asyncio.create_task(
+            self._send(primary, method, lambda: primary.batch_requests(method, params, timeout), len(params)))
+
+        delay = self.hedge_delay(method)
+        if delay is None:
+            return await primary_task
+
+        done, _ = await asyncio.wait({primary_task}, timeout=delay)
+        if done:
+            return primary_task.result()
+
+        secondary = self.pick(exclude=primary)
+
+        def hedge() -> Awaitable[list[RPCResponse]]:
+            return self._send(secondary, method, lambda: secondary.batch_requests(method, params, timeout),
+                              len(params))
+
+        hedge_task = asyncio.create_task(
+            hedge() if self.governor is None else self.governor.call(len(params), hedge))
+        pending = {primary_task, hedge_task}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+            # Both failed, report the error of the primary
+            return primary_task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def close(self):
+        for provider in self.providers:
+            await provider.close()
@@ -1,30 +1,60 @@
 import asyncio
+import os
+import time
 from datetime import datetime, timezone
-from typing import Callable, Literal, TypedDict
+from typing import (Awaitable, Callable, Iterable, Literal, NamedTuple,
+                    TypedDict)
 
-from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.sql import text
-
-from .db import ProxyContracts, async_engine
-from .detect import (check_ara_proxy, check_comptroller_proxy,
-                     check_eip_897_proxy, check_eip_1167_minimal_proxy,
-                     check_eip_1822_proxy, check_eip_1967_beacon_proxy,
-                     check_eip_1967_direct_proxy, check_gnosis_safe_proxy,
-                     check_many_to_one_proxy, check_one_to_one_proxy,
-                     check_oz_proxy, check_p_proxy_proxy)
-
-# No of types of proxy markers to process at a time
+from web3.types import BlockIdentifier
+
+from .checkpoint import CHECKPOINT_BLOCKS, Checkpoints, WorkUnit, block_ranges
+from .db import (Base, ProxyBeacons, async_engine,
+                 copy_upsert_proxy_contracts, upsert_proxy_beacons)
+from .detect import (FAILED, SLOT_PROXY_LOCATIONS, check_ara_proxy,
+                     check_comptroller_proxy, check_eip_897_proxy,
+                     check_eip_1167_minimal_proxy, check_eip_1822_proxy,
+                     check_eip_1967_beacon_proxies,
+                     check_eip_1967_beacon_proxy, check_eip_1967_direct_proxy,
+                     check_gnosis_safe_proxy, check_many_to_one_proxy,
+                     check_one_to_one_proxy, check_oz_proxy,
+                     check_p_proxy_proxy, check_slot_proxies,
+                     close_resources, pinned_block)
+from .deadletter import DeadLetterLog, dead_letters
+from .matcher import MultiPatternMatcher
+from .metrics import (DB_WRITE, ROWS, STAGE_LATENCY, MetricsExporter,
+                      timed_get, timed_partitions, timed_put)
+
+# No of types of proxy markers to fetch at a time
 MARKER_CONCURRENCY = 5
 
 # No of rows to fetch in a batch from cursor and process at a time
 BATCH_SIZE = 10000
 
-# Max no of batches available for workers
-QUEUE_SIZE = 2
+# Max no of fetched batches waiting for detection
+DETECT_QUEUE_SIZE = 4
+
+# Max no of workers detecting proxies of a batch with node calls
+DETECT_WORKERS = 4
+
+# Max no of detected batches waiting to be written
+WRITE_QUEUE_SIZE = 4
+
+# Max no of workers writing batches to the database
+WRITE_WORKERS = 2
+
+# Marker of the checkpoints of single pass runs, which cover all markers
+SINGLE_PASS_MARKER = '*'
+
+# No of blocks behind the highest contract in public.contracts followed, for reorgs
+FOLLOW_CONFIRMATIONS = 12
+
+# Seconds between polls for new contracts in follow mode
+FOLLOW_POLL_INTERVAL = 5
 
-# Max no of workers to process a batch
-WORKERS = 1
+# Max no of blocks processed in one window of follow mode
+FOLLOW_MAX_BLOCKS = 10000
 
 engine = async_engine()
 
@@ -32,8 +62,6 @@ async_session = async_sessionmaker(engine)
 
 updated_at = datetime.now(timezone.utc).replace(tzinfo=None)
 
-queue = asyncio.Queue(maxsize=QUEUE_SIZE)
-
 Marker = TypedDict(
     'Marker',
     {
@@ -73,21 +101,48 @@ markers: list[Marker] = [
 ]
 
 
-async def handle_batch(_batch_id: str, proxy_type: str, check_proxy: Callable[[str], str], partition: list[tuple]):
+bytecode_matcher = MultiPatternMatcher(
+    marker['marker'] for marker in markers if marker['type'] == 'bytecode')
+
+
+class MarkerRow(NamedTuple):
+    key: str
+    address: str
+
+
+class SlotRow(NamedTuple):
+    address: str
+    proxy_types: list[str]
+
+
+async def handle_batch(batch_id: str,
+                       proxy_type: str,
+                       check_proxy: Callable[[str], str],
+                       partition: list[tuple],
+                       block: BlockIdentifier = 'latest'):
     # print(f"processing {batch_id} - {len(partition)}")
 
     async def check_proxy_no_err(key: str):
         try:
-            return await check_proxy(key)
+            return await check_proxy(key, block)
         except ValueError:
             return None
 
     keys = [row.key for row in partition]
+    ROWS.inc(proxy_type, 'candidate', amount=len(keys))
 
-    implementation_addr = await check_proxy_no_err(keys)
+    beacon_addrs = None
+    if proxy_type == 'eip_1967_beacon':
+        # The beacons read for detection are kept for proxy_beacons
+        beacon_addrs, implementation_addr = await check_eip_1967_beacon_proxies(keys, block)
+    else:
+        implementation_addr = await check_proxy_no_err(keys)
 
     batch = []
+    failed = []
     for idx, row in enumerate(partition):
+        if implementation_addr[idx] is FAILED:
+            failed.append(row.address)
         if not implementation_addr[idx]:
             continue
 
@@ -97,42 +152,189 @@ async def handle_batch(_batch_id: str, proxy_type: str, check_proxy: Callable[[s
             "implementation_address": implementation_addr[idx],
             "updated_at": updated_at
         })
+        if beacon_addrs is not None:
+            batch[-1]['beacon_address'] = beacon_addrs[idx]
 
-    if len(batch) > 0:
-        async with async_session.begin() as session:
-            insert_stmt = insert(ProxyContracts)
-            upsert_stmt = insert_stmt.on_conflict_do_update(
-                index_elements=[ProxyContracts.proxy_address],
-                set_=dict(proxy_type=insert_stmt.excluded.proxy_type,
-                          implementation_address=insert_stmt.excluded.implementation_address,
-                          updated_at=insert_stmt.excluded.updated_at),
-                where=text(
-                    "(proxy_contracts.proxy_type = 'eip_897' AND excluded.proxy_type = 'eip_1967_beacon') OR (proxy_contracts.proxy_type = 'eip_1967_direct' AND excluded.proxy_type = 'eip_897')")
-            )
+    ROWS.inc(proxy_type, 'proxy', amount=len(batch))
+    record_failed_addresses(batch_id, proxy_type, failed)
+    return [batch] if batch else []
 
-            await session.execute(upsert_stmt, batch)
 
-    # print(f'batch-{batch_id} is processed. Inserted {len(batch)}.')
+async def handle_slot_batch(batch_id: str, partition: list[SlotRow], block: BlockIdentifier = 'latest'):
+    proxies: dict[str, list[str]] = {}
+    for row in partition:
+        for proxy_type in row.proxy_types:
+            proxies.setdefault(proxy_type, []).append(row.address)
 
+    implementation_addrs, beacon_addrs = await check_slot_proxies(proxies, block)
 
-async def worker(idx: int):
-    print(f'Starting worker #{idx}')
-    while True:
-        args = await queue.get()
-        try:
-            await handle_batch(*args)
-        except Exception as err:
-            batch_id = args[0]
-            batch = args[-1]
-            print(
-                f'Got exception when processing batch. batch_id={batch_id}, batch=')
-            print(batch)
-            print(err)
-        finally:
-            queue.task_done()
-
-
-async def execute_marker(marker: Marker, start_block: int, end_block: int):
+    # One batch per proxy type, merged into one statement when written
+    batches = []
+    for marker in markers:
+        proxy_type = marker['name']
+        if proxy_type not in proxies:
+            continue
+        ROWS.inc(proxy_type, 'candidate', amount=len(proxies[proxy_type]))
+        batch = [{
+            "proxy_address": addr,
+            "proxy_type": proxy_type,
+            "implementation_address": implementation_addr,
+            "updated_at": updated_at
+        } for addr, implementation_addr in zip(proxies[proxy_type], implementation_addrs[proxy_type])
+            if implementation_addr]
+        ROWS.inc(proxy_type, 'proxy', amount=len(batch))
+        record_failed_addresses(batch_id, proxy_type,
+                                [addr for addr, implementation_addr in zip(proxies[proxy_type], implementation_addrs[proxy_type])
+                                 if implementation_addr is FAILED])
+        if proxy_type == 'eip_1967_beacon':
+            # The beacons read for detection are kept for proxy_beacons
+            beacons = dict(zip(proxies[proxy_type], beacon_addrs))
+            for row in batch:
+                row['beacon_address'] = beacons[row['proxy_address']]
+        if len(batch) > 0:
+            batches.append(batch)
+    return batches
+
+
+async def write_batches(batches: list[list[dict]]):
+    started = time.perf_counter()
+    beacons = [{'proxy_address': row['proxy_address'],
+                'beacon_address': row['beacon_address'],
+                'updated_at': row['updated_at']}
+               for batch in batches for row in batch if row.get('beacon_address')]
+    async with async_session.begin() as session:
+        # All rows in one statement, as statements locking rows of several
+        # proxy types one after another can deadlock with other writers
+        await upsert_proxy_contracts(session, [row for batch in batches for row in batch])
+        if beacons:
+            await upsert_proxy_beacons(await session.connection(), beacons)
+    DB_WRITE.observe(time.perf_counter() - started, 'proxy_contracts')
+
+
+async def create_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all, tables=[ProxyBeacons.__table__])
+
+
+async def upsert_proxy_contracts(session, batch: list[dict]):
+    await copy_upsert_proxy_contracts(await session.connection(), batch)
+
+
+def record_failed_batch(batch_id: str, addresses: list[str], err: Exception):
+    print(
+        f'Got exception when processing batch. batch_id={batch_id}, size={len(addresses)}')
+    print(err)
+    dead_letters.record('batch',
+                        batch_id=batch_id,
+                        addresses=addresses,
+                        error=repr(err))
+
+
+def record_failed_addresses(batch_id: str, proxy_type: str, addresses: list[str]):
+    # Only the contracts whose requests failed are recorded, the rest of their
+    # batch is written
+    if not addresses:
+        return
+    print(f'Failed to check contracts of batch. batch_id={batch_id}, size={len(addresses)}')
+    ROWS.inc(proxy_type, 'failed', amount=len(addresses))
+    dead_letters.record('batch',
+                        batch_id=batch_id,
+                        proxy_type=proxy_type,
+                        addresses=addresses,
+                        error='requests failed permanently')
+
+
+class Pipeline:
+    # Fetched batches go through a detect stage making the node calls and a
+    # write stage upserting the results, each with its own workers and bounded
+    # queue, so the node and the database are kept busy at the same time. A full
+    # queue blocks the stage in front of it. Batches are detected at block.
+
+    def __init__(self,
+                 detect_workers: int = DETECT_WORKERS,
+                 write_workers: int = WRITE_WORKERS,
+                 detect_queue_size: int = DETECT_QUEUE_SIZE,
+                 write_queue_size: int = WRITE_QUEUE_SIZE,
+                 write: Callable[[list[list[dict]]], Awaitable[None]] = write_batches,
+                 block: BlockIdentifier = 'latest'):
+        self.detect_workers = detect_workers
+        self.write_workers = write_workers
+        self.detect_queue: asyncio.Queue = asyncio.Queue(maxsize=detect_queue_size)
+        self.write_queue: asyncio.Queue = asyncio.Queue(maxsize=write_queue_size)
+        self.write = write
+        self.block = block
+        self.tasks: list[asyncio.Task] = []
+
+    def start(self):
+        self.tasks = ([asyncio.create_task(self.detect_worker(i)) for i in range(self.detect_workers)]
+                      + [asyncio.create_task(self.write_worker(i)) for i in range(self.write_workers)])
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def put(self,
+                  handler: Callable[..., Awaitable[list[list[dict]]]],
+                  batch_id: str,
+                  *args,
+                  unit: WorkUnit | None = None):
+        if unit is not None:
+            unit.add_batch()
+        await timed_put(self.detect_queue, 'detect', (handler, batch_id, args, unit))
+
+    async def join(self):
+        # Detect workers hand their results to the write queue before they are done
+        await self.detect_queue.join()
+        await self.write_queue.join()
+
+    async def detect_worker(self, idx: int):
+        print(f'Starting detect worker #{idx}')
+        while True:
+            handler, batch_id, args, unit = await timed_get(self.detect_queue, 'detect')
+            started = time.perf_counter()
+            try:
+                batches = await handler(batch_id, *args, block=self.block)
+                STAGE_LATENCY.observe(time.perf_counter() - started, 'detect')
+            except Exception as err:
+                record_failed_batch(batch_id, [row.address for row in args[-1]], err)
+                finish_batch(unit, failed=True)
+            else:
+                if batches:
+                    await timed_put(self.write_queue, 'write', (batch_id, batches, unit))
+                else:
+                    finish_batch(unit)
+            finally:
+                self.detect_queue.task_done()
+
+    async def write_worker(self, idx: int):
+        print(f'Starting write worker #{idx}')
+        while True:
+            batch_id, batches, unit = await timed_get(self.write_queue, 'write')
+            started = time.perf_counter()
+            try:
+                await self.write(batches)
+                STAGE_LATENCY.observe(time.perf_counter() - started, 'write')
+            except Exception as err:
+                record_failed_batch(batch_id, [row['proxy_address'] for batch in batches for row in batch], err)
+                finish_batch(unit, failed=True)
+            else:
+                finish_batch(unit)
+            finally:
+                self.write_queue.task_done()
+
+
+def finish_batch(unit: WorkUnit | None, failed: bool = False):
+    if unit is not None:
+        unit.finish_batch(failed)
+
+
+async def execute_marker(pipeline: Pipeline,
+                         marker: Marker,
+                         start_block: int,
+                         end_block: int,
+                         unit: WorkUnit | None = None):
     # print(f"start {marker['name']}")
     async with engine.connect() as conn:
         conn = await conn.execution_options(yield_per=BATCH_SIZE)
@@ -153,35 +355,326 @@ async def execute_marker(marker: Marker, start_block: int, end_block: int):
 
         async with conn.stream(stmt) as result:
             idx = 0
-            async for partition in result.partitions(BATCH_SIZE):
-                await queue.put((f"{marker['name']}-{idx}",
-                                 marker['name'],
-                                 marker['method'],
-                                 partition))
+            async for partition in timed_partitions(result, BATCH_SIZE, marker['name']):
+                await pipeline.put(handle_batch,
+                                   f"{marker['name']}-{start_block}-{idx}",
+                                   marker['name'],
+                                   marker['method'],
+                                   partition,
+                                   unit=unit)
                 # print(f"added {marker['name']}-{idx} to queue")
                 idx += 1
         # print(f"end {marker['name']}")
 
 
-async def stream_async(start_block: int, end_block: int):
-    workers = [asyncio.create_task(worker(i)) for i in range(WORKERS)]
+async def execute_marker_units(pipeline: Pipeline,
+                               marker: Marker,
+                               start_block: int,
+                               end_block: int,
+                               checkpoints: Checkpoints,
+                               checkpoint_blocks: int = CHECKPOINT_BLOCKS):
+    for unit_start, unit_end in block_ranges(start_block, end_block, checkpoint_blocks):
+        if checkpoints.is_completed(marker['name'], unit_start, unit_end):
+            continue
+        unit = WorkUnit(marker['name'], unit_start, unit_end)
+        await execute_marker(pipeline, marker, unit_start, unit_end, unit)
+        checkpoints.finish_fetch(unit)
+
 
+async def execute_markers(pipeline: Pipeline,
+                          start_block: int,
+                          end_block: int,
+                          checkpoints: Checkpoints,
+                          marker_concurrency: int = MARKER_CONCURRENCY,
+                          checkpoint_blocks: int = CHECKPOINT_BLOCKS):
     marker_tasks = set()
     for marker in markers:
-        if len(marker_tasks) >= MARKER_CONCURRENCY:
+        if len(marker_tasks) >= marker_concurrency:
             # Wait for some download to finish before adding a new one
             _done, marker_tasks = await asyncio.wait(marker_tasks, return_when=asyncio.FIRST_COMPLETED)
         marker_tasks.add(asyncio.create_task(
-            execute_marker(marker, start_block, end_block)))
+            execute_marker_units(pipeline, marker, start_block, end_block, checkpoints, checkpoint_blocks)))
     # Wait for the remaining downloads to finish
     await asyncio.wait(marker_tasks)
 
-    await queue.join()
 
-    for task in workers:
-        task.cancel()
-    await asyncio.gather(*workers, return_exceptions=True)
+def classify_contract(bytecode: str | None, function_sighashes: list[str] | None) -> list[Marker]:
+    found = bytecode_matcher.match(bytecode) if bytecode else set()
+    sighashes = set(function_sighashes) if function_sighashes else set()
+    return [marker for marker in markers
+            if marker['marker'] in (found if marker['type'] == 'bytecode' else sighashes)]
+
+
+async def execute_markers_single_pass(pipeline: Pipeline,
+                                      start_block: int,
+                                      end_block: int,
+                                      checkpoints: Checkpoints,
+                                      checkpoint_blocks: int = CHECKPOINT_BLOCKS):
+    # Reads every candidate contract once and routes it to all markers it matches,
+    # instead of scanning public.contracts once per marker.
+    bytecode_pattern = '|'.join(marker['marker']
+                                for marker in markers if marker['type'] == 'bytecode')
+    function_conditions = ' OR '.join(f"'{marker['marker']}' = ANY(function_sighashes)"
+                                      for marker in markers if marker['type'] == 'function')
+    for unit_start, unit_end in block_ranges(start_block, end_block, checkpoint_blocks):
+        if checkpoints.is_completed(SINGLE_PASS_MARKER, unit_start, unit_end):
+            continue
+        unit = WorkUnit(SINGLE_PASS_MARKER, unit_start, unit_end)
+        stmt = text(
+            f"SELECT address, bytecode, function_sighashes "
+            f"FROM public.contracts "
+            f"WHERE (bytecode ~ '{bytecode_pattern}' OR {function_conditions}) "
+            f"AND block_number >= {unit_start} AND block_number <= {unit_end}"
+        )
+        await classify_contracts(pipeline, stmt, unit)
+        checkpoints.finish_fetch(unit)
+
+
+async def classify_contracts(pipeline: Pipeline, stmt, unit: WorkUnit | None = None):
+    prefix = f'{unit.start_block}-' if unit is not None else ''
+
+    buffers: dict[str, list[MarkerRow]] = {marker['name']: [] for marker in markers}
+    batch_ids = {marker['name']: 0 for marker in markers}
+    slot_buffer: list[SlotRow] = []
+    slot_batch_id = 0
+
+    async def flush(marker: Marker):
+        name = marker['name']
+        await pipeline.put(handle_batch,
+                           f"{name}-{prefix}{batch_ids[name]}",
+                           name,
+                           marker['method'],
+                           buffers[name],
+                           unit=unit)
+        buffers[name] = []
+        batch_ids[name] += 1
+
+    async def flush_slots():
+        nonlocal slot_buffer, slot_batch_id
+        await pipeline.put(handle_slot_batch, f"slot-{prefix}{slot_batch_id}", slot_buffer, unit=unit)
+        slot_buffer = []
+        slot_batch_id += 1
 
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(yield_per=BATCH_SIZE)
+        async with conn.stream(stmt) as result:
+            async for partition in timed_partitions(result, BATCH_SIZE, 'single_pass'):
+                for row in partition:
+                    slot_types = []
+                    for marker in classify_contract(row.bytecode, row.function_sighashes):
+                        # Storage slot markers of a contract are read together in one fused batch
+                        if marker['name'] in SLOT_PROXY_LOCATIONS:
+                            slot_types.append(marker['name'])
+                            continue
+                        key = row.bytecode if marker['select'] == 'bytecode' else row.address
+                        buffers[marker['name']].append(MarkerRow(key, row.address))
+                        if len(buffers[marker['name']]) >= BATCH_SIZE:
+                            await flush(marker)
+                    if slot_types:
+                        slot_buffer.append(SlotRow(row.address, slot_types))
+                        if len(slot_buffer) >= BATCH_SIZE:
+                            await flush_slots()
 
-def stream(start_block: int, end_block: int):
-    asyncio.run(stream_async(start_block, end_block))
+    for marker in markers:
+        if buffers[marker['name']]:
+            await flush(marker)
+    if slot_buffer:
+        await flush_slots()
+
+
+async def run_range(pipeline: Pipeline,
+                    checkpoints: Checkpoints,
+                    start_block: int,
+                    end_block: int,
+                    single_pass: bool = False,
+                    marker_concurrency: int = MARKER_CONCURRENCY,
+                    checkpoint_blocks: int = CHECKPOINT_BLOCKS):
+    if single_pass:
+        await execute_markers_single_pass(pipeline, start_block, end_block, checkpoints, checkpoint_blocks)
+    else:
+        await execute_markers(pipeline, start_block, end_block, checkpoints,
+                              marker_concurrency, checkpoint_blocks)
+
+    await pipeline.join()
+    await checkpoints.wait()
+
+
+async def stream_async(start_block: int,
+                       end_block: int,
+                       single_pass: bool = False,
+                       detect_workers: int = DETECT_WORKERS,
+                       write_workers: int = WRITE_WORKERS,
+                       detect_queue_size: int = DETECT_QUEUE_SIZE,
+                       write_queue_size: int = WRITE_QUEUE_SIZE,
+                       marker_concurrency: int = MARKER_CONCURRENCY,
+                       resume: bool = False,
+                       checkpoint_blocks: int = CHECKPOINT_BLOCKS,
+                       pin_block: int | bool = False):
+    # With pin_block, all node state is read at one block, the given one or
+    # with True the block of the node at the start
+    checkpoints = Checkpoints(engine, resume)
+    await checkpoints.load(start_block, end_block)
+    await create_tables()
+
+    pipeline = Pipeline(detect_workers, write_workers, detect_queue_size, write_queue_size)
+    pipeline.start()
+    exporter = MetricsExporter()
+    await exporter.start()
+
+    try:
+        pipeline.block = await pinned_block(pin_block)
+        if pin_block is not False:
+            print(f'Reading node state at block {pipeline.block}')
+        await run_range(pipeline, checkpoints, start_block, end_block,
+                        single_pass, marker_concurrency, checkpoint_blocks)
+    finally:
+        await checkpoints.cancel()
+        await pipeline.stop()
+        await exporter.stop()
+        await close_resources()
+
+
+async def get_head_block() -> int | None:
+    async with engine.connect() as conn:
+        result = await conn.execute(text("SELECT MAX(block_number) FROM public.contracts"))
+        return result.scalar()
+
+
+async def follow_start_block(checkpoints: Checkpoints, single_pass: bool, confirmations: int) -> int:
+    await checkpoints.setup()
+    start_block = await checkpoints.resume_block(
+        [SINGLE_PASS_MARKER] if single_pass else [marker['name'] for marker in markers])
+    if start_block is None:
+        start_block = (await get_head_block() or 0) - confirmations + 1
+    return start_block
+
+
+def follow_end_block(start_block: int, head_block: int | None, confirmations: int, max_blocks: int) -> int:
+    # Last block of the next window, before start_block while there is none
+    return min((head_block or 0) - confirmations, start_block + max_blocks - 1)
+
+
+async def follow_async(start_block: int | None = None,
+                       single_pass: bool = True,
+                       confirmations: int = FOLLOW_CONFIRMATIONS,
+                       poll_interval: float = FOLLOW_POLL_INTERVAL,
+                       max_blocks: int = FOLLOW_MAX_BLOCKS,
+                       detect_workers: int = DETECT_WORKERS,
+                       write_workers: int = WRITE_WORKERS,
+                       detect_queue_size: int = DETECT_QUEUE_SIZE,
+                       write_queue_size: int = WRITE_QUEUE_SIZE,
+                       marker_concurrency: int = MARKER_CONCURRENCY,
+                       checkpoint_blocks: int = CHECKPOINT_BLOCKS,
+                       pin_block: int | bool = False):
+    # Streams contracts as they are added to public.contracts, in windows of new
+    # blocks that are confirmations blocks behind the highest one. Workers, node
+    # connections and caches are kept between windows. Without start_block it
+    # continues from the first gap in the checkpoints, skipping the units
+    # completed after it, or starts at the current head. With pin_block=True,
+    # the node state of a window is read at one block, with a block number all
+    # windows read at that block.
+    global updated_at
+
+    checkpoints = Checkpoints(engine, resume=True)
+    await create_tables()
+    if start_block is None:
+        start_block = await follow_start_block(checkpoints, single_pass, confirmations)
+    await checkpoints.load(start_block, await get_head_block() or start_block)
+    print(f'Following from block {start_block}')
+
+    pipeline = Pipeline(detect_workers, write_workers, detect_queue_size, write_queue_size)
+    pipeline.start()
+    exporter = MetricsExporter()
+    await exporter.start()
+
+    try:
+        while True:
+            end_block = follow_end_block(start_block, await get_head_block(), confirmations, max_blocks)
+            if end_block < start_block:
+                await asyncio.sleep(poll_interval)
+                continue
+
+            updated_at = datetime.now(timezone.utc).replace(tzinfo=None)
+            pipeline.block = await pinned_block(pin_block)
+            started = time.monotonic()
+            await run_range(pipeline, checkpoints, start_block, end_block,
+                            single_pass, marker_concurrency, checkpoint_blocks)
+            print(f'Processed blocks {start_block}-{end_block} in {time.monotonic() - started:.1f}s')
+            start_block = end_block + 1
+    finally:
+        await checkpoints.cancel()
+        await pipeline.stop()
+        await exporter.stop()
+        await close_resources()
+
+
+def dead_letter_addresses(entries: Iterable[dict]) -> list[str]:
+    # The contracts of failed stream batches. A failed request, e.g. to the
+    # beacon of a proxy, is recorded with its contract too, so request entries
+    # are only for inspection. History entries are built again with
+    # replay_history_dead_letters.
+    addresses = []
+    for entry in entries:
+        if entry['kind'] == 'batch':
+            addresses.extend(entry['addresses'])
+    return list(dict.fromkeys(addr.lower() for addr in addresses))
+
+
+async def replay_dead_letters_async(path: str):
+    # Re-detects every contract found in the dead letters against all markers.
+    # History entries are left for replay_history_dead_letters.
+    if not os.path.exists(path):
+        print(f'No dead letters to replay at {path}')
+        return
+    addresses = dead_letter_addresses(DeadLetterLog(path).take({'rpc', 'batch'}))
+    print(f'Replaying {len(addresses)} addresses from {path}')
+    await create_tables()
+
+    pipeline = Pipeline()
+    pipeline.start()
+
+    try:
+        for chunk_start in range(0, len(addresses), BATCH_SIZE):
+            stmt = text(
+                "SELECT address, bytecode, function_sighashes "
+                "FROM public.contracts "
+                "WHERE address = ANY(:addresses)"
+            ).bindparams(addresses=addresses[chunk_start:chunk_start + BATCH_SIZE])
+            await classify_contracts(pipeline, stmt)
+
+        await pipeline.join()
+    finally:
+        await pipeline.stop()
+        await close_resources()
+
+
+def replay_dead_letters(path: str = dead_letters.path):
+    asyncio.run(replay_dead_letters_async(path))
+
+
+def stream(start_block: int,
+           end_block: int,
+           single_pass: bool = False,
+           detect_workers: int = DETECT_WORKERS,
+           write_workers: int = WRITE_WORKERS,
+           detect_queue_size: int = DETECT_QUEUE_SIZE,
+           write_queue_size: int = WRITE_QUEUE_SIZE,
+           marker_concurrency: int = MARKER_CONCURRENCY,
+           resume: bool = False,
+           checkpoint_blocks: int = CHECKPOINT_BLOCKS,
+           pin_block: int | bool = False):
+    asyncio.run(stream_async(start_block, end_block, single_pass,
+                             detect_workers, write_workers,
+                             detect_queue_size, write_queue_size,
+                             marker_concurrency, resume, checkpoint_blocks,
+                             pin_block))
+
+
+def follow(start_block: int | None = None,
+           single_pass: bool = True,
+           confirmations: int = FOLLOW_CONFIRMATIONS,
+           poll_interval: float = FOLLOW_POLL_INTERVAL,
+           max_blocks: int = FOLLOW_MAX_BLOCKS,
+           pin_block: int | bool = False):
+    asyncio.run(follow_async(start_block, single_pass, confirmations, poll_interval, max_blocks,
+                             pin_block=pin_block))
@@ -1,16 +1,23 @@
 import asyncio
+import time
+from datetime import datetime, timezone
 from typing import Callable
 
-from sqlalchemy import update
 from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.sql import text
+from web3.types import BlockIdentifier
 
-from .db import ProxyContracts, async_engine
-from .detect import (check_ara_proxy, check_comptroller_proxy,
-                     check_eip_897_proxy, check_eip_1822_proxy,
+from .db import (Base, ProxyBeacons, async_engine,
+                 copy_update_implementations, upsert_proxy_beacons)
+from .detect import (FAILED, PROXY_EVENT_TOPICS, check_ara_proxy,
+                     check_comptroller_proxy, check_eip_897_proxy,
+                     check_eip_1822_proxy, check_eip_1967_beacon_proxies,
                      check_eip_1967_beacon_proxy, check_eip_1967_direct_proxy,
                      check_gnosis_safe_proxy, check_one_to_one_proxy,
-                     check_oz_proxy, check_p_proxy_proxy)
+                     check_oz_proxy, check_p_proxy_proxy, close_resources,
+                     get_logs, pinned_block)
+from .metrics import (DB_WRITE, ROWS, STAGE_LATENCY, MetricsExporter,
+                      timed_get, timed_partitions, timed_put)
 
 engine = async_engine()
 async_session = async_sessionmaker(engine)
@@ -32,33 +39,59 @@ proxies = [
 
 BATCH_SIZE = 10000
 
+# Proxy types emitting Upgraded, BeaconUpgraded or AdminChanged when they change.
+# Proxies of other types are refreshed with a full sweep.
+EVENT_PROXY_TYPES = ['eip_1967_direct', 'eip_1967_beacon', 'oz']
+
 queue = asyncio.Queue(maxsize=4)
 
 
-async def handle_batch(rows: list[tuple], method):
+async def handle_batch(rows: list[tuple], proxy_type: str, method, block: BlockIdentifier = 'latest'):
     to_update = []
     keys = [row[1] for row in rows]
-    new_addrs = await method(keys)
+    beacon_addrs = []
+    if proxy_type == 'eip_1967_beacon':
+        beacon_addrs, new_addrs = await check_eip_1967_beacon_proxies(keys, block)
+    else:
+        new_addrs = await method(keys, block)
     for idx, row in enumerate(rows):
         new_impl = new_addrs[idx]
         old_impl = row[2]
-        if new_impl is not None and new_impl != old_impl:
+        # Proxies whose reads failed keep their implementation until the next update
+        if new_impl is not None and new_impl is not FAILED and new_impl != old_impl:
             to_update.append(
                 {"id": row[0], "implementation_address": new_impl})
 
-    if len(to_update) == 0:
+    # The beacons of beacon proxies are kept up to date for check_beacon_dependents
+    updated_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    beacons = [{'proxy_address': key, 'beacon_address': beacon, 'updated_at': updated_at}
+               for key, beacon in zip(keys, beacon_addrs) if beacon]
+
+    failed = sum(new_impl is FAILED for new_impl in new_addrs)
+    if failed:
+        print(f'Failed to check {failed} {proxy_type} proxies')
+        ROWS.inc(proxy_type, 'failed', amount=failed)
+    ROWS.inc(proxy_type, 'updated', amount=len(to_update))
+    if len(to_update) == 0 and len(beacons) == 0:
         return
 
+    started = time.perf_counter()
     async with async_session.begin() as session:
-        await session.execute(update(ProxyContracts), to_update)
+        if to_update:
+            await copy_update_implementations(await session.connection(), to_update)
+        if beacons:
+            await upsert_proxy_beacons(await session.connection(), beacons)
+    DB_WRITE.observe(time.perf_counter() - started, 'proxy_contracts')
 
 
 async def worker():
     print('Starting worker')
     while True:
-        args = await queue.get()
+        args = await timed_get(queue, 'update')
+        started = time.perf_counter()
         try:
             await handle_batch(*args)
+            STAGE_LATENCY.observe(time.perf_counter() - started, 'update')
         except Exception as err:
             print('Got exception when processing batch')
             print(err)
@@ -66,31 +99,122 @@ async def worker():
             queue.task_done()
 
 
-async def check_proxy(proxy_type: str, method: Callable[[str], str]):
+async def check_proxy(proxy_type: str, method: Callable[[str], str], block: BlockIdentifier = 'latest'):
     async with engine.connect() as conn:
         conn = await conn.execution_options(yield_per=BATCH_SIZE)
         stmt = text(
             f"SELECT id, proxy_address, implementation_address FROM public.proxy_contracts WHERE proxy_type='{proxy_type}'")
         async with conn.stream(stmt) as result:
             idx = 0
-            async for partition in result.partitions(BATCH_SIZE):
-                await queue.put((partition, method))
+            async for partition in timed_partitions(result, BATCH_SIZE, proxy_type):
+                ROWS.inc(proxy_type, 'candidate', amount=len(partition))
+                await timed_put(queue, 'update', (partition, proxy_type, method, block))
                 print(f"added {proxy_type}-{idx} to queue")
                 idx += 1
 
 
-async def update_existing_async():
+async def create_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all, tables=[ProxyBeacons.__table__])
+
+
+async def update_existing_async(pin_block: int | bool = False):
+    # With pin_block, all proxies are read at one block, the given one or with
+    # True the block of the node at the start
+    await create_tables()
     workers = [asyncio.create_task(worker()) for _ in range(1)]
+    exporter = MetricsExporter()
+    await exporter.start()
+
+    try:
+        block = await pinned_block(pin_block)
+        for proxy in proxies:
+            await check_proxy(proxy['name'], proxy['method'], block)
+
+        await queue.join()
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await exporter.stop()
+        await close_resources()
+
+
+def update_existing(pin_block: int | bool = False):
+    asyncio.run(update_existing_async(pin_block))
 
-    for proxy in proxies:
-        await check_proxy(proxy['name'], proxy['method'])
 
-    await queue.join()
+async def get_event_emitters(start_block: int, end_block: int) -> set[str]:
+    logs = await get_logs(start_block, end_block, PROXY_EVENT_TOPICS)
+    return {log['address'].lower() for log in logs}
 
-    for task in workers:
-        task.cancel()
-    await asyncio.gather(*workers, return_exceptions=True)
+
+async def check_emitting_proxies(proxy_type: str,
+                                 method: Callable[[str], str],
+                                 emitters: set[str],
+                                 block: BlockIdentifier = 'latest'):
+    addresses = list(emitters)
+    async with engine.connect() as conn:
+        for chunk_start in range(0, len(addresses), BATCH_SIZE):
+            stmt = text(
+                "SELECT id, proxy_address, implementation_address FROM public.proxy_contracts "
+                "WHERE proxy_type = :proxy_type AND proxy_address = ANY(:addresses)"
+            ).bindparams(proxy_type=proxy_type, addresses=addresses[chunk_start:chunk_start + BATCH_SIZE])
+            rows = (await conn.execute(stmt)).all()
+            ROWS.inc(proxy_type, 'candidate', amount=len(rows))
+            if rows:
+                await timed_put(queue, 'update', (rows, proxy_type, method, block))
+                print(f"added {len(rows)} {proxy_type} to queue")
+
+
+async def check_beacon_dependents(method: Callable[[str], str], emitters: set[str], block: BlockIdentifier = 'latest'):
+    # A beacon emits Upgraded itself, so the proxies following an upgraded
+    # beacon are looked up in proxy_beacons. Proxies with no beacon recorded yet
+    # are checked too, which records their beacon.
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(yield_per=BATCH_SIZE)
+        stmt = text(
+            "SELECT c.id, c.proxy_address, c.implementation_address FROM public.proxy_contracts c "
+            "LEFT JOIN public.proxy_beacons b ON b.proxy_address = c.proxy_address "
+            "WHERE c.proxy_type = 'eip_1967_beacon' AND (b.proxy_address IS NULL "
+            "OR c.proxy_address = ANY(:emitters) OR b.beacon_address = ANY(:emitters))"
+        ).bindparams(emitters=list(emitters))
+        async with conn.stream(stmt) as result:
+            async for partition in timed_partitions(result, BATCH_SIZE, 'eip_1967_beacon'):
+                ROWS.inc('eip_1967_beacon', 'candidate', amount=len(partition))
+                await timed_put(queue, 'update', (partition, 'eip_1967_beacon', method, block))
+                print(f"added {len(partition)} eip_1967_beacon to queue")
 
 
-def update_existing():
-    asyncio.run(update_existing_async())
+async def update_from_logs_async(start_block: int, end_block: int, sweep: bool = True, pin_block: int | bool = False):
+    # Re-checks only the proxies that emitted upgrade events in the block range,
+    # and with sweep, every proxy of the types that emit none.
+    await create_tables()
+    workers = [asyncio.create_task(worker()) for _ in range(1)]
+    exporter = MetricsExporter()
+    await exporter.start()
+
+    try:
+        block = await pinned_block(pin_block)
+        emitters = await get_event_emitters(start_block, end_block)
+        print(f"found {len(emitters)} contracts with upgrade events in {start_block}-{end_block}")
+
+        for proxy in proxies:
+            if proxy['name'] == 'eip_1967_beacon':
+                await check_beacon_dependents(proxy['method'], emitters, block)
+            elif proxy['name'] in EVENT_PROXY_TYPES:
+                await check_emitting_proxies(proxy['name'], proxy['method'], emitters, block)
+            elif sweep:
+                await check_proxy(proxy['name'], proxy['method'], block)
+
+        await queue.join()
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await exporter.stop()
+        await close_resources()
+
+
+def update_from_logs(start_block: int, end_block: int, sweep: bool = True, pin_block: int | bool = False):
+    asyncio.run(update_from_logs_async(start_block, end_block, sweep, pin_block))
@@ -1,5 +1,67 @@
-from ethereum_proxy_etl.detect import parse_1167_bytecode
+import pytest
+
+from ethereum_proxy_etl.bytecode import (iter_push_operands,
+                                         parse_1167_bytecode,
+                                         parse_many_to_one_bytecode)
+from ethereum_proxy_etl.detect import (block_params, read_address,
+                                       read_addresses, to_block_param)
+
 
 def test_parse_1167_bytecode():
     addr = parse_1167_bytecode('0x363d3d373d3d3d363d73f62849f9a0b5bf2913b396098f7c7019b51a820a5af43d82803e903d91602b57fd5bf3000000000000000000000000000000000000000000000000000000000000007a6900000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000')
-    assert addr == '0xf62849f9a0b5bf2913b396098f7c7019b51a820a'
\ No newline at end of file
+    assert addr == '0xf62849f9a0b5bf2913b396098f7c7019b51a820a'
+
+def test_read_addresses():
+    assert read_addresses([
+        '0x0000000000000000000000004bd844f72a8edd323056130a86fc624d0dbcf5b0',
+        '0x0000000000000000000000000000000000000000000000000000000000000000',
+        '0x4BD844F72A8EDD323056130A86FC624D0DBCF5B0',
+        '0x',
+        None,
+    ]) == [
+        '0x4bd844f72a8edd323056130a86fc624d0dbcf5b0',
+        None,
+        '0x4bd844f72a8edd323056130a86fc624d0dbcf5b0',
+        None,
+        None,
+    ]
+
+
+def test_read_addresses_invalid_hex():
+    assert read_addresses([
+        '0x4bd844f72a8edd323056130a86fc624d0dbcf5b0',
+        '0x4bd844f72a8edd323056130a86fc624d0dbcf5bz',
+        '0x4bd844f72a8edd323056130a86fc624d0dbcf5 0',
+    ]) == ['0x4bd844f72a8edd323056130a86fc624d0dbcf5b0', None, None]
+
+
+def test_read_address():
+    assert read_address('0x4bd844f72a8edd323056130a86fc624d0dbcf5b0') == '0x4bd844f72a8edd323056130a86fc624d0dbcf5b0'
+    with pytest.raises(ValueError):
+        read_address('0x0000000000000000000000000000000000000000')
+
+
+MANY_TO_ONE_BYTECODE = '0x60806040523661001357610011610017565b005b6100115b61001f61002f565b61002f61002a610031565b6101b0565b565b60405160009081906060906001600160a01b037f000000000000000000000000ffde4785e980a99fe10e6a87a67d243664b91b25169083818181855afa9150503d806000811461009d576040519150601f19603f3d011682016040523d82523d6000602084013e6100a2565b606091505b50915091508181906101325760405162461bcd60e51b81526004018080602001828103825283818151815260200191508051906020019080838360005b838110156100f75781810151838201526020016100df565b50505050905090810190601f1680156101245780820380516001836020036101000a031916815260200191505b509250505060405180910390fd5b50600081806020019051602081101561014a57600080fd5b505190506001600160a01b0381166101a9576040805162461bcd60e51b815260206004820152601760248201527f4552525f4e554c4c5f494d504c454d454e544154494f4e000000000000000000604482015290519081900360640190fd5b9250505090565b3660008037600080366000845af43d6000803e8080156101cf573d6000f35b3d6000fdfea26469706673582212209b0f8ebe5564b0d1fb938189635d5a7b33088937e2d48e4ff88b4fcf7c850bb164736f6c634300060c0033'
+
+
+def test_parse_many_to_one_bytecode():
+    addr = parse_many_to_one_bytecode(MANY_TO_ONE_BYTECODE)
+    assert addr == '0xffde4785e980a99fe10e6a87a67d243664b91b25'
+    with pytest.raises(ValueError):
+        parse_many_to_one_bytecode('0x6080')
+
+
+def test_iter_push_operands():
+    # PUSH2 0x7f7f, PUSH1 0x01, JUMPDEST, truncated PUSH4
+    code = bytes.fromhex('617f7f60015b63aabb')
+    assert list(iter_push_operands(code)) == [(0, bytes.fromhex('7f7f')), (3, bytes.fromhex('01'))]
+    assert list(iter_push_operands(code, (1,))) == [(3, bytes.fromhex('01'))]
+
+
+def test_block_params():
+    assert to_block_param(1000) == '0x3e8'
+    assert to_block_param(0) == '0x0'
+    assert to_block_param(None) == 'latest'
+    assert to_block_param('safe') == 'safe'
+    assert block_params('latest', 2) == ['latest', 'latest']
+    assert block_params([1, 'latest'], 2) == ['0x1', 'latest']
@@ -0,0 +1,63 @@
+import pytest
+
+from ethereum_proxy_etl.history import find_changes, history_rows
+
+IMPL_A = '0x' + 'a' * 40
+IMPL_B = '0x' + 'b' * 40
+IMPL_C = '0x' + 'c' * 40
+
+# Upgrade points of each proxy, (block, implementation)
+TIMELINES = {
+    '0x1': [(0, IMPL_A), (1000, IMPL_B), (5000, IMPL_C)],
+    '0x2': [(0, None), (3333, IMPL_A)],
+    '0x3': [(0, IMPL_A)],
+}
+
+
+def implementation_at(addr, block):
+    impl = None
+    for from_block, timeline_impl in TIMELINES[addr]:
+        if from_block <= block:
+            impl = timeline_impl
+    return impl
+
+
+@pytest.mark.asyncio
+async def test_find_changes():
+    calls = []
+
+    async def check_proxy(addrs, blocks):
+        calls.append(len(addrs))
+        return [implementation_at(addr, block) for addr, block in zip(addrs, blocks)]
+
+    changes = await find_changes(check_proxy, list(TIMELINES), 0, 9999)
+
+    assert changes == [
+        [(0, IMPL_A), (1000, IMPL_B), (5000, IMPL_C)],
+        [(0, None), (3333, IMPL_A)],
+        [(0, IMPL_A)],
+    ]
+    # One batched call per round of the bisection
+    assert len(calls) <= 2 + 14
+
+
+@pytest.mark.asyncio
+async def test_find_changes_raises_on_failed_reads():
+    rounds = []
+
+    async def check_proxy(addrs, blocks):
+        rounds.append(blocks)
+        if len(rounds) == 3:
+            raise ValueError('eth_getStorageAt failed')
+        return [implementation_at(addr, block) for addr, block in zip(addrs, blocks)]
+
+    with pytest.raises(ValueError):
+        await find_changes(check_proxy, list(TIMELINES), 0, 9999)
+
+
+def test_history_rows():
+    rows = history_rows('0x2', 'oz', [(0, None), (3333, IMPL_A), (5000, IMPL_B)], 9999)
+    assert [(row['implementation_address'], row['from_block'], row['to_block']) for row in rows] == [
+        (IMPL_A, 3333, 4999),
+        (IMPL_B, 5000, 9999),
+    ]
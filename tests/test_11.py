@@ -0,0 +1,33 @@
+import pytest
+
+from benchmarks.mock_node import MockNode, SyntheticChain
+from ethereum_proxy_etl import batching, detect
+from ethereum_proxy_etl.provider import NodeProviderPool
+from ethereum_proxy_etl.stream import markers
+
+
+@pytest.mark.asyncio
+async def test_check_proxies_against_mock_node(monkeypatch, tmp_path):
+    monkeypatch.setattr(batching, 'RPC_RETRY_BACKOFF', 0)
+    monkeypatch.setattr(batching.dead_letters, 'path', str(tmp_path / 'dead-letter.jsonl'))
+    chain = SyntheticChain(30)
+    node = MockNode(chain, error_rate=0.2)
+    url = await node.start()
+    provider = NodeProviderPool([url])
+    monkeypatch.setattr(detect, 'node_provider', provider)
+
+    try:
+        for marker in markers:
+            proxies = chain.proxies[marker['name']]
+            if marker['select'] == 'bytecode':
+                keys = [chain.bytecodes[proxy] for proxy, _ in proxies]
+            else:
+                keys = [proxy for proxy, _ in proxies]
+            assert await marker['method'](keys) == [impl for _, impl in proxies], marker['name']
+    finally:
+        await provider.close()
+        await node.stop()
+
+    # Failed requests were retried
+    assert node.failed
+    assert not list(batching.dead_letters.read())
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from ethereum_proxy_etl import metrics
+from ethereum_proxy_etl.metrics import (SIZE_BUCKETS, Registry, timed_get,
+                                        timed_partitions)
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    errors = registry.counter('rpc_errors_total', 'Failed requests', ('method', 'kind'))
+    depth = registry.gauge('queue_depth', 'Items waiting', ('stage',))
+    sizes = registry.histogram('rpc_batch_size', 'Batch sizes', ('method',), SIZE_BUCKETS)
+    registry.counter('unused_total', 'Never incremented')
+
+    errors.inc('eth_call', 'request')
+    errors.inc('eth_call', 'request', amount=2)
+    depth.set(3, 'detect')
+    for size in (1, 80, 100, 20000):
+        sizes.observe(size, 'eth_call')
+
+    text = registry.render()
+    assert 'rpc_errors_total{method="eth_call",kind="request"} 3' in text
+    assert 'queue_depth{stage="detect"} 3' in text
+    assert 'rpc_batch_size_bucket{method="eth_call",le="1"} 1' in text
+    assert 'rpc_batch_size_bucket{method="eth_call",le="100"} 3' in text
+    assert 'rpc_batch_size_bucket{method="eth_call",le="+Inf"} 4' in text
+    assert 'rpc_batch_size_sum{method="eth_call"} 20181' in text
+    assert 'rpc_batch_size_count{method="eth_call"} 4' in text
+
+    snapshot = registry.snapshot()
+    assert 'unused_total' not in snapshot
+    assert snapshot['rpc_errors_total'] == {'eth_call/request': 3}
+    assert snapshot['rpc_batch_size']['eth_call']['p50'] == 100
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def partitions(self, size):
+        for start in range(0, len(self.rows), size):
+            await asyncio.sleep(0)
+            yield self.rows[start:start + size]
+
+
+@pytest.mark.asyncio
+async def test_timed_partitions_and_queues():
+    partitions = [partition async for partition in timed_partitions(FakeResult(list(range(5))), 2, 'test_source')]
+    assert partitions == [[0, 1], [2, 3], [4]]
+    assert sum(metrics.DB_FETCH.counts[('test_source',)]) == 3
+
+    queue = asyncio.Queue()
+    asyncio.get_running_loop().call_later(0.02, queue.put_nowait, 'item')
+    assert await timed_get(queue, 'test_stage') == 'item'
+    assert metrics.WORKER_IDLE.values[('test_stage',)] >= 0.01
+    assert metrics.QUEUE_DEPTH.values[('test_stage',)] == 0
@@ -0,0 +1,53 @@
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ethereum_proxy_etl.insert import (BATCH_SCHEMA, COLUMNS, merge,
+                                       partition_batches)
+
+
+def write_batch(path, rows):
+    pq.write_table(pa.Table.from_pylist([dict(zip(COLUMNS, row)) for row in rows], schema=BATCH_SCHEMA), path)
+    return str(path)
+
+
+def test_merge_resolves_duplicates_by_priority(tmp_path):
+    paths = [
+        write_batch(tmp_path / 'eip_897.parquet', [
+            ('0xaa01', 'eip_897', '0x01', 't'),
+            ('0xab02', 'eip_897', '0x02', 't'),
+            ('0xcc03', 'eip_897', '0x03', 't'),
+        ]),
+        write_batch(tmp_path / 'eip_1967_beacon.parquet', [
+            ('0xaa01', 'eip_1967_beacon', '0x09', 't'),
+            ('0xcc03', 'eip_1967_beacon', '0x03', 't'),
+        ]),
+        write_batch(tmp_path / 'oz.parquet', [
+            ('0xdd04', 'oz', '0x04', 't'),
+        ]),
+    ]
+    partition_batches(paths, str(tmp_path / 'combined'))
+    assert sorted(os.listdir(tmp_path / 'combined')) == ['aa', 'ab', 'cc', 'dd']
+
+    assert merge(str(tmp_path / 'combined'), str(tmp_path / 'combined.csv')) == 0
+    df = pd.read_csv(tmp_path / 'combined.csv').sort_values('proxy_address')
+    assert df.values.tolist() == [
+        ['0xaa01', 'eip_1967_beacon', '0x09', 't'],
+        ['0xab02', 'eip_897', '0x02', 't'],
+        ['0xcc03', 'eip_1967_beacon', '0x03', 't'],
+        ['0xdd04', 'oz', '0x04', 't'],
+    ]
+
+
+def test_merge_fails_on_unhandled_duplicates(tmp_path):
+    paths = [
+        write_batch(tmp_path / 'oz.parquet', [('0xaa01', 'oz', '0x01', 't')]),
+        write_batch(tmp_path / 'eip_1822.parquet', [('0xaa01', 'eip_1822', '0x02', 't')]),
+    ]
+    partition_batches(paths, str(tmp_path / 'combined'))
+
+    assert merge(str(tmp_path / 'combined'), str(tmp_path / 'combined.csv')) == 1
+    assert not os.path.exists(tmp_path / 'combined.csv')
+    assert not os.path.exists(tmp_path / 'combined.csv.tmp')
@@ -0,0 +1,100 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from ethereum_proxy_etl.db import (copy_update_implementations,
+                                   copy_upsert_proxy_contracts,
+                                   upsert_proxy_beacons)
+
+UPDATED_AT = datetime(2024, 1, 1)
+
+
+class FakeDriverConnection:
+    def __init__(self):
+        self.copies = []
+
+    async def copy_records_to_table(self, table, records, columns):
+        self.copies.append((table, list(records), columns))
+
+
+class FakeRawConnection:
+    def __init__(self):
+        self.driver_connection = FakeDriverConnection()
+
+
+class FakeConnection:
+    # Records the statements an AsyncConnection would run
+    def __init__(self):
+        self.raw = FakeRawConnection()
+        self.statements = []
+        self.executed = []
+
+    async def exec_driver_sql(self, statement):
+        self.statements.append(statement)
+
+    async def get_raw_connection(self):
+        return self.raw
+
+    async def execute(self, statement, parameters=None):
+        self.executed.append((str(statement.compile(dialect=postgresql.dialect())), parameters))
+
+
+def row(address, proxy_type, implementation):
+    return {'proxy_address': address, 'proxy_type': proxy_type,
+            'implementation_address': implementation, 'updated_at': UPDATED_AT}
+
+
+@pytest.mark.asyncio
+async def test_copy_upsert_proxy_contracts():
+    conn = FakeConnection()
+    rows = [row('0x02', 'eip_1967_direct', '0xd1'), row('0x01', 'oz', '0xd2'), row('0x02', 'eip_1967_beacon', '0xd3')]
+    await copy_upsert_proxy_contracts(conn, rows)
+
+    table, records, columns = conn.raw.driver_connection.copies[0]
+    assert table == 'proxy_contracts_staging'
+    assert columns == ['seq', 'proxy_address', 'proxy_type', 'implementation_address', 'updated_at']
+    assert records == [
+        (0, '0x02', 'eip_1967_direct', '0xd1', UPDATED_AT),
+        (1, '0x01', 'oz', '0xd2', UPDATED_AT),
+        (2, '0x02', 'eip_1967_beacon', '0xd3', UPDATED_AT),
+    ]
+
+    create, truncate, merge = conn.statements
+    assert create.startswith('CREATE TEMP TABLE IF NOT EXISTS proxy_contracts_staging')
+    assert 'ON COMMIT DELETE ROWS' in create
+    assert truncate == 'TRUNCATE proxy_contracts_staging'
+    # One row per address, in address order, preferring the type that wins the override rule
+    assert 'SELECT DISTINCT ON (proxy_address)' in merge
+    assert "ORDER BY proxy_address, CASE proxy_type WHEN 'eip_1967_beacon' THEN 0" in merge
+    assert 'ON CONFLICT (proxy_address) DO UPDATE SET' in merge
+    assert "proxy_contracts.proxy_type = 'eip_897' AND excluded.proxy_type = 'eip_1967_beacon'" in merge
+
+
+@pytest.mark.asyncio
+async def test_copy_update_implementations():
+    conn = FakeConnection()
+    await copy_update_implementations(conn, [{'id': 7, 'implementation_address': '0xd1'},
+                                             {'id': 9, 'implementation_address': '0xd2'}])
+
+    table, records, columns = conn.raw.driver_connection.copies[0]
+    assert table == 'proxy_implementations_staging'
+    assert columns == ['id', 'implementation_address']
+    assert records == [(7, '0xd1'), (9, '0xd2')]
+    assert conn.statements[1] == 'TRUNCATE proxy_implementations_staging'
+    assert conn.statements[2].startswith('UPDATE proxy_contracts SET implementation_address = staging.implementation_address')
+    assert 'WHERE proxy_contracts.id = staging.id' in conn.statements[2]
+
+
+@pytest.mark.asyncio
+async def test_upsert_proxy_beacons_in_address_order():
+    conn = FakeConnection()
+    await upsert_proxy_beacons(conn, [
+        {'proxy_address': '0x02', 'beacon_address': '0xb1', 'updated_at': UPDATED_AT},
+        {'proxy_address': '0x01', 'beacon_address': '0xb1', 'updated_at': UPDATED_AT},
+    ])
+
+    statement, parameters = conn.executed[0]
+    assert statement.startswith('INSERT INTO proxy_beacons')
+    assert 'ON CONFLICT (proxy_address) DO UPDATE SET beacon_address = excluded.beacon_address' in statement
+    assert [params['proxy_address'] for params in parameters] == ['0x01', '0x02']
@@ -0,0 +1,14 @@
+from ethereum_proxy_etl.matcher import MultiPatternMatcher
+
+
+def test_multi_pattern_matcher():
+    matcher = MultiPatternMatcher(['0x363d3d', '3d3d37', 'a3f0ad', 'ffff'])
+    assert matcher.match('0x363d3d373d3d3d363d73') == {'0x363d3d', '3d3d37'}
+    assert matcher.match('0x6080a3f0ad') == {'a3f0ad'}
+    assert matcher.match('0x6080') == set()
+
+
+def test_multi_pattern_matcher_prefixes():
+    matcher = MultiPatternMatcher(['0x36', '0x363d', '3d'])
+    assert matcher.match('0x363d') == {'0x36', '0x363d', '3d'}
+    assert matcher.match('0x3600') == {'0x36'}
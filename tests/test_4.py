@@ -0,0 +1,183 @@
+import pytest
+from web3 import Web3
+
+from ethereum_proxy_etl import detect
+from ethereum_proxy_etl.cache import LRUCache
+from ethereum_proxy_etl.detect import (ADMIN_CHANGED_TOPIC,
+                                       BEACON_UPGRADED_TOPIC,
+                                       EIP_1967_BEACON_SLOT, EIP_1967_LOGIC_SLOT,
+                                       OPEN_ZEPPELIN_IMPLEMENTATION_SLOT,
+                                       PROXY_EVENT_TOPICS, UPGRADED_TOPIC,
+                                       check_eip_1967_beacon_proxy,
+                                       check_slot_proxies, get_logs)
+
+PROXY = '0x00fdae9174357424a78afaad98da36fd66dd9e03'
+BEACON = '0xdd4e2eb37268b047f55fc5caf22837f9ec08a881'
+IMPL_1967 = '0x4bd844f72a8edd323056130a86fc624d0dbcf5b0'
+IMPL_OZ = '0xeb6cb99538bcf417f7a64a4ad81fce9b9714cde8'
+IMPL_BEACON = '0xe5c048792dcf2e4a56000c8b6a47f21df22752d1'
+BEACON_2 = '0x5a2a4f2f3c18f09179b6703e63d9edd165909073'
+IMPL_BEACON_2 = '0x2d5d7d31f671f86c782533cc367f14109a082712'
+
+
+def word(addr):
+    return '0x' + addr[2:].rjust(64, '0')
+
+
+class FakeProvider:
+    def __init__(self):
+        self.calls = []
+
+    async def batch_requests(self, method, params):
+        self.calls.append((method, params))
+        responses = []
+        for idx, param in enumerate(params):
+            if method == 'eth_getStorageAt':
+                result = {
+                    EIP_1967_LOGIC_SLOT: word(IMPL_1967),
+                    OPEN_ZEPPELIN_IMPLEMENTATION_SLOT: word(IMPL_OZ),
+                    EIP_1967_BEACON_SLOT: word(BEACON),
+                }[param[1]]
+            else:
+                result = word(IMPL_BEACON)
+            responses.append({'jsonrpc': '2.0', 'id': idx, 'result': result})
+        return responses
+
+
+@pytest.mark.asyncio
+async def test_check_slot_proxies(monkeypatch):
+    provider = FakeProvider()
+    monkeypatch.setattr(detect, 'node_provider', provider)
+
+    res, beacons = await check_slot_proxies({
+        'eip_1967_direct': [PROXY],
+        'oz': [PROXY],
+        'eip_1967_beacon': [PROXY],
+    })
+
+    assert res == {
+        'eip_1967_direct': [IMPL_1967],
+        'oz': [IMPL_OZ],
+        'eip_1967_beacon': [IMPL_BEACON],
+    }
+    assert beacons == [BEACON]
+    storage_calls = [params for method, params in provider.calls if method == 'eth_getStorageAt']
+    assert len(storage_calls) == 1
+    assert len(storage_calls[0]) == 3
+
+
+class FakeLogProvider:
+    def __init__(self, logs):
+        self.logs = logs
+        self.ranges = []
+
+    async def batch_requests(self, method, params):
+        responses = []
+        for idx, [param] in enumerate(params):
+            start, end = int(param['fromBlock'], 16), int(param['toBlock'], 16)
+            self.ranges.append((start, end))
+            if end - start >= 100:
+                responses.append({'jsonrpc': '2.0', 'id': idx,
+                                  'error': {'code': -32602, 'message': 'query returned more than 10000 results'}})
+                continue
+            responses.append({'jsonrpc': '2.0', 'id': idx, 'result': [
+                log for log in self.logs if start <= log['blockNumber'] <= end and log['topics'][0] in param['topics'][0]]})
+        return responses
+
+
+@pytest.mark.asyncio
+async def test_get_logs_splits_refused_ranges(monkeypatch):
+    logs = [{'address': PROXY, 'blockNumber': block, 'topics': [UPGRADED_TOPIC]} for block in (0, 150, 299)]
+    provider = FakeLogProvider(logs)
+    monkeypatch.setattr(detect, 'node_provider', provider)
+
+    res = await get_logs(0, 299, PROXY_EVENT_TOPICS, chunk_blocks=200)
+
+    assert [log['blockNumber'] for log in res] == [0, 150, 299]
+    assert (0, 199) in provider.ranges
+    assert max(end - start for start, end in provider.ranges if (start, end) != (0, 199)) < 100
+
+
+def test_proxy_event_topics():
+    assert UPGRADED_TOPIC == Web3.keccak(text='Upgraded(address)').hex()
+    assert BEACON_UPGRADED_TOPIC == Web3.keccak(text='BeaconUpgraded(address)').hex()
+    assert ADMIN_CHANGED_TOPIC == Web3.keccak(text='AdminChanged(address,address)').hex()
+
+
+@pytest.mark.asyncio
+async def test_results_at_block_number_are_cached(monkeypatch):
+    provider = FakeProvider()
+    monkeypatch.setattr(detect, 'node_provider', provider)
+    monkeypatch.setattr(detect, 'rpc_result_cache', LRUCache(100))
+
+    assert await check_eip_1967_beacon_proxy([PROXY], 1000) == [IMPL_BEACON]
+    calls = len(provider.calls)
+    assert await check_eip_1967_beacon_proxy([PROXY], 1000) == [IMPL_BEACON]
+    assert len(provider.calls) == calls
+
+    await check_eip_1967_beacon_proxy([PROXY], 'latest')
+    assert len(provider.calls) > calls
+
+
+class BeaconProvider:
+    # PROXY_0-PROXY_5 follow BEACON with implementation(), PROXY_6-PROXY_9 follow
+    # BEACON_2 with childImplementation() only
+    def __init__(self):
+        self.calls = []
+
+    async def batch_requests(self, method, params):
+        self.calls.append((method, params))
+        responses = []
+        for idx, param in enumerate(params):
+            if method == 'eth_getStorageAt':
+                result = word(BEACON if int(param[0], 16) < 6 else BEACON_2)
+            elif param[0]['to'] == BEACON:
+                result = word(IMPL_BEACON)
+            elif param[0]['data'] == detect.EIP_1167_BEACON_METHODS[1]:
+                result = word(IMPL_BEACON_2)
+            else:
+                result = '0x'
+            responses.append({'jsonrpc': '2.0', 'id': idx, 'result': result})
+        return responses
+
+
+@pytest.mark.asyncio
+async def test_beacons_are_called_once(monkeypatch):
+    provider = BeaconProvider()
+    monkeypatch.setattr(detect, 'node_provider', provider)
+    monkeypatch.setattr(detect, 'beacon_cache', LRUCache(100))
+    proxies = [f'0x{idx:040x}' for idx in range(10)]
+
+    assert await check_eip_1967_beacon_proxy(proxies) == [IMPL_BEACON] * 6 + [IMPL_BEACON_2] * 4
+    calls = [params for method, params in provider.calls if method == 'eth_call']
+    assert [[param[0]['to'] for param in params] for params in calls] == [[BEACON, BEACON_2], [BEACON_2]]
+
+    # At 'latest', the beacons are reused until BEACON_CACHE_TTL runs out
+    provider.calls = []
+    assert await check_eip_1967_beacon_proxy(proxies) == [IMPL_BEACON] * 6 + [IMPL_BEACON_2] * 4
+    assert [method for method, _ in provider.calls] == ['eth_getStorageAt']
+
+    monkeypatch.setattr(detect, 'BEACON_CACHE_TTL', 0)
+    monkeypatch.setattr(detect, 'beacon_cache', LRUCache(100))
+    await check_eip_1967_beacon_proxy(proxies)
+    provider.calls = []
+    await check_eip_1967_beacon_proxy(proxies)
+    assert len([method for method, _ in provider.calls if method == 'eth_call']) == 2
+
+
+@pytest.mark.asyncio
+async def test_beacon_slot_is_read_once(monkeypatch):
+    from ethereum_proxy_etl.stream import MarkerRow, SlotRow, handle_batch, handle_slot_batch
+
+    provider = FakeProvider()
+    monkeypatch.setattr(detect, 'node_provider', provider)
+    monkeypatch.setattr(detect, 'beacon_cache', LRUCache(100))
+
+    [batch] = await handle_batch('eip_1967_beacon-0', 'eip_1967_beacon', check_eip_1967_beacon_proxy,
+                                 [MarkerRow(PROXY, PROXY)])
+    assert batch[0]['implementation_address'] == IMPL_BEACON
+    assert batch[0]['beacon_address'] == BEACON
+
+    [batch] = await handle_slot_batch('slot-0', [SlotRow(PROXY, ['eip_1967_beacon'])])
+    assert batch[0]['beacon_address'] == BEACON
+    assert [method for method, _ in provider.calls].count('eth_getStorageAt') == 2
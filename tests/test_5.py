@@ -0,0 +1,140 @@
+import asyncio
+
+import pytest
+from aiohttp import ClientConnectionError
+
+from ethereum_proxy_etl import batching
+from ethereum_proxy_etl.batching import AdaptiveBatchSizer, run_batched
+from ethereum_proxy_etl.provider import BatchTooLargeError
+
+
+def test_adaptive_batch_sizer():
+    sizer = AdaptiveBatchSizer(initial_size=100, max_size=200, target_latency=1.0)
+    sizer.record_success(100, 0.1)
+    assert sizer.size == 110
+    sizer.record_success(110, 2.0)
+    assert sizer.size == 55
+    sizer.record_too_large(55)
+    assert sizer.max_size == 27
+    assert sizer.size == 27
+
+
+@pytest.mark.asyncio
+async def test_run_batched_splits_too_large(monkeypatch):
+    monkeypatch.setitem(batching.batch_sizers, 'test_method',
+                        AdaptiveBatchSizer(initial_size=8, max_size=8))
+    sizes = []
+
+    async def fetch(chunk):
+        if len(chunk) > 2:
+            raise BatchTooLargeError('batch too large')
+        sizes.append(len(chunk))
+        return [item * 2 for item in chunk]
+
+    res = await run_batched('test_method', list(range(20)), fetch)
+    assert res == [item * 2 for item in range(20)]
+    assert max(sizes) <= 2
+    assert batching.batch_sizers['test_method'].max_size <= 2
+
+
+@pytest.mark.asyncio
+async def test_send_with_retry_isolates_bad_elements(monkeypatch, tmp_path):
+    monkeypatch.setattr(batching, 'RPC_RETRY_BACKOFF', 0)
+    monkeypatch.setattr(batching.dead_letters, 'path', str(tmp_path / 'dead-letter.jsonl'))
+    flaky = {'attempts': 0}
+
+    async def send(params):
+        if 'bad' in params:
+            raise batching.RPCBatchError('server error')
+        flaky['attempts'] += 1
+        return [{'id': idx, 'error': {'code': -32603, 'message': 'internal error'}}
+                if param == 'flaky' and flaky['attempts'] < 3 else {'id': idx, 'result': param}
+                for idx, param in enumerate(params)]
+
+    params = ['a', 'b', 'flaky', 'bad', 'c']
+    res = await batching.send_with_retry('eth_call', params, send, retries=2)
+
+    assert [r.get('result') for r in res] == ['a', 'b', 'flaky', None, 'c']
+    assert [batching.is_failed_response(r) for r in res] == [False, False, False, True, False]
+    entries = list(batching.dead_letters.read())
+    assert len(entries) == 1
+    assert entries[0]['kind'] == 'rpc'
+    assert entries[0]['params'] == 'bad'
+
+
+@pytest.mark.asyncio
+async def test_send_with_retry_raises_when_node_unreachable(monkeypatch, tmp_path):
+    monkeypatch.setattr(batching, 'RPC_RETRY_BACKOFF', 0)
+    monkeypatch.setattr(batching.dead_letters, 'path', str(tmp_path / 'dead-letter.jsonl'))
+    sent = []
+
+    async def send(params):
+        sent.append(params)
+        raise ClientConnectionError('connection refused')
+
+    with pytest.raises(ClientConnectionError):
+        await batching.send_with_retry('eth_call', list(range(100)), send, retries=2)
+
+    assert len(sent) == 3
+    assert not list(batching.dead_letters.read())
+
+
+@pytest.mark.asyncio
+async def test_failed_requests_fail_only_their_contracts(monkeypatch, tmp_path):
+    from ethereum_proxy_etl import detect, stream
+    from ethereum_proxy_etl.deadletter import DeadLetterLog
+    from ethereum_proxy_etl.stream import MarkerRow, dead_letter_addresses
+
+    async def rpc_batch_request(method, params_list):
+        return [batching.failed_response('server error') if params == 'bad' else {'id': 0, 'result': params}
+                for params in params_list]
+
+    monkeypatch.setattr(detect, 'rpc_batch_request', rpc_batch_request)
+    assert await detect.rpc_batch_results('eth_chainId', ['a', 'bad']) == ['a', batching.FAILED]
+
+    async def rpc_batch_request(method, params_list):
+        return [{'id': 0, 'error': {'code': -32000, 'message': params}} for params in params_list]
+
+    monkeypatch.setattr(detect, 'rpc_batch_request', rpc_batch_request)
+    assert await detect.rpc_batch_results('eth_chainId', ['execution reverted', 'missing trie node']) == \
+        [None, batching.FAILED]
+
+    # The resolved proxies of a batch are written, only the failed one is dead-lettered
+    async def check_proxy(keys, block):
+        return [{'0x01': '0xd1', '0x02': batching.FAILED, '0x03': None}[key] for key in keys]
+
+    monkeypatch.setattr(stream, 'dead_letters', DeadLetterLog(str(tmp_path / 'dead-letter.jsonl')))
+    partition = [MarkerRow(addr, addr) for addr in ('0x01', '0x02', '0x03')]
+    batches = await stream.handle_batch('oz-0', 'oz', check_proxy, partition)
+    assert [row['proxy_address'] for row in batches[0]] == ['0x01']
+    assert dead_letter_addresses(stream.dead_letters.read()) == ['0x02']
+
+    entries = [{'kind': 'rpc', 'method': 'eth_call', 'params': [{'to': '0xBEACON'}, 'latest']},
+               {'kind': 'batch', 'proxy_type': 'eip_1967_beacon', 'addresses': ['0xPROXY', '0xproxy']},
+               {'kind': 'history', 'proxy_type': 'oz', 'addresses': ['0xother']}]
+    assert dead_letter_addresses(entries) == ['0xproxy']
+
+
+@pytest.mark.asyncio
+async def test_batch_size_ignores_governor_waits(monkeypatch):
+    from ethereum_proxy_etl.governor import RPCGovernor
+    from ethereum_proxy_etl.provider import NodeProviderPool
+
+    monkeypatch.setitem(batching.batch_sizers, 'test_rate',
+                        AdaptiveBatchSizer(initial_size=50, max_size=50, target_latency=0.1))
+    governor = RPCGovernor(max_in_flight=32, max_requests_per_second=20, max_elements_per_second=0)
+    pool = NodeProviderPool(['http://node'], batch_observer=batching.record_batch_latency)
+
+    async def batch_requests(method, params, timeout=None):
+        await asyncio.sleep(0.01)
+        return [{'id': idx, 'result': param} for idx, param in enumerate(params)]
+    pool.providers[0].batch_requests = batch_requests
+
+    async def fetch(chunk):
+        responses = await governor.call(len(chunk), lambda: pool.batch_requests('test_rate', chunk))
+        return [response['result'] for response in responses]
+
+    # 30 batches at 20 per second wait up to half a second for the governor
+    res = await run_batched('test_rate', list(range(1500)), fetch)
+    assert res == list(range(1500))
+    assert batching.batch_sizers['test_rate'].size == 50
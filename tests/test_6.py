@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from ethereum_proxy_etl.batching import is_transient_element_error
+from ethereum_proxy_etl.governor import RPCGovernor
+from ethereum_proxy_etl.provider import RPCOverloadError, is_overload_error
+
+
+@pytest.mark.asyncio
+async def test_governor_caps_in_flight():
+    governor = RPCGovernor(max_in_flight=3)
+    in_flight = 0
+    peak = 0
+
+    async def request():
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return True
+
+    res = await asyncio.gather(*[governor.call(1, request) for _ in range(20)])
+    assert all(res)
+    assert peak == 3
+
+
+@pytest.mark.asyncio
+async def test_governor_backs_off_on_overload():
+    governor = RPCGovernor(max_in_flight=8, backoff=0.01)
+    attempts = 0
+
+    async def request():
+        nonlocal attempts
+        attempts += 1
+        if attempts < 3:
+            raise RPCOverloadError('429')
+        return 'ok'
+
+    assert await governor.call(1, request) == 'ok'
+    assert attempts == 3
+    assert governor.in_flight_limit < 8
+    assert governor.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_governor_gives_up_after_retries():
+    governor = RPCGovernor(max_retries=1, backoff=0)
+
+    async def request():
+        raise RPCOverloadError('429')
+
+    with pytest.raises(RPCOverloadError):
+        await governor.call(1, request)
+    assert governor.in_flight == 0
+
+
+def test_result_limit_is_not_overload():
+    rate_limit = {'code': -32005, 'message': 'daily request count exceeded, request rate limited'}
+    result_limit = {'code': -32005, 'message': 'query returned more than 10000 results'}
+    assert is_overload_error(rate_limit)
+    assert not is_overload_error(result_limit)
+    assert not is_transient_element_error(result_limit)
@@ -0,0 +1,124 @@
+import asyncio
+import json
+
+import pytest
+
+from ethereum_proxy_etl import provider as provider_module
+from ethereum_proxy_etl.cache import CacheMissError, ResponseCache
+from ethereum_proxy_etl.governor import RPCGovernor
+from ethereum_proxy_etl.provider import NodeBatchProvider, NodeProviderPool
+
+
+def fake_node(provider, delay, calls):
+    async def batch_requests(method, params, timeout=None):
+        calls.append(provider.endpoint_uri)
+        await asyncio.sleep(delay)
+        return [{'id': idx, 'result': provider.endpoint_uri} for idx, _ in enumerate(params)]
+    provider.batch_requests = batch_requests
+
+
+@pytest.mark.asyncio
+async def test_pool_prefers_faster_node():
+    pool = NodeProviderPool(['http://slow', 'http://fast'], hedge_percentile=0)
+    calls = []
+    fake_node(pool.providers[0], 0.02, calls)
+    fake_node(pool.providers[1], 0.001, calls)
+
+    for _ in range(50):
+        await pool.batch_requests('eth_call', [[]])
+    assert calls.count('http://fast') > calls.count('http://slow')
+
+
+@pytest.mark.asyncio
+async def test_pool_hedges_slow_batches():
+    pool = NodeProviderPool(['http://slow', 'http://fast'], min_hedge_samples=5)
+    pool.latencies['eth_call'].extend([0.001] * 10)
+    slow, fast = pool.providers
+    calls = []
+    fake_node(slow, 1, calls)
+    fake_node(fast, 0.001, calls)
+    pool.pick = lambda exclude=None: fast if exclude is slow else slow
+
+    res = await asyncio.wait_for(pool.batch_requests('eth_call', [[]]), timeout=0.5)
+    assert calls == ['http://slow', 'http://fast']
+    assert res[0]['result'] == 'http://fast'
+
+
+@pytest.mark.asyncio
+async def test_pool_hedge_takes_a_governor_slot():
+    governor = RPCGovernor(max_in_flight=2)
+    pool = NodeProviderPool(['http://slow', 'http://fast'], min_hedge_samples=5, governor=governor)
+    pool.latencies['eth_call'].extend([0.001] * 10)
+    slow, fast = pool.providers
+    in_flight = []
+    fake_node(slow, 1, [])
+
+    async def batch_requests(method, params, timeout=None):
+        in_flight.append(governor.in_flight)
+        return [{'id': idx, 'result': fast.endpoint_uri} for idx, _ in enumerate(params)]
+    fast.batch_requests = batch_requests
+    pool.pick = lambda exclude=None: fast if exclude is slow else slow
+
+    res = await asyncio.wait_for(
+        governor.call(1, lambda: pool.batch_requests('eth_call', [[]])), timeout=0.5)
+    assert res[0]['result'] == 'http://fast'
+    # The primary and the hedge each hold a slot
+    assert in_flight == [2]
+    assert governor.in_flight == 0
+
+
+@pytest.mark.parametrize('use_orjson', [True, False])
+def test_decode_rpc_responses_by_id(monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(provider_module, 'orjson', None)
+    provider = NodeBatchProvider('http://node')
+    first_id = provider.reserve_ids(3)
+    request = json.loads(provider.encode_rpc_requests('eth_call', [[1], [2], [3]], first_id))
+    assert [item['id'] for item in request] == [first_id, first_id + 1, first_id + 2]
+    assert provider.reserve_ids(1) == first_id + 3
+
+    raw = json.dumps([{'id': first_id + 2, 'result': 'c'}, {'id': first_id, 'result': 'a'}]).encode()
+    res = provider.decode_rpc_responses(raw, first_id, 3)
+    assert res[0]['result'] == 'a'
+    assert 'error' in res[1]
+    assert res[2]['result'] == 'c'
+
+
+@pytest.mark.asyncio
+async def test_pool_serves_block_number_requests_from_cache(tmp_path):
+    path = str(tmp_path / 'rpc-cache.sqlite')
+    pool = NodeProviderPool(['http://node'], response_cache=ResponseCache(path, 1 << 20))
+    calls = []
+    fake_node(pool.providers[0], 0, calls)
+
+    params = [['0x1', '0x0', '0x10'], ['0x2', '0x0', 'latest']]
+    await pool.batch_requests('eth_getStorageAt', params)
+    res = await pool.batch_requests('eth_getStorageAt', params)
+    assert len(calls) == 2
+    assert [item['result'] for item in res] == ['http://node', 'http://node']
+
+    replay_pool = NodeProviderPool(['http://node'], response_cache=ResponseCache(path, 1 << 20, replay=True))
+    fake_node(replay_pool.providers[0], 0, calls)
+    res = await replay_pool.batch_requests('eth_getStorageAt', params[:1])
+    assert res[0]['result'] == 'http://node'
+    with pytest.raises(CacheMissError):
+        await replay_pool.batch_requests('eth_getStorageAt', params)
+    assert len(calls) == 2
+
+
+def test_response_cache_keeps_logs_of_block_number_ranges():
+    assert ResponseCache.cacheable([{'fromBlock': '0x1', 'toBlock': '0x2', 'topics': [['0xab']]}])
+    assert not ResponseCache.cacheable([{'fromBlock': '0x1', 'toBlock': 'latest', 'topics': [['0xab']]}])
+
+
+@pytest.mark.asyncio
+async def test_pinned_block_needs_no_request_for_a_block_number(monkeypatch):
+    from ethereum_proxy_etl import detect
+
+    async def get_block_number():
+        return 20
+
+    monkeypatch.setattr(detect, 'get_block_number', get_block_number)
+    assert await detect.pinned_block(10) == 10
+    assert await detect.pinned_block(True) == 20
+    assert await detect.pinned_block(False) == 'latest'
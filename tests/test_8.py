@@ -0,0 +1,90 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from ethereum_proxy_etl import detect
+from ethereum_proxy_etl.cache import (MISSING, BytecodeCache, LRUCache,
+                                      ResponseCache, bytecode_hash)
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is MISSING
+    assert cache.get('a') == 1
+    assert len(cache) == 2
+
+
+def test_bytecode_cache_persists(tmp_path):
+    path = str(tmp_path / 'bytecode.sqlite')
+    cache = BytecodeCache(10, path)
+    cache.set('many_to_one', bytecode_hash('0x01'), '0xffde4785e980a99fe10e6a87a67d243664b91b25')
+    cache.set('many_to_one', bytecode_hash('0x02'), None)
+    cache.flush()
+
+    cache = BytecodeCache(10, path)
+    assert cache.get('many_to_one', bytecode_hash('0x01')) == '0xffde4785e980a99fe10e6a87a67d243664b91b25'
+    assert cache.get('many_to_one', bytecode_hash('0x02')) is None
+    assert cache.get('many_to_one', bytecode_hash('0x03')) is MISSING
+
+
+def test_parse_bytecodes_cached(monkeypatch):
+    monkeypatch.setattr(detect, 'bytecode_cache', BytecodeCache(10))
+    calls = []
+
+    def parse(bytecode):
+        calls.append(bytecode)
+        if bytecode == '0xbad':
+            raise ValueError('Not a proxy')
+        return '0x' + bytecode[2:].rjust(40, '0')
+
+    res = detect.parse_bytecodes_cached('test', parse, ['0x01', '0xbad', '0x01', '0xbad'])
+    assert res == ['0x' + '01'.rjust(40, '0'), None, '0x' + '01'.rjust(40, '0'), None]
+    assert calls == ['0x01', '0xbad']
+
+
+@pytest.mark.asyncio
+async def test_parse_bytecodes_in_process_pool(monkeypatch):
+    monkeypatch.setattr(detect, 'bytecode_cache', BytecodeCache(100))
+    monkeypatch.setattr(detect, 'BYTECODE_OFFLOAD_MIN', 2)
+    monkeypatch.setattr(detect, 'BYTECODE_CHUNK_SIZE', 2)
+    impl = 'f62849f9a0b5bf2913b396098f7c7019b51a820a'
+    clones = [f'0x363d3d373d3d3d363d73{impl[:-2]}{idx:02x}5af43d82803e903d91602b57fd5bf3' for idx in range(5)]
+    bytecodes = clones + ['0x6080', 'not hex', clones[0]]
+
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        monkeypatch.setattr(detect, 'bytecode_executor', executor)
+        res = await detect.parse_bytecodes('eip_1167_minimal', bytecodes)
+
+    assert res == [f'0x{impl[:-2]}{idx:02x}' for idx in range(5)] + [None, None, f'0x{impl[:-2]}00']
+    assert detect.bytecode_cache.get('eip_1167_minimal', bytecode_hash(clones[4])) == f'0x{impl[:-2]}04'
+    assert detect.bytecode_cache.get('eip_1167_minimal', bytecode_hash('0x6080')) is None
+
+
+def test_response_cache_evicts_oldest(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'rpc-cache.sqlite'), max_bytes=1000)
+    keys = [cache.key('eth_call', [{'to': f'0x{idx}', 'data': '0x'}, '0x1']) for idx in range(20)]
+    for key in keys:
+        cache.set_many([(key, '0x' + '0' * 64)])
+
+    assert cache.size <= 1000
+    found = cache.get_many(keys)
+    assert keys[0] not in found
+    assert found[keys[-1]] == '0x' + '0' * 64
+    assert ResponseCache.cacheable(['0x1', '0x0', '0x10'])
+    assert not ResponseCache.cacheable(['0x1', '0x0', 'latest'])
+    assert not ResponseCache.cacheable([])
+
+
+def test_response_cache_size_of_replaced_results(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'rpc-cache.sqlite'), max_bytes=1 << 20)
+    key = cache.key('eth_call', [{'to': '0x1', 'data': '0x'}, '0x1'])
+    for _ in range(3):
+        cache.set_many([(key, '0x' + '0' * 64), (key, '0x' + '0' * 64)])
+
+    assert cache.size == cache._db.execute('SELECT SUM(size) FROM responses').fetchone()[0]
+    assert cache.size == len(key) + len('"0x' + '0' * 64 + '"')
@@ -0,0 +1,145 @@
+import asyncio
+from collections import namedtuple
+
+import pytest
+
+from ethereum_proxy_etl import stream
+from ethereum_proxy_etl.checkpoint import WorkUnit, block_ranges
+from ethereum_proxy_etl.stream import Pipeline
+
+Row = namedtuple('Row', ['key', 'address'])
+
+
+@pytest.mark.asyncio
+async def test_pipeline_overlaps_detect_and_write(monkeypatch, tmp_path):
+    monkeypatch.setattr(stream.dead_letters, 'path', str(tmp_path / 'dead-letter.jsonl'))
+    events = []
+    written = []
+
+    async def handler(batch_id, partition, block):
+        events.append(('detect', batch_id))
+        await asyncio.sleep(0.01)
+        return [[{'proxy_address': row.address} for row in partition]]
+
+    async def write(batches):
+        events.append(('write', batches[0][0]['proxy_address']))
+        await asyncio.sleep(0.01)
+        if batches[0][0]['proxy_address'] == '0x2':
+            raise RuntimeError('write failed')
+        written.extend(batches)
+
+    pipeline = Pipeline(detect_workers=1, write_workers=1, detect_queue_size=1, write_queue_size=1, write=write)
+    pipeline.start()
+    try:
+        for idx in range(4):
+            await pipeline.put(handler, f'batch-{idx}', [Row('key', f'0x{idx}')])
+        await pipeline.join()
+    finally:
+        await pipeline.stop()
+
+    assert [batch[0]['proxy_address'] for batch in written] == ['0x0', '0x1', '0x3']
+    # The second batch is detected while the first one is written
+    assert set(events[1:3]) == {('detect', 'batch-1'), ('write', '0x0')}
+    entries = list(stream.dead_letters.read('batch'))
+    assert [entry['batch_id'] for entry in entries] == ['batch-2']
+    assert entries[0]['addresses'] == ['0x2']
+
+
+def test_block_ranges():
+    assert list(block_ranges(150, 420, 100)) == [(150, 199), (200, 299), (300, 399), (400, 420)]
+    assert list(block_ranges(200, 299, 100)) == [(200, 299)]
+
+
+@pytest.mark.asyncio
+async def test_pipeline_finishes_units(monkeypatch, tmp_path):
+    monkeypatch.setattr(stream.dead_letters, 'path', str(tmp_path / 'dead-letter.jsonl'))
+
+    async def handler(batch_id, partition, block):
+        return [[{'proxy_address': row.address} for row in partition]]
+
+    async def write(batches):
+        if batches[0][0]['proxy_address'] == '0xbad':
+            raise RuntimeError('write failed')
+
+    good = WorkUnit('oz', 0, 99)
+    bad = WorkUnit('oz', 100, 199)
+    pipeline = Pipeline(write=write)
+    pipeline.start()
+    try:
+        await pipeline.put(handler, 'good-0', [Row('key', '0x1')], unit=good)
+        await pipeline.put(handler, 'good-1', [Row('key', '0x2')], unit=good)
+        await pipeline.put(handler, 'bad-0', [Row('key', '0xbad')], unit=bad)
+        await pipeline.join()
+        assert not good.done.is_set()
+        good.finish_fetch()
+        bad.finish_fetch()
+    finally:
+        await pipeline.stop()
+
+    assert good.done.is_set() and not good.failed
+    assert bad.done.is_set() and bad.failed
+
+
+def test_dead_letter_take_keeps_other_kinds(tmp_path):
+    from ethereum_proxy_etl.deadletter import DeadLetterLog
+
+    log = DeadLetterLog(str(tmp_path / 'dead-letter.jsonl'))
+    log.record('batch', batch_id='oz-0', addresses=['0x1'])
+    log.record('history', batch_id='history-oz-0', proxy_type='oz', start_block=0, end_block=99, addresses=['0x2'])
+
+    assert [entry['addresses'] for entry in log.take({'history'})] == [['0x2']]
+    assert [entry['batch_id'] for entry in log.read()] == ['oz-0']
+    assert not log.take({'history'})
+
+
+@pytest.mark.asyncio
+async def test_replay_without_dead_letters(tmp_path, capsys):
+    await stream.replay_dead_letters_async(str(tmp_path / 'dead-letter.jsonl'))
+    assert 'No dead letters to replay' in capsys.readouterr().out
+
+
+class FakeCheckpointEngine:
+    # Serves (marker, start_block, end_block) rows of stream_checkpoints
+    def __init__(self, rows):
+        self.rows = rows
+
+    def connect(self):
+        return self
+
+    def begin(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def run_sync(self, fn, **kwargs):
+        pass
+
+    async def execute(self, statement):
+        return self.rows
+
+
+@pytest.mark.asyncio
+async def test_follow_resumes_from_first_gap(monkeypatch):
+    from ethereum_proxy_etl.checkpoint import Checkpoints, first_gap
+
+    assert first_gap([(0, 99), (200, 299), (100, 199)]) == 300
+    assert first_gap([(0, 99), (200, 299)]) == 100
+
+    async def get_head_block():
+        return 1000
+
+    monkeypatch.setattr(stream, 'get_head_block', get_head_block)
+    # Unit 100-199 failed, so following goes on from it and not after 299
+    checkpoints = Checkpoints(FakeCheckpointEngine([('*', 0, 99), ('*', 200, 299)]))
+    assert await stream.follow_start_block(checkpoints, True, 12) == 100
+    # All markers need a checkpoint, otherwise it starts at the head
+    assert await stream.follow_start_block(checkpoints, False, 12) == 989
+
+    assert stream.follow_end_block(100, 1000, 12, 10000) == 988
+    assert stream.follow_end_block(100, 1000, 12, 50) == 149
+    assert stream.follow_end_block(990, 1000, 12, 50) < 990
+    assert stream.follow_end_block(0, None, 12, 50) < 0